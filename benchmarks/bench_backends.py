@@ -0,0 +1,101 @@
+"""
+Accuracy and speed of the CPU inference backends, per model size.
+
+Runs every backend on the frames of a fixed clip and compares its detections
+with the pytorch backend frame by frame: boxes of the same class with IoU >= 0.5
+are matches. Reports frames per second, recall and precision against pytorch,
+and the mean IoU of matched boxes. Exports happen on first use and are cached
+under weights/exported/. Run from the repo root, weights are loaded from weights/.
+
+usage: python -m benchmarks.bench_backends --video clip.mp4 [--models nano medium] [--backends pytorch onnx onnx-int8 openvino]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import write_synthetic_video
+from video_app.models import BACKENDS, load_model
+from video_app.sharding import box_iou
+
+# conf/iou used by the processing pipeline
+PREDICT_ARGS = dict(conf=0.5, iou=0.5, verbose=False)
+
+
+def read_frames(video, limit):
+    cap = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def run_backend(model_type, backend, frames):
+    model = load_model(model_type, backend)
+    model.predict(frames[0], **PREDICT_ARGS)  # warm-up
+    detections = []
+    start = time.perf_counter()
+    for frame in frames:
+        boxes = model.predict(frame, **PREDICT_ARGS)[0].boxes.data.cpu().numpy()
+        detections.append(boxes)
+    return len(frames) / (time.perf_counter() - start), detections
+
+
+def compare(reference, detections, threshold=0.5):
+    """ matches, reference boxes, detected boxes, mean IoU of matches """
+    matches, total_ref, total_det, ious = 0, 0, 0, []
+    for ref, det in zip(reference, detections):
+        total_ref += len(ref)
+        total_det += len(det)
+        if len(ref) == 0 or len(det) == 0:
+            continue
+        iou = box_iou(ref[:, :4], det[:, :4])
+        iou[ref[:, 5][:, None] != det[:, 5][None, :]] = 0
+        # greedy one-to-one matching, best pairs first
+        for i, j in sorted(zip(*np.nonzero(iou >= threshold)), key=lambda p: -iou[p]):
+            if np.isnan(iou[i, j]):
+                continue
+            matches += 1
+            ious.append(iou[i, j])
+            iou[i, :] = np.nan
+            iou[:, j] = np.nan
+    return matches, total_ref, total_det, float(np.mean(ious)) if ious else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--video', help='fixed local clip, default: synthetic clip')
+    parser.add_argument('--frames', type=int, default=300, help='frames of the clip to use')
+    parser.add_argument('--models', nargs='+', default=['nano'])
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, choices=BACKENDS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = args.video or write_synthetic_video(os.path.join(tmp, 'clip.mp4'), args.frames)
+        frames = read_frames(video, args.frames)
+
+    print(f'{len(frames)} frames of {args.video or "a synthetic clip"}')
+    print(f"{'model':>7} {'backend':>10} {'frames/s':>9} {'speedup':>8} {'recall':>7} {'precision':>10} {'mean IoU':>9}")
+    for model_type in args.models:
+        base_fps, reference = run_backend(model_type, 'pytorch', frames)
+        for backend in args.backends:
+            if backend == 'pytorch':
+                fps, detections = base_fps, reference
+            else:
+                fps, detections = run_backend(model_type, backend, frames)
+            matches, total_ref, total_det, mean_iou = compare(reference, detections)
+            recall = matches / total_ref if total_ref else float('nan')
+            precision = matches / total_det if total_det else float('nan')
+            print(f'{model_type:>7} {backend:>10} {fps:>9.1f} {fps / base_fps:>7.2f}x '
+                  f'{recall:>7.3f} {precision:>10.3f} {mean_iou:>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
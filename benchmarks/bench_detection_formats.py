@@ -0,0 +1,67 @@
+"""
+Size on disk and load time into pandas of the per-frame detections table per format.
+
+Builds the table from a synthetic result stream with detections_to_df, writes it
+with write_detections in every format, then times pd.read_* of each file and the
+chunked csv conversion of the download. Loaded tables are checked against the original.
+
+usage: python -m benchmarks.bench_detection_formats [--frames 18000] [--objects 20 100]
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_boxes
+from video_app.downloads import detections_as_csv
+from video_app.utils import DetectionStore, DETECTION_DTYPES, DETECTION_FORMATS, detections_to_df, write_detections
+
+READERS = {'parquet': pd.read_parquet, 'feather': pd.read_feather, 'csv': pd.read_csv}
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--frames', type=int, default=18000, help='10 minutes at 30 fps')
+    parser.add_argument('--objects', type=int, nargs='+', default=[20, 100])
+    args = parser.parse_args()
+
+    print(f'{"rows":>10} {"format":>8} {"MB":>7} {"write s":>8} {"read s":>7} {"as csv s":>9}')
+    for objects in args.objects:
+        detections = DetectionStore()
+        for frame, boxes in enumerate(synthetic_boxes(args.frames, objects), start=1):
+            detections.append(boxes, frame)
+        df = detections_to_df(detections, 30.0)
+        expected = df.astype(DETECTION_DTYPES)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for format, extension in DETECTION_FORMATS.items():
+                path = os.path.join(tmp, 'detections' + extension)
+                _, write_seconds = timed(write_detections, df, path)
+                loaded, read_seconds = timed(READERS[format], path)
+                # csv doesn't keep dtypes, compare values only
+                np.testing.assert_allclose(loaded.to_numpy(dtype=np.float64),
+                                           expected.to_numpy(dtype=np.float64), rtol=1e-6)
+                as_csv = ''
+                if format != 'csv':
+                    body, csv_seconds = timed(lambda: b''.join(detections_as_csv(path)))
+                    converted = pd.read_csv(io.BytesIO(body))
+                    assert list(converted.columns) == list(expected.columns)
+                    np.testing.assert_allclose(converted.to_numpy(dtype=np.float64),
+                                               expected.to_numpy(dtype=np.float64), rtol=1e-6)
+                    as_csv = f'{csv_seconds:.2f}'
+                print(f'{len(df):>10} {format:>8} {os.path.getsize(path) / 2**20:>7.1f} '
+                      f'{write_seconds:>8.2f} {read_seconds:>7.2f} {as_csv:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the columnar `get_df` with the previous per-detection implementation.
+
+The legacy path is reproduced here verbatim (minus the prints) so the two can be
+timed on the same synthetic result stream and checked for identical output.
+
+usage: python -m benchmarks.bench_get_df [--frames 1800] [--objects 5 50 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import FakeResults, synthetic_boxes, write_synthetic_video
+from video_app.utils import DetectionStore, get_df, get_frame_rate
+
+
+def legacy_get_df(list_results, VIDEO):
+    """ get_df before the columnar builder: appends scalars per detection """
+    xmin, ymin, xmax, ymax = [], [], [], []
+    track_id, confidence, class_id, frame_num, timestamps = [], [], [], [], []
+    frame = 0
+    fps = get_frame_rate(VIDEO)
+    for frame_result in list_results:
+        frame += 1
+        for i in range(len(frame_result.boxes.data.numpy()[:])):
+            if frame_result.boxes.data.numpy()[:][i].size == 7:
+                xmin.append(frame_result.boxes.data.numpy()[:][i][0])
+                ymin.append(frame_result.boxes.data.numpy()[:][i][1])
+                xmax.append(frame_result.boxes.data.numpy()[:][i][2])
+                ymax.append(frame_result.boxes.data.numpy()[:][i][3])
+                track_id.append(frame_result.boxes.data.numpy()[:][i][4])
+                confidence.append(frame_result.boxes.data.numpy()[:][i][5])
+                class_id.append(frame_result.boxes.data.numpy()[:][i][6])
+                frame_num.append(frame)
+                timestamps.append(frame / fps)
+    data = {'frame_num': frame_num, 'timestamp': timestamps,
+            'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax,
+            'track_id': track_id, 'confidence': confidence, 'class_id': class_id}
+    return pd.DataFrame(data=data)
+
+
+def best_of(repeats, fn, *args):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--frames', type=int, default=1800)
+    parser.add_argument('--objects', type=int, nargs='+', default=[5, 50, 200],
+                        help='detections per frame')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = write_synthetic_video(os.path.join(tmp, 'clip.mp4'), 30)
+        print(f"{'detections':>12} {'legacy (s)':>12} {'columnar (s)':>14} {'speedup':>9}")
+        for objects in args.objects:
+            blocks = list(synthetic_boxes(args.frames, objects))
+            results = [FakeResults(block, None) for block in blocks]
+            store = DetectionStore()
+            for block in blocks:
+                store.append(block)
+
+            legacy_time, legacy_df = best_of(
+                args.repeats, legacy_get_df, results, video)
+            new_time, new_df = best_of(args.repeats, get_df, store, video)
+            pd.testing.assert_frame_equal(legacy_df, new_df)
+
+            print(f"{len(new_df):>12} {legacy_time:>12.3f} {new_time:>14.4f} {legacy_time / new_time:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Detection queries through DetectionIndex vs scanning the DataFrame per query.
+
+Builds a long synthetic detections table, then runs random queries (time range,
+class, track, region of interest and combinations). Every indexed answer is
+checked against the scan, which is how the table would be filtered without an index.
+
+usage: python -m benchmarks.bench_query [--frames 108000] [--objects 20] [--queries 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import synthetic_boxes
+from video_app.query import DetectionIndex
+from video_app.utils import DetectionStore, DETECTION_DTYPES, detections_to_df
+
+LABELS = {i: f'class_{i}' for i in range(80)}
+
+
+def scan(df, start, end, classes, tracks, roi):
+    """ the query as a full DataFrame filter """
+    mask = np.ones(len(df), dtype=bool)
+    if start is not None:
+        mask &= df['timestamp'].to_numpy() >= start
+    if end is not None:
+        mask &= df['timestamp'].to_numpy() <= end
+    if classes:
+        mask &= df['class_id'].isin(classes).to_numpy()
+    if tracks:
+        mask &= df['track_id'].isin(tracks).to_numpy()
+    if roi:
+        cx = ((df['xmin'] + df['xmax']) / 2).to_numpy()
+        cy = ((df['ymin'] + df['ymax']) / 2).to_numpy()
+        mask &= (cx >= roi[0]) & (cx <= roi[2]) & (cy >= roi[1]) & (cy <= roi[3])
+    return df[mask]
+
+
+def random_queries(df, count, seed=0):
+    rng = np.random.default_rng(seed)
+    duration = float(df['timestamp'].max())
+    classes = np.unique(df['class_id'].to_numpy()).astype(int)
+    tracks = np.unique(df['track_id'].to_numpy()).astype(int)
+    kinds = [('time',), ('class', 'time'), ('track',), ('roi', 'time'), ('class', 'roi', 'time')]
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        start = end = cls = trk = roi = None
+        if 'time' in kind:
+            start = rng.uniform(0, duration)
+            end = start + rng.uniform(10, 120)
+        if 'class' in kind:
+            cls = [int(rng.choice(classes))]
+        if 'track' in kind:
+            trk = [int(t) for t in rng.choice(tracks, 3)]
+        if 'roi' in kind:
+            x0, y0 = rng.uniform(0, 1500), rng.uniform(0, 800)
+            roi = [int(x0), int(y0), int(x0 + 400), int(y0 + 250)]
+        yield kind, (start, end, cls, trk, roi)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--frames', type=int, default=108000, help='1 hour at 30 fps')
+    parser.add_argument('--objects', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    detections = DetectionStore()
+    for frame, boxes in enumerate(synthetic_boxes(args.frames, args.objects), start=1):
+        detections.append(boxes, frame)
+    # typed as in the index, so both answer on the same values
+    df = detections_to_df(detections, 30.0).astype({**DETECTION_DTYPES, 'timestamp': 'float64'})
+
+    start = time.perf_counter()
+    index = DetectionIndex.build(df, LABELS)
+    build = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp:
+        path = index.save(os.path.join(tmp, 'index.npz'))
+        size = os.path.getsize(path) / 2**20
+        start = time.perf_counter()
+        index = DetectionIndex.load(path)
+        load = time.perf_counter() - start
+    print(f'{len(df)} detections: index built in {build:.2f} s, {size:.0f} MB, loaded in {load:.2f} s')
+
+    timings = {}
+    for kind, (start_s, end_s, cls, trk, roi) in random_queries(df, args.queries):
+        t0 = time.perf_counter()
+        expected = scan(df, start_s, end_s, cls, trk, roi)
+        expected.head(100).to_dict('records')  # the page, as the index returns it
+        t1 = time.perf_counter()
+        total, page = index.query(start_s, end_s, cls, trk, roi, offset=0, limit=100)
+        t2 = time.perf_counter()
+        assert total == len(expected), (kind, total, len(expected))
+        assert [d['frame_num'] for d in page] == expected.sort_values('timestamp', kind='stable')['frame_num'].tolist()[:100]
+        scan_times, index_times = timings.setdefault('+'.join(kind), ([], []))
+        scan_times.append(t1 - t0)
+        index_times.append(t2 - t1)
+
+    print(f'{"query":>16} {"scan ms":>8} {"index ms":>9} {"speedup":>8}')
+    for kind, (scan_times, index_times) in timings.items():
+        s, i = np.median(scan_times) * 1000, np.median(index_times) * 1000
+        print(f'{kind:>16} {s:>8.2f} {i:>9.3f} {s / i:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
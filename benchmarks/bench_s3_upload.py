@@ -0,0 +1,116 @@
+"""
+Wall time of S3 uploads versus the number of thumbnails, against the local S3 stand-in.
+
+Compares the old approach (a new boto3 client per file, files one after another)
+with S3Uploader (one pooled client, a bounded thread pool), and a large file
+uploaded in one request versus in parallel multipart chunks.
+Every upload is checked to have arrived intact. `--latency` simulates the
+round trip to S3; `--fail-rate` exercises the retries.
+
+usage: python -m benchmarks.bench_s3_upload [--thumbnails 10 50 200] [--latency 0.03] [--workers 8]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import boto3
+import numpy as np
+import cv2
+
+from benchmarks.local_s3 import LocalS3
+from video_app.s3 import S3Uploader, object_name_for
+
+BUCKET = 'eyespy-bench'
+
+
+def write_thumbnails(folder, count, seed=0):
+    """
+    Writes `count` noisy 320x240 JPEGs, about the size of the app's thumbnails
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        image = cv2.GaussianBlur(rng.integers(0, 255, (240, 320, 3), dtype=np.uint8), (5, 5), 0)
+        path = os.path.join(folder, f'detection{i}_car.jpg')
+        cv2.imwrite(path, image)
+        paths.append(path)
+    return paths
+
+
+def upload_legacy(paths, endpoint_url):
+    # the old utils.upload_to_s3: a new client for every file, sequentially
+    for path in paths:
+        client = boto3.client('s3', endpoint_url=endpoint_url)
+        client.upload_file(path, BUCKET, object_name_for(path))
+
+
+def check_uploaded(s3, paths):
+    for path in paths:
+        with open(path, 'rb') as f:
+            assert s3.objects[(BUCKET, object_name_for(path))] == f.read(), path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--thumbnails', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--latency', type=float, default=0.03,
+                        help='simulated seconds per S3 request')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--large-mb', type=int, default=64)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    with LocalS3(latency=args.latency, fail_rate=args.fail_rate) as s3, \
+            tempfile.TemporaryDirectory() as tmp:
+        print(f'S3 stand-in at {s3.url}, {args.latency * 1000:.0f} ms per request, '
+              f'fail rate {args.fail_rate}')
+        print(f'{"thumbnails":>10} {"legacy s":>9} {"pooled s":>9} {"speedup":>8} {"retried":>8} {"failed":>7}')
+        for count in args.thumbnails:
+            folder = os.path.join(tmp, str(count))
+            os.makedirs(folder)
+            paths = write_thumbnails(folder, count)
+
+            legacy = None
+            if args.fail_rate == 0:  # the legacy path has no retries of its own
+                start = time.perf_counter()
+                upload_legacy(paths, s3.url)
+                legacy = time.perf_counter() - start
+                check_uploaded(s3, paths)
+                s3.objects.clear()
+
+            uploader = S3Uploader(BUCKET, s3.url, max_workers=args.workers, backoff=0.05)
+            start = time.perf_counter()
+            report = uploader.upload_many(paths)
+            pooled = time.perf_counter() - start
+            if not report['failed']:
+                check_uploaded(s3, paths)
+            s3.objects.clear()
+
+            legacy_text = f'{legacy:9.2f}' if legacy is not None else f'{"-":>9}'
+            speedup = f'{legacy / pooled:7.1f}x' if legacy is not None else f'{"-":>8}'
+            print(f'{count:>10} {legacy_text} {pooled:9.2f} {speedup} '
+                  f'{report["retried"]:>8} {report["failed"]:>7}')
+
+        # one large file: single PUT vs parallel multipart parts
+        large = os.path.join(tmp, 'large.csv')
+        with open(large, 'wb') as f:
+            f.write(os.urandom(args.large_mb * 1024 * 1024))
+        print(f'\n{args.large_mb} MB file')
+        for label, threshold_mb in [('single request', args.large_mb + 1), ('multipart 8 MB', 8)]:
+            uploader = S3Uploader(BUCKET, s3.url, multipart_threshold_mb=threshold_mb, backoff=0.05)
+            start = time.perf_counter()
+            outcome = uploader.upload(large)
+            seconds = time.perf_counter() - start
+            assert outcome['ok'], outcome['error']
+            check_uploaded(s3, [large])
+            print(f'{label:>15}: {seconds:.2f} s ({args.large_mb / seconds:.0f} MB/s)')
+            s3.objects.clear()
+
+
+if __name__ == '__main__':
+    main()
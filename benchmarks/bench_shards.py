@@ -0,0 +1,54 @@
+"""
+Throughput of sharded processing with 1, 2, 4 and 8 shards.
+
+Each run processes the same clip with `process_video_sharded` (1 shard is a
+single process with the same code path) and reports frames per second,
+speedup over 1 shard, and the number of stitched tracks, which should stay
+close across shard counts if stitching holds tracks together.
+Run from the repo root, model weights are loaded from weights/.
+
+usage: python -m benchmarks.bench_shards [--video clip.mp4] [--model nano] [--shards 1 2 4 8]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_video
+from video_app.models import load_model
+from video_app.sharding import get_frame_count, process_video_sharded
+from video_app.utils import Detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--video', help='clip to process, default: synthetic 1280x720 clip')
+    parser.add_argument('--frames', type=int, default=1800,
+                        help='length of the synthetic clip')
+    parser.add_argument('--model', default='nano')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--stride', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = args.video or write_synthetic_video(os.path.join(tmp, 'clip.mp4'), args.frames,
+                                                    width=1280, height=720)
+        total_frames = get_frame_count(video)
+        model = load_model(args.model)
+        classes = list(range(len(model.names)))
+
+        print(f'{total_frames} frames, model {args.model}, {os.cpu_count()} CPUs')
+        print(f"{'shards':>6} {'seconds':>9} {'frames/s':>9} {'speedup':>8} {'tracks':>7}")
+        baseline = None
+        for shards in args.shards:
+            detections = Detections()
+            start = time.perf_counter()
+            process_video_sharded(detections, args.model, video, classes, shards, args.stride)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f'{shards:>6} {elapsed:>9.1f} {total_frames / elapsed:>9.1f} '
+                  f'{baseline / elapsed:>7.2f}x {len(detections.track_ids):>7}')
+
+
+if __name__ == '__main__':
+    main()
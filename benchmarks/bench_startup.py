@@ -0,0 +1,119 @@
+"""
+Startup time and memory per worker, with the heavy modules imported lazily or preloaded.
+
+Each mode starts a fresh process, like a gunicorn --preload master: it times
+`import video_app` and `create_app`, then forks --workers workers, each importing
+what a processing job needs (lazy.preload). While they are all alive, the memory of every
+worker is read from /proc/<pid>/smaps_rollup: private (USS, what the worker costs)
+and shared with the master (copy-on-write pages of the preloaded modules).
+
+  lazy     -- PRELOAD_MODULES=False: fast startup, every worker imports its own ML stack
+  preload  -- PRELOAD_MODULES=True: the master imports it once, the workers share it
+
+usage: python -m benchmarks.bench_startup [--workers 4] [--models nano]
+--models are preloaded too in both modes (needs weights/ in the working directory).
+Linux only.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+MODES = ['lazy', 'preload']
+
+
+def smaps_mb(pid):
+    # Private and shared memory of a process, in MB
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0])
+    return {'private_mb': round((fields['Private_Clean'] + fields['Private_Dirty']) / 1024, 1),
+            'shared_mb': round((fields['Shared_Clean'] + fields['Shared_Dirty']) / 1024, 1),
+            'rss_mb': round(fields['Rss'] / 1024, 1)}
+
+
+def worker(ready, go):
+    # Forked worker: imports what its first job would, reports, then waits to be measured
+    from video_app.lazy import preload
+    started = time.perf_counter()
+    preload()
+    os.write(ready, json.dumps({'first_job_import_seconds': round(time.perf_counter() - started, 3)}).encode())
+    os.read(go, 1)
+    os._exit(0)
+
+
+def mode_main(workers):
+    # Entry point of a mode subprocess: prints its result as JSON
+    started = time.perf_counter()
+    import video_app
+    imported = time.perf_counter()
+    video_app.create_app('production')
+    ready_at = time.perf_counter()
+    result = {'import_seconds': round(imported - started, 3),
+              'startup_seconds': round(ready_at - started, 3),
+              'master': smaps_mb(os.getpid()),
+              'master_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+              'workers': []}
+
+    children = []
+    go_read, go_write = os.pipe()
+    for _ in range(workers):
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            os.close(go_write)
+            worker(ready_write, go_read)
+        os.close(ready_write)
+        children.append((pid, ready_read))
+    for pid, ready_read in children:
+        report = json.loads(os.read(ready_read, 4096))
+        result['workers'].append(dict(report, **smaps_mb(pid)))
+    os.close(go_write)  # the workers exit
+    for pid, _ in children:
+        os.waitpid(pid, 0)
+    print(json.dumps(result))
+
+
+def run_mode(mode, workers, models):
+    env = dict(os.environ, PRELOAD_MODULES=str(mode == 'preload'), PRELOAD_MODELS=models)
+    done = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--mode', mode,
+                           '--workers', str(workers)], capture_output=True, text=True, env=env)
+    if done.returncode != 0:
+        print(done.stderr[-2000:], file=sys.stderr)
+        raise SystemExit(f'{mode} failed')
+    return json.loads(done.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--models', default='', help='PRELOAD_MODELS, e.g. nano')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        mode_main(args.workers)
+        return
+
+    print(f'{"mode":<8} {"import s":>9} {"startup s":>10} {"master MB":>10} '
+          f'{"worker import s":>16} {"worker private MB":>18} {"worker shared MB":>17} {"total MB":>9}')
+    for mode in MODES:
+        result = run_mode(mode, args.workers, args.models)
+        workers = result['workers']
+        mean = lambda key: sum(w[key] for w in workers) / len(workers)  # noqa: E731
+        # what the master and its workers cost together: shared pages are counted once
+        total = result['master']['rss_mb'] + sum(w['private_mb'] for w in workers)
+        print(f'{mode:<8} {result["import_seconds"]:>9.2f} {result["startup_seconds"]:>10.2f} '
+              f'{result["master"]["rss_mb"]:>10.0f} {mean("first_job_import_seconds"):>16.2f} '
+              f'{mean("private_mb"):>18.0f} {mean("shared_mb"):>17.0f} {total:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+End-to-end check of live stream mode against the local RTSP stand-in.
+
+Serves a synthetic video over RTSP (see local_rtsp.py), and processes it with a
+StreamProcessor whose model is deliberately slower than the stream's frame rate,
+reading through the same OpenCV/FFmpeg capture as a real camera.
+Inference can't keep up, so frames must be dropped rather than queued:
+latency and memory must stay flat while the stream runs.
+
+Fails (exit status 1) if no frame was dropped, if the latency exceeds --max-latency,
+or if RSS in the last third of the run grew by more than --max-growth-mb over the first third.
+
+usage: python -m benchmarks.bench_stream [--seconds 20] [--inference-ms 100] [--fps 30]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.local_rtsp import LocalRTSP
+from benchmarks.synthetic import FakeModel, write_synthetic_video
+from video_app.lazy import preload
+from video_app.streams import StreamProcessor
+
+
+class SlowModel(FakeModel):
+    """
+    FakeModel taking `seconds` per frame, like a model too slow for the stream
+    """
+
+    def __init__(self, seconds, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.seconds = seconds
+
+    def predict(self, image, **kwargs):
+        time.sleep(self.seconds)
+        return super().predict(image, **kwargs)
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=20, help='how long the stream runs')
+    parser.add_argument('--inference-ms', type=float, default=100, help='time the model takes per frame')
+    parser.add_argument('--fps', type=float, default=30, help='frame rate of the stream')
+    parser.add_argument('--max-latency', type=float, default=1.0,
+                        help='fail if a frame waits longer than this many seconds for inference')
+    parser.add_argument('--max-growth-mb', type=float, default=20,
+                        help='fail if RSS grows by more than this while the stream runs')
+    args = parser.parse_args()
+
+    preload()  # the ML stack, imported on first use otherwise: not growth of the stream's memory
+    with tempfile.TemporaryDirectory() as tmp:
+        video = write_synthetic_video(os.path.join(tmp, 'stream.mp4'), 300, objects_per_frame=5,
+                                      width=640, height=360, fps=args.fps)
+        model = SlowModel(args.inference_ms / 1000, 10 ** 6, objects_per_frame=5, width=640, height=360)
+        with LocalRTSP(video, fps=args.fps) as rtsp:
+            processor = StreamProcessor('bench', rtsp.url, 'fake', list(range(9)),
+                                        os.path.join(tmp, 'out'), model=model)
+            processor.start()
+            samples = []  # (seconds, rss MB, latency)
+            started = time.monotonic()
+            while time.monotonic() - started < args.seconds and processor.status['state'] in ('starting', 'running'):
+                time.sleep(0.5)
+                samples.append((time.monotonic() - started, rss_mb(), processor.status['latency']))
+            processor.stop()
+            while processor.status['state'] == 'running':
+                time.sleep(0.1)
+            status = processor.status
+            sent = rtsp.frames_sent
+
+    if status['state'] == 'failed':
+        sys.exit(f'FAIL: the stream failed: {status["error"]}')
+    third = max(1, len(samples) // 3)
+    first = sum(rss for _, rss, _ in samples[:third]) / third
+    last = sum(rss for _, rss, _ in samples[-third:]) / third
+    latency = max(latency for _, _, latency in samples[third:]) if len(samples) > third else 0
+
+    print(f'stream: {sent} frames sent at {args.fps:g} fps, inference {args.inference_ms:g} ms/frame')
+    print(f'frames read {status["frames_read"]}, processed {status["frames_processed"]} '
+          f'({status["inference_fps"]} fps), dropped {status["frames_dropped"]}')
+    print(f'max latency {latency:.3f}s, RSS {first:.0f} MB -> {last:.0f} MB, '
+          f'{status["detections"]} detections, {status["tracks_ended"]} tracks ended')
+
+    failures = []
+    if status['frames_dropped'] == 0:
+        failures.append('no frame was dropped, although inference is slower than the stream')
+    if latency > args.max_latency:
+        failures.append(f'latency {latency:.3f}s exceeds {args.max_latency}s: frames are queueing')
+    if last - first > args.max_growth_mb:
+        failures.append(f'RSS grew by {last - first:.0f} MB while the stream ran')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Memory regression check for the streaming Detections pipeline.
+
+Runs `Detections.process_video` on a short and a long synthetic 1080p video
+and compares the peak traced memory. Peak memory must stay roughly flat with
+video length, since every frame image is dropped as soon as its boxes are read
+(a few frames are decoded ahead, a fixed amount).
+
+usage: python -m benchmarks.bench_streaming_memory [--frames 300] [--scale 10]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import FakeModel, write_synthetic_video
+from video_app.lazy import preload
+from video_app.utils import Detections
+
+
+def peak_memory_mb(num_frames, video):
+    model = FakeModel(num_frames)
+    detections = Detections()
+    preload()  # the lazily imported modules, else the first run traces their import
+    tracemalloc.start()
+    start = time.perf_counter()
+    detections.process_video(model, video, CLASSES=list(range(9)))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024), elapsed, len(detections.df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--frames', type=int, default=300,
+                        help='frames in the short run')
+    parser.add_argument('--scale', type=int, default=10,
+                        help='the long run has frames * scale frames')
+    parser.add_argument('--max-growth', type=float, default=2.0,
+                        help='fail if long/short peak memory exceeds this ratio')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # the frames are decoded, the detections come from FakeModel
+        short_peak, short_time, short_rows = peak_memory_mb(args.frames, write_synthetic_video(
+            os.path.join(tmp, 'short.mp4'), args.frames, width=1920, height=1080))
+        long_peak, long_time, long_rows = peak_memory_mb(args.frames * args.scale, write_synthetic_video(
+            os.path.join(tmp, 'long.mp4'), args.frames * args.scale, width=1920, height=1080))
+
+    print(f'{args.frames:>8} frames: peak {short_peak:8.1f} MB, {short_rows} detections, {short_time:.2f}s')
+    print(f'{args.frames * args.scale:>8} frames: peak {long_peak:8.1f} MB, {long_rows} detections, {long_time:.2f}s')
+    growth = long_peak / short_peak
+    print(f'peak memory growth: {growth:.2f}x for {args.scale}x the frames')
+    if growth > args.max_growth:
+        print('FAIL: peak memory grows with video length')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
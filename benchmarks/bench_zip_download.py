@@ -0,0 +1,89 @@
+"""
+Memory and time to first byte of the thumbnail ZIP download, in-memory vs streamed.
+
+The old download_images built the whole archive in a BytesIO before sending it;
+image_archive yields it as it's written. Both archives are read back and checked
+to hold the same files. Peak memory is measured with tracemalloc.
+
+usage: python -m benchmarks.bench_zip_download [--images 100 1000 3000] [--kb 150]
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from video_app.downloads import image_archive, select_images
+
+
+def write_images(folder, count, kb):
+    # incompressible bytes, like JPEGs
+    names = []
+    for i in range(count):
+        name = f'detection{i + 1}_{"person" if i % 3 else "car"}.jpg'
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(os.urandom(kb * 1024))
+        names.append(name)
+    return names
+
+
+def legacy_zip(folder, names):
+    in_memory_zip = io.BytesIO()
+    with zipfile.ZipFile(in_memory_zip, 'w') as zf:
+        for name in names:
+            zf.write(os.path.join(folder, name), arcname=name)
+    in_memory_zip.seek(0)
+    yield in_memory_zip.getvalue()
+
+
+def measure(chunks, out):
+    """
+    Consumes a response body like a WSGI server, writing it to `out`.
+    Returns (seconds to first byte, total seconds, peak traced MB)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    first_byte = None
+    for chunk in chunks:
+        if chunk and first_byte is None:
+            first_byte = time.perf_counter() - start
+        out.write(chunk)
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return first_byte, total, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--images', type=int, nargs='+', default=[100, 1000, 3000])
+    parser.add_argument('--kb', type=int, default=150, help='size of each image')
+    args = parser.parse_args()
+
+    print(f'{"images":>7} {"archive MB":>11} {"":>9} {"first byte s":>13} {"total s":>8} {"peak MB":>8}')
+    for count in args.images:
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = os.path.join(tmp, 'images')
+            os.makedirs(folder)
+            names = write_images(folder, count, args.kb)
+            contents = {}
+            for label, chunks in [('in-memory', legacy_zip(folder, names)),
+                                  ('streamed', image_archive(folder, names))]:
+                path = os.path.join(tmp, f'{label}.zip')
+                with open(path, 'wb') as out:
+                    first_byte, total, peak = measure(chunks, out)
+                with zipfile.ZipFile(path) as zf:
+                    assert zf.testzip() is None
+                    contents[label] = sorted((i.filename, i.file_size) for i in zf.infolist())
+                size = os.path.getsize(path) / 2**20
+                print(f'{count:>7} {size:>11.0f} {label:>9} {first_byte:>13.3f} {total:>8.2f} {peak:>8.1f}')
+            assert contents['in-memory'] == contents['streamed']
+
+            selected = select_images(names, labels=['car'], track_range=(1, count // 2))
+            assert all('_car' in name for name in selected)
+
+
+if __name__ == '__main__':
+    main()
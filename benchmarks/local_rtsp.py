@@ -0,0 +1,246 @@
+"""
+Local RTSP stand-in for testing live stream mode without a camera.
+
+Serves a video file as a live RTSP source, looping, at its own frame rate:
+frames are sent on the wall clock whether or not the client keeps up, like a camera.
+Video goes as RTP/JPEG (RFC 2435) interleaved in the RTSP connection (RTP over TCP),
+so the app reads it through the same OpenCV/FFmpeg capture path as a real camera.
+Only that transport is offered: SETUPs asking for UDP get 461 (OpenCV asks for TCP).
+The first --max-frames frames of the video are encoded once at startup: OpenCV holds
+a global lock while a capture opens, so the stand-in can't decode while the app connects.
+
+Point a stream at rtsp://127.0.0.1:8554/live (any path). bench_stream.py runs the app's StreamProcessor on it.
+
+usage: python -m benchmarks.local_rtsp VIDEO [--port 8554] [--fps 30] [--quality 80] [--max-frames 300]
+"""
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+import argparse
+import itertools
+import random
+import struct
+import threading
+import time
+
+import cv2
+
+# RTP payload per packet, below a typical MTU as a camera would send it
+MAX_PAYLOAD = 1400
+# RTP clock rate of video
+CLOCK_RATE = 90000
+JPEG_PAYLOAD_TYPE = 26
+
+
+def parse_jpeg(data):
+    """
+    Splits a baseline JPEG into what RTP/JPEG sends: (type, width, height, quantization tables, scan data).
+    type is 0 for 4:2:2 and 1 for 4:2:0 chroma subsampling
+    """
+    tables = {}
+    position = 2  # after SOI
+    while position < len(data):
+        marker = data[position + 1]
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        segment = data[position + 4:position + 2 + length]
+        if marker == 0xDB:  # DQT, 8-bit tables
+            offset = 0
+            while offset < len(segment):
+                tables[segment[offset] & 0x0F] = segment[offset + 1:offset + 65]
+                offset += 65
+        elif marker == 0xC0:  # SOF0
+            height, width = struct.unpack('>HH', segment[1:5])
+            sampling = segment[7]  # of the first component, luma
+        elif marker == 0xDA:  # SOS: the entropy-coded data follows, up to EOI
+            return (1 if sampling == 0x22 else 0, width, height,
+                    tables[0] + tables[1], data[position + 2 + length:-2])
+        position += 2 + length
+    raise ValueError('Not a baseline JPEG')
+
+
+def rtp_jpeg_packets(jpeg, sequence, timestamp, ssrc):
+    """
+    RTP packets of one JPEG frame, quantization tables inline (Q=255) in the first one.
+    Returns (packets, next sequence number)
+    """
+    kind, width, height, tables, scan = parse_jpeg(jpeg)
+    packets = []
+    offset = 0
+    while offset < len(scan):
+        header = struct.pack('>B3sBBBB', 0, offset.to_bytes(3, 'big'), kind, 255, width // 8, height // 8)
+        if offset == 0:
+            header += struct.pack('>BBH', 0, 0, len(tables)) + tables
+        chunk = scan[offset:offset + MAX_PAYLOAD - len(header)]
+        offset += len(chunk)
+        marker = 0x80 if offset >= len(scan) else 0  # last packet of the frame
+        packets.append(struct.pack('>BBHII', 0x80, marker | JPEG_PAYLOAD_TYPE, sequence & 0xFFFF,
+                                   timestamp & 0xFFFFFFFF, ssrc) + header + chunk)
+        sequence += 1
+    return packets, sequence
+
+
+class LocalRTSP:
+    """
+    RTSP stand-in served from a background thread, each client gets the video from its start
+    """
+
+    def __init__(self, video, host='127.0.0.1', port=0, fps=None, quality=80, max_frames=300):
+        cap = cv2.VideoCapture(video)
+        if not cap.isOpened():
+            raise ValueError(f'Unable to open video file: {video}')
+        self.fps = fps or cap.get(cv2.CAP_PROP_FPS) or 30
+        self.jpegs = []
+        while len(self.jpegs) < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            # RTP/JPEG sizes are in multiples of 8 pixels, up to 2040
+            height, width = frame.shape[:2]
+            frame = frame[:min(height // 8 * 8, 2040), :min(width // 8 * 8, 2040)]
+            self.jpegs.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+        cap.release()
+        if not self.jpegs:
+            raise ValueError(f'No frames in video file: {video}')
+        self.frames_sent = 0
+        self.server = ThreadingTCPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'rtsp://{host}:{port}/live'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        rtsp = self
+
+        class Handler(StreamRequestHandler):
+
+            def setup(self):
+                super().setup()
+                self.lock = threading.Lock()  # the sender thread writes to the same connection
+                self.playing = threading.Event()
+                self.closed = threading.Event()
+                self.session = f'{random.getrandbits(32):08x}'
+
+            def _reply(self, cseq, status='200 OK', headers=None, body=b''):
+                lines = [f'RTSP/1.0 {status}', f'CSeq: {cseq}']
+                lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+                if body:
+                    lines.append(f'Content-Length: {len(body)}')
+                with self.lock:
+                    self.wfile.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+
+            def _request(self):
+                # the next RTSP request: (method, url, headers), skipping interleaved RTCP from the client
+                while True:
+                    first = self.rfile.read(1)
+                    if not first:
+                        return None
+                    if first == b'$':
+                        _, length = struct.unpack('>BH', self.rfile.read(3))
+                        self.rfile.read(length)
+                        continue
+                    line = (first + self.rfile.readline()).decode().strip()
+                    if line:
+                        break
+                method, url, _ = line.split(' ', 2)
+                headers = {}
+                for header in iter(self.rfile.readline, b'\r\n'):
+                    if not header:
+                        return None
+                    name, _, value = header.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                self.rfile.read(int(headers.get('content-length', 0)))
+                return method, url, headers
+
+            def handle(self):
+                try:
+                    while not self.closed.is_set():
+                        request = self._request()
+                        if request is None:
+                            break
+                        method, url, headers = request
+                        cseq = headers.get('cseq', '0')
+                        if method == 'DESCRIBE':
+                            sdp = (f'v=0\r\no=- 0 0 IN IP4 127.0.0.1\r\ns=eyespy stand-in\r\n'
+                                   f'c=IN IP4 0.0.0.0\r\nt=0 0\r\nm=video 0 RTP/AVP {JPEG_PAYLOAD_TYPE}\r\n'
+                                   f'a=framerate:{rtsp.fps:g}\r\na=control:track0\r\n').encode()
+                            self._reply(cseq, headers={'Content-Type': 'application/sdp',
+                                                       'Content-Base': url.rstrip('/') + '/'}, body=sdp)
+                        elif method == 'SETUP':
+                            if 'TCP' not in headers.get('transport', ''):
+                                self._reply(cseq, '461 Unsupported Transport')
+                                continue
+                            self._reply(cseq, headers={'Transport': 'RTP/AVP/TCP;unicast;interleaved=0-1',
+                                                       'Session': f'{self.session};timeout=60'})
+                        elif method == 'PLAY':
+                            self._reply(cseq, headers={'Session': self.session, 'Range': 'npt=0.000-'})
+                            if not self.playing.is_set():
+                                self.playing.set()
+                                threading.Thread(target=self._send_frames, daemon=True).start()
+                        elif method == 'TEARDOWN':
+                            self._reply(cseq, headers={'Session': self.session})
+                            break
+                        else:  # OPTIONS, GET_PARAMETER keep-alives...
+                            self._reply(cseq, headers={'Public': 'OPTIONS, DESCRIBE, SETUP, PLAY, TEARDOWN, '
+                                                                 'GET_PARAMETER', 'Session': self.session})
+                except (ConnectionError, ValueError):
+                    pass
+                finally:
+                    self.closed.set()
+
+            def _send_frames(self):
+                sequence = random.getrandbits(16)
+                ssrc = random.getrandbits(32)
+                started = time.monotonic()
+                try:
+                    for sent, jpeg in enumerate(itertools.cycle(rtsp.jpegs)):
+                        delay = started + sent / rtsp.fps - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                        if self.closed.is_set():
+                            return
+                        packets, sequence = rtp_jpeg_packets(jpeg, sequence, int(sent * CLOCK_RATE / rtsp.fps), ssrc)
+                        with self.lock:
+                            for packet in packets:  # interleaved on channel 0
+                                self.wfile.write(struct.pack('>cBH', b'$', 0, len(packet)) + packet)
+                        rtsp.frames_sent += 1
+                except (ConnectionError, OSError):
+                    self.closed.set()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('video')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8554)
+    parser.add_argument('--fps', type=float, help='default: the frame rate of the video')
+    parser.add_argument('--quality', type=int, default=80, help='JPEG quality of the frames')
+    parser.add_argument('--max-frames', type=int, default=300, help='frames of the video served, looping')
+    args = parser.parse_args()
+
+    rtsp = LocalRTSP(args.video, args.host, args.port, args.fps, args.quality, args.max_frames)
+    print(f'Local RTSP stand-in serving {args.video} on {rtsp.url}')
+    try:
+        rtsp.server.serve_forever()
+    except KeyboardInterrupt:
+        rtsp.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Local S3-compatible stand-in for testing uploads without AWS.
+
+Implements the subset of the S3 REST API the uploader uses: PutObject,
+multipart uploads (create, upload part, complete, abort), HeadObject and
+GetObject, with path-style addressing and any credentials. Objects are kept
+in memory. `latency` adds a delay to every request, like a network round trip
+to S3, and `fail_rate` answers that fraction of writes with 503 SlowDown.
+
+Point the app at it with S3_ENDPOINT_URL=http://127.0.0.1:9000 and any
+S3_BUCKET_NAME / AWS keys.
+
+usage: python -m benchmarks.local_s3 [--port 9000] [--latency 0.05] [--fail-rate 0]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import argparse
+import hashlib
+import random
+import threading
+import time
+import uuid
+
+
+def decode_aws_chunked(body):
+    """
+    Payload of an aws-chunked body: "<size hex>[;ext]\\r\\n<data>\\r\\n" ... "0\\r\\n<trailers>"
+    """
+    data = bytearray()
+    position = 0
+    while True:
+        line_end = body.index(b'\r\n', position)
+        size = int(body[position:line_end].split(b';')[0], 16)
+        if size == 0:
+            return bytes(data)
+        data += body[line_end + 2:line_end + 2 + size]
+        position = line_end + 2 + size + 2
+
+
+class LocalS3:
+    """
+    In-memory S3 stand-in served from a background thread
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.objects = {}  # (bucket, key): bytes
+        self.uploads = {}  # upload id: {part number: bytes}
+        self.requests = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        s3 = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, so client connection pooling matters
+
+            def log_message(self, *args):
+                pass
+
+            def _parse(self):
+                url = urlsplit(self.path)
+                bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+                return bucket, key, {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+
+            def _body(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if 'aws-chunked' in self.headers.get('Content-Encoding', '') or \
+                        self.headers.get('x-amz-content-sha256', '').startswith('STREAMING-'):
+                    body = decode_aws_chunked(body)
+                return body
+
+            def _send(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _start(self, write):
+                with s3.lock:
+                    s3.requests += 1
+                if s3.latency:
+                    time.sleep(s3.latency)
+                if write and random.random() < s3.fail_rate:
+                    self._body()
+                    with s3.lock:
+                        s3.failures += 1
+                    self._send(503, b'<Error><Code>SlowDown</Code><Message>Reduce your request rate.</Message></Error>')
+                    return False
+                return True
+
+            def do_PUT(self):
+                if not self._start(write=True):
+                    return
+                bucket, key, query = self._parse()
+                body = self._body()
+                if not key:  # CreateBucket
+                    return self._send(200)
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                if 'uploadId' in query:
+                    with s3.lock:
+                        s3.uploads[query['uploadId']][int(query['partNumber'])] = body
+                else:
+                    with s3.lock:
+                        s3.objects[(bucket, key)] = body
+                self._send(200, headers={'ETag': etag})
+
+            def do_POST(self):
+                if not self._start(write=True):
+                    return
+                bucket, key, query = self._parse()
+                self._body()
+                if 'uploads' in query:
+                    upload_id = uuid.uuid4().hex
+                    with s3.lock:
+                        s3.uploads[upload_id] = {}
+                    return self._send(200, (
+                        '<InitiateMultipartUploadResult>'
+                        f'<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>'
+                        '</InitiateMultipartUploadResult>').encode())
+                with s3.lock:
+                    parts = s3.uploads.pop(query['uploadId'])
+                    s3.objects[(bucket, key)] = b''.join(parts[n] for n in sorted(parts))
+                self._send(200, (
+                    '<CompleteMultipartUploadResult>'
+                    f'<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>"{uuid.uuid4().hex}-{len(parts)}"</ETag>'
+                    '</CompleteMultipartUploadResult>').encode())
+
+            def do_DELETE(self):
+                self._start(write=False)
+                bucket, key, query = self._parse()
+                with s3.lock:
+                    if 'uploadId' in query:
+                        s3.uploads.pop(query['uploadId'], None)
+                    else:
+                        s3.objects.pop((bucket, key), None)
+                self._send(204)
+
+            def do_GET(self):
+                self._start(write=False)
+                bucket, key, _ = self._parse()
+                body = s3.objects.get((bucket, key))
+                if body is None:
+                    return self._send(404, b'<Error><Code>NoSuchKey</Code></Error>')
+                self._send(200, body, {'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+
+            do_HEAD = do_GET
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='fraction of writes answered with 503 SlowDown')
+    args = parser.parse_args()
+
+    s3 = LocalS3(args.host, args.port, args.latency, args.fail_rate)
+    print(f'Local S3 stand-in listening on {s3.url}')
+    try:
+        s3.server.serve_forever()
+    except KeyboardInterrupt:
+        s3.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Benchmark suite of the processing hot paths, saved as a machine-readable baseline.
+
+Every benchmark runs over a matrix of deterministic synthetic inputs (see synthetic.py):
+video length, resolution, objects per frame and track length (so the number of tracks).
+Each case runs in a fresh subprocess, so its peak RSS is its own, and reports the best
+of --repeats timings (more for quick cases) as throughput in items per second.
+
+Results are written as JSON (default: benchmarks/results/<git commit>.json).
+--compare diffs two of them: throughput and peak RSS per case, regressions beyond
+--threshold are flagged and make the exit status 1. Compare runs from the same machine.
+
+usage:
+  python -m benchmarks.suite [--quick] [--only get_df thumbnails] [--repeats 3] [--output PATH]
+  python -m benchmarks.suite --compare OLD.json NEW.json [--threshold 0.1]
+
+process_video_nano needs the nano weights (weights/yolov8n.pt in the working directory),
+it is recorded as skipped without them.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = ['get_df', 'summary', 'middle_frames', 'write_csv', 'write_detections',
+              'thumbnails', 'process_video', 'process_video_nano']
+
+
+def matrix(quick=False):
+    """
+    The cases: (benchmark, params). Table benchmarks vary length, objects and track length,
+    benchmarks decoding or drawing frames also vary the resolution
+    """
+    table = [dict(frames=frames, objects=objects, track_length=90, width=1920, height=1080)
+             for frames in ([1800, 9000] if quick else [1800, 9000, 36000])
+             for objects in ([10] if quick else [10, 50])]
+    # fewer, longer tracks and more, shorter ones
+    table += [dict(frames=9000, objects=10, track_length=track_length, width=1920, height=1080)
+              for track_length in ([30] if quick else [30, 900])]
+    frames = [dict(frames=frames, objects=10, track_length=90, width=width, height=height)
+              for frames in ([300] if quick else [900, 3600])
+              for width, height in ([(640, 360)] if quick else [(640, 360), (1920, 1080)])]
+    nano = [dict(frames=frames, objects=5, track_length=90, width=width, height=height)
+            for frames in [150 if quick else 300]
+            for width, height in ([(640, 360)] if quick else [(640, 360), (1280, 720)])]
+
+    cases = []
+    for benchmark in BENCHMARKS:
+        if benchmark in ('thumbnails', 'process_video'):
+            grid = frames
+        elif benchmark == 'process_video_nano':
+            grid = nano
+        else:
+            grid = table
+        cases += [(benchmark, params) for params in grid]
+    return cases
+
+
+def case_key(benchmark, params):
+    return benchmark + ' ' + ' '.join(f'{name}={value}' for name, value in sorted(params.items()))
+
+
+### Cases, run in a subprocess ###
+
+def synthetic_video(cache_folder, params):
+    # Videos are written once per suite run and shared by the cases
+    from benchmarks.synthetic import write_synthetic_video
+    name = '{frames}f_{objects}o_{track_length}t_{width}x{height}.mp4'.format(**params)
+    path = os.path.join(cache_folder, name)
+    if not os.path.exists(path):
+        write_synthetic_video(path + '.part.mp4', params['frames'], params['objects'],
+                              params['track_length'], params['width'], params['height'])
+        os.rename(path + '.part.mp4', path)
+    return path
+
+
+def detection_store(params):
+    from benchmarks.synthetic import synthetic_boxes
+    from video_app.utils import DetectionStore
+    store = DetectionStore()
+    for frame, boxes in enumerate(synthetic_boxes(params['frames'], params['objects'], params['track_length'],
+                                                  params['width'], params['height']), start=1):
+        store.append(boxes, frame)
+    return store
+
+
+def best_of(repeats, fn, min_seconds=0.5, max_runs=100):
+    # at least `repeats` runs, more for quick cases until min_seconds have passed, like timeit's autorange
+    best = float('inf')
+    total = 0
+    runs = 0
+    while runs < repeats or (total < min_seconds and runs < max_runs):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        runs += 1
+    return best
+
+
+def run_case(benchmark, params, repeats, cache_folder):
+    """
+    Returns (best seconds, number of items processed, unit of the items)
+    """
+    from benchmarks.synthetic import FakeModel
+    from video_app.utils import (Detections, get_df, get_images, get_middle_frames, get_summary_df,
+                                 write_detections)
+
+    labels = FakeModel.names
+    # the frame rate is read from the video, even by the table benchmarks
+    video = synthetic_video(cache_folder, dict(params, frames=min(params['frames'], 30))
+                            if benchmark not in ('thumbnails', 'process_video', 'process_video_nano') else params)
+
+    if benchmark == 'process_video_nano':
+        from video_app.models import load_model
+        try:
+            model = load_model('nano')
+        except Exception as e:
+            raise SkipCase(f'nano model unavailable: {e}')
+        return (best_of(repeats, lambda: Detections().process_video(model, video, list(range(80)))),
+                params['frames'], 'frames')
+
+    if benchmark == 'process_video':
+        # the pipeline around the model: tracking loop, tables, thumbnails and csv
+        def pipeline():
+            detections = Detections()
+            detections.process_video(FakeModel(params['frames'], params['objects'], params['track_length'],
+                                               params['width'], params['height']), video, list(range(80)))
+            with tempfile.TemporaryDirectory() as out:
+                detections.write_images(video, out)
+                detections.write_csv(out, video)
+        return best_of(repeats, pipeline), params['frames'], 'frames'
+
+    df = get_df(detection_store(params), video)
+    rows = len(df)
+    if benchmark == 'get_df':
+        store = detection_store(params)
+        return best_of(repeats, lambda: get_df(store, video)), rows, 'detections'
+    if benchmark == 'summary':
+        return best_of(repeats, lambda: get_summary_df(df, labels)), rows, 'detections'
+
+    track_ids = df['track_id'].unique()
+    if benchmark == 'middle_frames':
+        return best_of(repeats, lambda: get_middle_frames(df, track_ids)), rows, 'detections'
+    if benchmark == 'thumbnails':
+        middle_frames = get_middle_frames(df, track_ids)
+        with tempfile.TemporaryDirectory() as out:
+            return (best_of(repeats, lambda: get_images(df, labels, video, middle_frames, out)),
+                    len(track_ids), 'images')
+
+    with tempfile.TemporaryDirectory() as out:
+        if benchmark == 'write_csv':
+            detections = Detections()
+            detections.summary_df = get_summary_df(df, labels)
+            detections.csv = detections.summary_df.to_csv(index=False)
+            return best_of(repeats, lambda: detections.write_csv(out, video)), len(track_ids), 'tracks'
+        if benchmark == 'write_detections':
+            path = os.path.join(out, 'detections.parquet')
+            return best_of(repeats, lambda: write_detections(df, path)), rows, 'detections'
+    raise ValueError(f'Unknown benchmark {benchmark}')
+
+
+class SkipCase(Exception):
+    pass
+
+
+def case_main(spec):
+    # Entry point of a case subprocess: prints its result as JSON
+    spec = json.loads(spec)
+    # pandas, cv2, torch and ultralytics are imported lazily: import them all up front,
+    # for the same base footprint for every case
+    from video_app.lazy import preload
+    preload()
+    rss_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = {'benchmark': spec['benchmark'], 'params': spec['params'],
+              'key': case_key(spec['benchmark'], spec['params'])}
+    try:
+        seconds, items, unit = run_case(spec['benchmark'], spec['params'], spec['repeats'], spec['cache'])
+        result.update(seconds=round(seconds, 6), items=items, unit=unit,
+                      throughput=round(items / seconds, 2) if seconds > 0 else None)
+    except SkipCase as e:
+        result['skipped'] = str(e)
+    # ru_maxrss is in KB on Linux. The case's own memory is what it added to the base
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    result['case_rss_mb'] = round(result['peak_rss_mb'] - rss_base / 1024, 1)
+    print(json.dumps(result))
+
+
+### Suite ###
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_suite(args):
+    cases = [(benchmark, params) for benchmark, params in matrix(args.quick)
+             if not args.only or benchmark in args.only]
+    cache = tempfile.mkdtemp(prefix='eyespy-bench-')
+    results = []
+    print(f'{"case":<75} {"seconds":>9} {"items/s":>12} {"peak MB":>8} {"case MB":>8}')
+    try:
+        for benchmark, params in cases:
+            spec = json.dumps({'benchmark': benchmark, 'params': params,
+                               'repeats': args.repeats, 'cache': cache})
+            done = subprocess.run([sys.executable, '-m', 'benchmarks.suite', '--case', spec],
+                                  capture_output=True, text=True)
+            if done.returncode != 0:
+                print(done.stderr[-2000:], file=sys.stderr)
+                raise SystemExit(f'{case_key(benchmark, params)} failed')
+            result = json.loads(done.stdout.strip().splitlines()[-1])
+            results.append(result)
+            if 'skipped' in result:
+                print(f'{result["key"]:<75} skipped: {result["skipped"][:60]}')
+            else:
+                print(f'{result["key"]:<75} {result["seconds"]:>9.4f} {result["throughput"]:>12.1f} '
+                      f'{result["peak_rss_mb"]:>8.0f} {result["case_rss_mb"]:>8.0f}')
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
+
+    commit = git_commit()
+    baseline = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'commit': commit,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'repeats': args.repeats,
+                'results': results}
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(baseline, f, indent=1)
+    print(f'Saved {len(results)} results to {output}')
+
+
+def compare(old_path, new_path, threshold):
+    """
+    Prints throughput and peak RSS changes per case, returns the number of regressions
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f'{old_path} ({old["commit"]}) -> {new_path} ({new["commit"]})')
+    if old['platform'] != new['platform'] or old['cpu_count'] != new['cpu_count']:
+        print('warning: the runs come from different machines')
+
+    old_results = {r['key']: r for r in old['results'] if 'skipped' not in r}
+    regressions = 0
+    print(f'{"case":<75} {"items/s":>12} {"change":>8} {"peak MB":>8} {"change":>8}')
+    for result in new['results']:
+        before = old_results.get(result['key'])
+        if before is None or 'skipped' in result:
+            continue
+        speed = result['throughput'] / before['throughput'] - 1
+        memory = result['peak_rss_mb'] / before['peak_rss_mb'] - 1
+        flag = ''
+        if speed < -threshold or memory > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f'{result["key"]:<75} {result["throughput"]:>12.1f} {speed:>+8.1%} '
+              f'{result["peak_rss_mb"]:>8.0f} {memory:>+8.1%}{flag}')
+    print(f'{regressions} regression(s) beyond {threshold:.0%}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--quick', action='store_true', help='a smaller matrix, for a quick check')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='run only these benchmarks')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='where to save the results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='diff two saved results')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change flagged by --compare')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        case_main(args.case)
+    elif args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    else:
+        run_suite(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Deterministic synthetic inputs for the benchmarks.
+Provides YOLO-like result streams with known moving boxes and a matching
+video file, so the hot paths can be measured without model weights.
+"""
+import numpy as np
+import cv2
+
+
+class FakeTensor:
+    """ stands in for a torch tensor: supports .cpu().numpy() """
+
+    def __init__(self, array):
+        self._array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._array
+
+
+class FakeBoxes:
+    def __init__(self, data, orig_shape):
+        self.data = FakeTensor(data)
+        self.orig_shape = orig_shape
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        # as ultralytics Boxes, which the tracker takes
+        from ultralytics.engine.results import Boxes
+        return Boxes(self.data.numpy(), self.orig_shape)
+
+
+class FakeResults:
+    """ stands in for ultralytics Results: the boxes of one frame """
+
+    def __init__(self, data, orig_shape):
+        self.boxes = FakeBoxes(data, orig_shape)
+
+
+def synthetic_boxes(num_frames, objects_per_frame=10, track_length=90,
+                    width=1920, height=1080, seed=0):
+    """
+    Yields one (N,7) float32 array per frame: xmin, ymin, xmax, ymax, track_id, confidence, class_id.
+    Every object moves linearly and bounces off the frame edges.
+    Each object slot starts a new track every `track_length` frames.
+    """
+    rng = np.random.default_rng(seed)
+    size = rng.uniform(20, 120, size=(objects_per_frame, 2))
+    limit = np.array([width, height]) - size
+    start = rng.uniform(0, 1, size=(objects_per_frame, 2)) * limit
+    velocity = rng.uniform(-4, 4, size=(objects_per_frame, 2))
+    class_ids = rng.integers(0, 9, size=objects_per_frame)
+    confidence = rng.uniform(0.5, 0.99, size=objects_per_frame)
+    slots = np.arange(objects_per_frame)
+
+    for frame in range(num_frames):
+        # bounce: reflect positions into [0, limit]
+        xy = np.abs(start + velocity * frame) % (2 * limit)
+        xy = np.where(xy > limit, 2 * limit - xy, xy)
+        generation = frame // track_length
+        track_ids = 1 + slots + objects_per_frame * generation
+        data = np.column_stack([xy, xy + size, track_ids,
+                                confidence, class_ids]).astype(np.float32)
+        yield data
+
+
+class FakeModel:
+    """
+    Stands in for an ultralytics YOLO model in `Detections.process_video`.
+    Each `predict` call returns the detections of the next frame of `synthetic_boxes`,
+    in the coordinates of the (letterboxed) image it is given, like the real model.
+    The tracking itself is ByteTrack's, as with a real model.
+    """
+
+    names = {i: f'class_{i}' for i in range(80)}
+
+    def __init__(self, num_frames, objects_per_frame=10, track_length=90,
+                 width=1920, height=1080):
+        self.num_frames = num_frames
+        self.objects_per_frame = objects_per_frame
+        self.track_length = track_length
+        self.width = width
+        self.height = height
+        self._frames = synthetic_boxes(num_frames, objects_per_frame, track_length, width, height)
+
+    def predict(self, image, **kwargs):
+        data = next(self._frames, np.empty((0, 7), dtype=np.float32))
+        gain = min(image.shape[0] / self.height, image.shape[1] / self.width)
+        pad = np.array([image.shape[1] - self.width * gain, image.shape[0] - self.height * gain]) / 2
+        boxes = np.column_stack([data[:, :2] * gain + pad, data[:, 2:4] * gain + pad,
+                                 data[:, 5:7]]).astype(np.float32)  # xyxy, confidence, class_id
+        return [FakeResults(boxes, image.shape[:2])]
+
+
+def write_synthetic_video(path, num_frames, objects_per_frame=10, track_length=90,
+                          width=640, height=360, fps=30):
+    """
+    Writes an mp4 whose frames show the same moving boxes as `synthetic_boxes`
+    (scaled to the video size), returns the path
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'),
+                             fps, (width, height))
+    for data in synthetic_boxes(num_frames, objects_per_frame, track_length, width, height):
+        frame = np.full((height, width, 3), 40, dtype=np.uint8)
+        for xmin, ymin, xmax, ymax, track_id, _, _ in data:
+            colour = tuple(int(c) for c in (
+                (track_id * 50) % 255, (track_id * 90) % 255, 200))
+            cv2.rectangle(frame, (int(xmin), int(ymin)),
+                          (int(xmax), int(ymax)), colour, -1)
+        writer.write(frame)
+    writer.release()
+    return path
@@ -1,5 +1,5 @@
 import os
-from decouple import config
+from decouple import config, Csv
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
@@ -8,25 +8,80 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or '5WjKWBaQa5TaD594H2oOKw'
     home = BASE_DIR
+    # Background processing jobs
+    JOB_DB = os.path.join(home, 'tmp/jobs.db')
+    JOB_WORKERS = config('JOB_WORKERS', default=2, cast=int)
+    # Loading pages following job progress over Server-Sent Events at once, per worker.
+    # Each holds a request thread, so keep it below gunicorn's --threads: pages over the limit poll instead
+    MAX_EVENT_STREAMS = config('MAX_EVENT_STREAMS', default=2, cast=int)
+    # How thumbnails pick a frame per track: middle, confidence, area, sharpness
+    THUMBNAIL_STRATEGY = config('THUMBNAIL_STRATEGY', default='middle')
+    # Processes per video, each tracks a segment with its own model. 1 disables sharding
+    SHARDS = config('SHARDS', default=1, cast=int)
+    # Loaded models per process: estimated memory budget (LRU eviction),
+    # and models loaded at startup, before gunicorn forks its workers (--preload)
+    MODEL_MEMORY_BUDGET_MB = config(
+        'MODEL_MEMORY_BUDGET_MB', default=1024, cast=int)
+    PRELOAD_MODELS = config('PRELOAD_MODELS', default='nano', cast=Csv())
+    # Import the ML stack (torch, ultralytics, pandas, cv2...) at startup too, rather than
+    # on first use. Disable for quick restarts in development, or workers serving light routes only
+    PRELOAD_MODULES = config('PRELOAD_MODULES', default=True, cast=bool)
+    # CPU inference backend per model, e.g. "nano:onnx,XL:openvino". Unlisted models use pytorch.
+    # Backends: pytorch, onnx, onnx-int8, openvino
+    MODEL_BACKENDS = config('MODEL_BACKENDS', default='', cast=Csv())
+    # Live streams processed at once per worker. RTSP sources may be on any host,
+    # http(s) ones only on these hosts: the server fetches them, so users mustn't point it at internal URLs
+    MAX_STREAMS = config('MAX_STREAMS', default=2, cast=int)
+    STREAM_ALLOWED_HOSTS = config('STREAM_ALLOWED_HOSTS', default='', cast=Csv())
+    # S3 uploads of results. S3_ENDPOINT_URL points at an S3-compatible stand-in, e.g. MinIO
+    S3_BUCKET_NAME = config('S3_BUCKET_NAME', default=None)
+    S3_ENDPOINT_URL = config('S3_ENDPOINT_URL', default=None)
+    S3_UPLOAD_WORKERS = config('S3_UPLOAD_WORKERS', default=8, cast=int)
+    S3_MULTIPART_THRESHOLD_MB = config('S3_MULTIPART_THRESHOLD_MB', default=8, cast=int)
+    S3_UPLOAD_RETRIES = config('S3_UPLOAD_RETRIES', default=3, cast=int)
+    # Chunked, resumable uploads from the dropZone
+    UPLOAD_CHUNK_MB = config('UPLOAD_CHUNK_MB', default=8, cast=int)
+    MAX_UPLOAD_MB = config('MAX_UPLOAD_MB', default=500, cast=int)
+    # Per-job workspaces (video, csv, images), evicted by the janitor by age and total size
+    WORKSPACE_TTL_HOURS = config('WORKSPACE_TTL_HOURS', default=24, cast=float)
+    WORKSPACE_QUOTA_MB = config('WORKSPACE_QUOTA_MB', default=5000, cast=int)
+    JANITOR_INTERVAL = config('JANITOR_INTERVAL', default=600, cast=int)
+    # Results of processed videos, reused for identical submissions. Disk budget, LRU eviction
+    RESULT_CACHE_MB = config('RESULT_CACHE_MB', default=2048, cast=int)
+    # Motion gating for fixed cameras: frames where less than this fraction of the (downscaled)
+    # pixels changed skip inference and keep the last boxes, e.g. 0.002. 0 runs every frame
+    MOTION_THRESHOLD = config('MOTION_THRESHOLD', default=0, cast=float)
+    # Format of the per-frame detections table: parquet, feather or csv
+    DETECTIONS_FORMAT = config('DETECTIONS_FORMAT', default='parquet')
+    # Sampling profiles of jobs, written to their workspace: of every job (PROFILE_JOBS),
+    # or of jobs submitted with a X-Eyespy-Profile header signed with PROFILE_SECRET
+    # (python -m video_app.profiling prints one). Sampling interval in milliseconds.
+    # Profiles are served by /jobs/<id>/profile to signed requests only, so not at all without PROFILE_SECRET
+    PROFILE_JOBS = config('PROFILE_JOBS', default=False, cast=bool)
+    PROFILE_SECRET = config('PROFILE_SECRET', default=None)
+    PROFILE_INTERVAL_MS = config('PROFILE_INTERVAL_MS', default=10, cast=float)
 
 
 class DevelopmentConfig(Config):
     DEBUG = True
-    IMAGE_FOLDER = os.path.join(Config.home, 'tmp/images')
-    VIDEO_FOLDER = os.path.join(Config.home, 'tmp/videos')
-    CSV_FOLDER = os.path.join(Config.home, 'tmp/csvs')
+    WORKSPACE_FOLDER = os.path.join(Config.home, 'tmp/jobs')
+    STREAM_FOLDER = os.path.join(Config.home, 'tmp/streams')
+    CACHE_FOLDER = os.path.join(Config.home, 'tmp/cache')
+    UPLOAD_FOLDER = os.path.join(Config.home, 'tmp/uploads')
 
 
 class TestingConfig(Config):
     DEBUG = False
     TESTING = True
-    IMAGE_FOLDER = os.path.join(Config.home, 'tmp/images')
-    VIDEO_FOLDER = os.path.join(Config.home, 'tmp/videos')
-    CSV_FOLDER = os.path.join(Config.home, 'tmp/csvs')
+    WORKSPACE_FOLDER = os.path.join(Config.home, 'tmp/jobs')
+    STREAM_FOLDER = os.path.join(Config.home, 'tmp/streams')
+    CACHE_FOLDER = os.path.join(Config.home, 'tmp/cache')
+    UPLOAD_FOLDER = os.path.join(Config.home, 'tmp/uploads')
 
 
 class ProductionConfig(Config):
     DEBUG = False
-    IMAGE_FOLDER = os.path.join(Config.home, 'tmp/images')
-    VIDEO_FOLDER = os.path.join(Config.home, 'tmp/videos')
-    CSV_FOLDER = os.path.join(Config.home, 'tmp/csvs')
+    WORKSPACE_FOLDER = os.path.join(Config.home, 'tmp/jobs')
+    STREAM_FOLDER = os.path.join(Config.home, 'tmp/streams')
+    CACHE_FOLDER = os.path.join(Config.home, 'tmp/cache')
+    UPLOAD_FOLDER = os.path.join(Config.home, 'tmp/uploads')
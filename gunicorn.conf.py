@@ -0,0 +1,22 @@
+"""
+Gunicorn settings, read from the working directory on top of the command line in Dockerfile.flask.
+
+Prometheus metrics in multiprocess mode: each worker writes its metrics to files in
+PROMETHEUS_MULTIPROC_DIR and /metrics aggregates them, whichever worker answers.
+The directory is set and emptied here, before the app (and prometheus_client) is loaded.
+"""
+import os
+import shutil
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(BASE_DIR, 'tmp/metrics'))
+# metrics of the previous run would be added to this one's
+shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+
+
+def child_exit(server, worker):
+    # keep the exited worker's counters, drop its live gauges
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,9 +1,19 @@
 from flask import Flask
 from config import DevelopmentConfig, ProductionConfig, TestingConfig
 from video_app.routes.main_routes import main
+from video_app.jobs import JobStore, JobQueue
+from video_app.lazy import preload
+from video_app.cache import ResultCache
+from video_app.models import ModelRegistry, parse_backends
+from video_app.s3 import S3Uploader
+from video_app.streams import StreamManager
+from video_app.uploads import ChunkedUploads
+from video_app.workspaces import Janitor, Workspaces
 
+import gc
 import os
 import logging
+import threading
 from logging.handlers import RotatingFileHandler
 
 
@@ -23,8 +33,51 @@ def create_app(config_name='production'):
     # Register the blueprints
     app.register_blueprint(main)
 
-    # Initialize empty cache for models
-    app.model_cache = {}
+    # Shared, memory-budgeted cache of loaded models.
+    # With gunicorn --preload this runs once in the master process,
+    # and the preloaded modules and weights are shared copy-on-write by all workers.
+    if app.config['PRELOAD_MODULES']:
+        preload()
+    app.model_registry = ModelRegistry(app.config['MODEL_MEMORY_BUDGET_MB'],
+                                       parse_backends(app.config['MODEL_BACKENDS']))
+    app.model_registry.preload(app.config['PRELOAD_MODELS'])
+    # keep everything loaded so far out of the GC, so collections in workers don't dirty its pages
+    gc.freeze()
+
+    # Background uploads of results to S3, shared by all jobs of this process
+    app.s3_uploader = S3Uploader(app.config['S3_BUCKET_NAME'], app.config['S3_ENDPOINT_URL'],
+                                 max_workers=app.config['S3_UPLOAD_WORKERS'],
+                                 multipart_threshold_mb=app.config['S3_MULTIPART_THRESHOLD_MB'],
+                                 retries=app.config['S3_UPLOAD_RETRIES'])
+
+    # Results of previous jobs, shared by all workers through local disk
+    app.result_cache = ResultCache(
+        app.config['CACHE_FOLDER'], app.config['RESULT_CACHE_MB'])
+
+    # Persistent job state and background worker pool for /upload
+    app.job_store = JobStore(app.config['JOB_DB'])
+    app.job_store.recover()
+    app.job_queue = JobQueue(app, app.job_store, app.config['JOB_WORKERS'])
+    # Request threads that job progress event streams may hold at once
+    app.event_streams = threading.BoundedSemaphore(app.config['MAX_EVENT_STREAMS'])
+
+    # Partial uploads from the dropZone, assembled on disk
+    app.chunked_uploads = ChunkedUploads(app.config['UPLOAD_FOLDER'], app.config['UPLOAD_CHUNK_MB'],
+                                         app.config['MAX_UPLOAD_MB'])
+
+    # Per-job workspaces, cleaned up in the background of each worker
+    app.workspaces = Workspaces(app.config['WORKSPACE_FOLDER'], app.config['WORKSPACE_TTL_HOURS'],
+                                app.config['WORKSPACE_QUOTA_MB'])
+    app.janitor = Janitor(app.workspaces, app.job_store.is_active,
+                          app.config['JANITOR_INTERVAL'], uploads=app.chunked_uploads)
+
+    @app.before_request
+    def start_janitor():
+        app.janitor.ensure_started()
+
+    # Live streams processed by this worker
+    app.stream_manager = StreamManager(
+        app.config['STREAM_FOLDER'], app.config['MAX_STREAMS'])
 
     # Set up logging
     if not app.debug:
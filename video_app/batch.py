@@ -0,0 +1,275 @@
+"""
+Offline batch processing of many videos, without the web app.
+
+Processes every video of a folder, or those listed in a manifest (a text file with
+one path per line, relative to the manifest; blank lines and # comments are ignored),
+with a pool of worker processes. Each worker loads the model once.
+
+Every video gets its own output folder: OUTPUT/<name>-<hash of its path>/ with the csv,
+the detections table, the thumbnails and result.json, written last. A rerun reuses the
+videos whose result.json matches the video (size, mtime) and the settings, so an
+interrupted batch restarts where it stopped. --force reprocesses everything.
+
+At the end OUTPUT/summary.csv has one row per video, and OUTPUT/batch.json the
+throughput of the run.
+
+usage:
+  python -m video_app.batch VIDEOS_FOLDER_OR_MANIFEST OUTPUT [--workers 2] [--model nano]
+      [--backend pytorch] [--classes 0 1 2] [--stride 1] [--no-images] [--force]
+
+Run it from the folder holding weights/, like the app.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import os
+import csv
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import multiprocessing
+
+from config import Config
+from video_app.models import BACKENDS, load_model, resolve_model_type, weights_selection_mapping
+from video_app.utils import DETECTION_FORMATS, FRAME_STRATEGIES, Detections, get_frame_count, has_allowed_extension
+
+logger = logging.getLogger('video_app')
+
+RESULT_FILENAME = 'result.json'
+SUMMARY_FILENAME = 'summary.csv'
+STATS_FILENAME = 'batch.json'
+SUMMARY_COLUMNS = ['video', 'status', 'frames', 'seconds', 'fps', 'tracks', 'detections',
+                   'frames_skipped', 'labels', 'output', 'error']
+
+# Model of this worker process, loaded once by _init_worker
+_worker_model = None
+
+
+def find_videos(source):
+    """
+    Absolute paths of the videos of a folder (recursively) or of a manifest file
+    """
+    if os.path.isdir(source):
+        return sorted(os.path.abspath(os.path.join(root, name))
+                      for root, _, names in os.walk(source)
+                      for name in names if has_allowed_extension(name))
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        lines = [line.strip() for line in f]
+    videos = [os.path.abspath(os.path.join(base, line)) for line in lines if line and not line.startswith('#')]
+    return list(dict.fromkeys(videos))  # listed twice, processed once
+
+
+def output_folder(output, video):
+    """
+    Output folder of a video: clips with the same name in different folders don't collide
+    """
+    name = os.path.splitext(os.path.basename(video))[0]
+    return os.path.join(output, f'{name}-{hashlib.sha1(video.encode()).hexdigest()[:8]}')
+
+
+def video_signature(video):
+    stat = os.stat(video)
+    return {'path': video, 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def load_result(folder, video, settings):
+    """
+    The result.json of a previous run, if it is complete and matches the video and the settings
+    """
+    try:
+        with open(os.path.join(folder, RESULT_FILENAME)) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if result.get('video') != video_signature(video) or result.get('settings') != settings:
+        return None
+    return result
+
+
+def _init_worker(model_type, backend, threads, verbose):
+    global _worker_model
+    import torch
+    if verbose:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(message)s')
+    torch.set_num_threads(threads)
+    _worker_model = load_model(model_type, backend)
+
+
+def process_one(video, folder, settings):
+    """
+    Processes one video in a worker process, writing its outputs to folder.
+    Returns its result, also saved as folder/result.json once everything else is written
+    """
+    started = time.perf_counter()
+    shutil.rmtree(folder, ignore_errors=True)  # outputs of an interrupted or outdated run
+    image_folder = os.path.join(folder, 'images')
+    os.makedirs(image_folder)
+
+    detections = Detections(frame_strategy=settings['frame_strategy'], model_type=settings['model'],
+                            motion_threshold=settings['motion_threshold'])
+    detections.process_video(_worker_model, video, settings['classes'], stride=settings['stride'])
+    if detections.df is None:
+        raise ValueError(f'Could not process {video}')
+    csv_path = detections.write_csv(folder, video)
+    detections_path = detections.write_detections(folder, video, settings['format'])
+    images = sorted(detections.write_images(video, image_folder)) if settings['images'] else []
+
+    seconds = time.perf_counter() - started
+    frames = get_frame_count(video)
+    result = {'video': video_signature(video),
+              'settings': settings,
+              'frames': frames,
+              'seconds': round(seconds, 3),
+              'fps': round(frames / seconds, 2) if seconds > 0 else None,
+              'tracks': len(detections.track_ids),
+              'detections': len(detections.df),
+              'frames_skipped': detections.frames_skipped,
+              'labels': {label: int(count) for label, count in detections.summary_df['label'].value_counts().items()},
+              'csv': csv_path,
+              'detections_table': detections_path,
+              'images': images,
+              'frame_source': detections.frame_source_stats}
+    path = os.path.join(folder, RESULT_FILENAME)
+    with open(path + '.part', 'w') as f:
+        json.dump(result, f, indent=1)
+    os.replace(path + '.part', path)
+    return result
+
+
+def summary_row(video, folder, status, result=None, error=None):
+    result = result or {}
+    labels = result.get('labels', {})
+    return {'video': video, 'status': status, 'frames': result.get('frames'), 'seconds': result.get('seconds'),
+            'fps': result.get('fps'), 'tracks': result.get('tracks'), 'detections': result.get('detections'),
+            'frames_skipped': result.get('frames_skipped'),
+            'labels': ' '.join(f'{label}:{count}' for label, count in sorted(labels.items())),
+            'output': folder, 'error': error}
+
+
+def run_batch(videos, output, settings, workers=2, force=False, verbose=False):
+    """
+    Processes videos into output with `workers` processes, reusing complete results unless force.
+    Returns (summary rows in the order of videos, throughput stats)
+    """
+    os.makedirs(output, exist_ok=True)
+    rows = {}
+    pending = []
+    for video in videos:
+        folder = output_folder(output, video)
+        if not os.path.isfile(video):
+            rows[video] = summary_row(video, folder, 'failed', error='file not found')
+            continue
+        result = None if force else load_result(folder, video, settings)
+        if result is not None:
+            rows[video] = summary_row(video, folder, 'reused', result)
+        else:
+            pending.append(video)
+    logger.info(f'{len(videos)} videos: {len(pending)} to process, {len(videos) - len(pending)} done or missing')
+    # largest first, so a long video doesn't start last and keep one worker busy alone
+    pending.sort(key=os.path.getsize, reverse=True)
+
+    started = time.perf_counter()
+    busy_seconds = 0.0
+    frames = 0
+    if pending:
+        workers = max(1, min(workers, len(pending)))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # spawn, not fork: torch is not fork-safe, see sharding
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(settings['model'], settings['backend'], threads, verbose)) as pool:
+            futures = {pool.submit(process_one, video, output_folder(output, video), settings): video
+                       for video in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                video = futures[future]
+                folder = output_folder(output, video)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f'{video} failed: {e}')
+                    rows[video] = summary_row(video, folder, 'failed', error=str(e))
+                    print(f'[{done}/{len(pending)}] {video}: failed, {e}', file=sys.stderr)
+                    continue
+                rows[video] = summary_row(video, folder, 'done', result)
+                busy_seconds += result['seconds']
+                frames += result['frames']
+                print(f'[{done}/{len(pending)}] {video}: {result["frames"]} frames in {result["seconds"]:.1f}s '
+                      f'({result["fps"]} fps), {result["tracks"]} tracks', file=sys.stderr)
+    seconds = time.perf_counter() - started
+
+    rows = [rows[video] for video in videos]
+    statuses = [row['status'] for row in rows]
+    stats = {'videos': len(videos),
+             'processed': statuses.count('done'),
+             'reused': statuses.count('reused'),
+             'failed': statuses.count('failed'),
+             'workers': workers,
+             'seconds': round(seconds, 3),
+             'frames': frames,
+             'fps': round(frames / seconds, 2) if seconds > 0 else None,
+             'videos_per_hour': round(statuses.count('done') / seconds * 3600, 1) if seconds > 0 else None,
+             # share of the workers' time spent on videos, the rest is model loading and idle tail
+             'worker_utilization': round(busy_seconds / (seconds * workers), 3) if seconds > 0 else None,
+             'settings': settings}
+    return rows, stats
+
+
+def write_summary(output, rows, stats):
+    """
+    Writes summary.csv and batch.json to output, returns their paths
+    """
+    summary_path = os.path.join(output, SUMMARY_FILENAME)
+    with open(summary_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    stats_path = os.path.join(output, STATS_FILENAME)
+    with open(stats_path, 'w') as f:
+        json.dump(stats, f, indent=1)
+    return summary_path, stats_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('source', help='folder of videos, or manifest file with one video path per line')
+    parser.add_argument('output', help='folder of the results')
+    parser.add_argument('--workers', type=int, default=2, help='worker processes, each with its own model')
+    parser.add_argument('--model', default='nano', choices=list(weights_selection_mapping))
+    parser.add_argument('--backend', default='pytorch', choices=BACKENDS)
+    parser.add_argument('--classes', type=int, nargs='+', default=[0, 1, 2, 3, 4, 5, 6, 7, 8],
+                        help='class ids to detect, default: people & vehicles')
+    parser.add_argument('--stride', type=int, default=1, help='run inference on every stride-th frame')
+    parser.add_argument('--frame-strategy', default=Config.THUMBNAIL_STRATEGY, choices=FRAME_STRATEGIES)
+    parser.add_argument('--motion-threshold', type=float, default=Config.MOTION_THRESHOLD)
+    parser.add_argument('--format', default=Config.DETECTIONS_FORMAT, choices=list(DETECTION_FORMATS),
+                        help='format of the detections table')
+    parser.add_argument('--no-images', action='store_true', help="don't write thumbnails")
+    parser.add_argument('--force', action='store_true', help='reprocess videos with complete results')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(processName)s %(message)s')
+    videos = find_videos(args.source)
+    if not videos:
+        sys.exit(f'No videos found in {args.source}')
+    settings = {'model': resolve_model_type(args.model), 'backend': args.backend, 'classes': sorted(args.classes),
+                'stride': args.stride, 'frame_strategy': args.frame_strategy,
+                'motion_threshold': args.motion_threshold, 'format': args.format, 'images': not args.no_images}
+    output = os.path.abspath(args.output)
+    rows, stats = run_batch(videos, output, settings, args.workers, args.force, args.verbose)
+    summary_path, stats_path = write_summary(output, rows, stats)
+
+    print(f'{stats["videos"]} videos: {stats["processed"]} processed, {stats["reused"]} reused, '
+          f'{stats["failed"]} failed in {stats["seconds"]:.1f}s, {stats["frames"]} frames at {stats["fps"]} fps '
+          f'with {stats["workers"]} workers ({stats["worker_utilization"]} busy)')
+    print(f'Summary: {summary_path}, stats: {stats_path}')
+    sys.exit(1 if stats['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+from contextlib import contextmanager
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tempfile
+
+from video_app.utils import folder_size
+
+logger = logging.getLogger('video_app')
+
+
+def file_digest(path):
+    """
+    sha256 of a file's bytes, identifies an uploaded video whatever its name
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(video_id, model_type, CLASSES, stride=1, backend='pytorch', frame_strategy='middle',
+              motion_threshold=0):
+    """
+    Key of the results of processing a video with the given settings.
+    video_id -- file_digest of the video, or 'youtube:<video id>'
+    """
+    settings = [video_id, model_type, sorted(CLASSES), stride, backend, frame_strategy]
+    if motion_threshold:  # keys without motion gating are unchanged
+        settings.append(motion_threshold)
+    return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of processing results on local disk.
+
+    Each entry is a folder named by its key (see cache_key) with the summary csv and html,
+    the per-frame detections table (see write_detections) and its index, and the thumbnails. A sqlite index shared by every
+    gunicorn worker tracks entry sizes and last use; least recently used entries are
+    evicted to keep the total under `max_mb`. Hits and misses are counted in the index.
+    """
+
+    def __init__(self, folder, max_mb):
+        self.folder = folder
+        self.max_bytes = max_mb * 1024 * 1024
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+                                key TEXT PRIMARY KEY,
+                                size INTEGER NOT NULL,
+                                created REAL,
+                                last_used REAL)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS counters (
+                                name TEXT PRIMARY KEY,
+                                value INTEGER NOT NULL)''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(os.path.join(self.folder, 'index.db'), timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, conn, name):
+        conn.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                     'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+    def get(self, key):
+        '''
+        Returns the cached entry {'folder', 'video_name', 'table_html', 'images'}, or None on a miss
+        '''
+        entry_folder = os.path.join(self.folder, key)
+        with self._connect() as conn:
+            row = conn.execute('SELECT key FROM entries WHERE key = ?', (key,)).fetchone()
+            entry = None
+            if row is not None:
+                try:
+                    with open(os.path.join(entry_folder, 'entry.json')) as f:
+                        entry = json.load(f)
+                    with open(os.path.join(entry_folder, 'summary.html')) as f:
+                        entry['table_html'] = f.read()
+                except OSError:
+                    # evicted by another worker in the meantime
+                    entry = None
+                    conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            if entry is None:
+                self._count(conn, 'misses')
+                return None
+            conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._count(conn, 'hits')
+        entry['folder'] = entry_folder
+        return entry
+
+    def restore(self, entry, CSV_FOLDER, IMAGE_FOLDER):
+        '''
+        Copies a cached entry's summary csv, detections table and index, and thumbnails into the output folders.
+        Returns the job result, as run_pipeline does
+        '''
+        # copies, not hard links: later jobs overwrite files of the same name in place
+        csv_path = os.path.join(CSV_FOLDER, entry['video_name'] + '.csv')
+        shutil.copyfile(os.path.join(entry['folder'], 'summary.csv'), csv_path)
+        # entries cached before detections and their index were kept have none
+        paths = {}
+        for name in ['detections', 'index']:
+            paths[name] = None
+            if entry.get(name):
+                paths[name] = os.path.join(CSV_FOLDER, entry[name])
+                shutil.copyfile(os.path.join(entry['folder'], entry[name]), paths[name])
+        for image in entry['images']:
+            shutil.copyfile(os.path.join(entry['folder'], 'images', image),
+                            os.path.join(IMAGE_FOLDER, image))
+        return {'csv': csv_path,
+                'detections': paths['detections'],
+                'index': paths['index'],
+                'table_html': entry['table_html'],
+                'images': entry['images'],
+                'cached': True}
+
+    def put(self, key, video_name, csv_path, table_html, IMAGE_FOLDER, images, detections_path=None, index_path=None):
+        '''
+        Stores the results of a video, then evicts least recently used entries over the size budget.
+        video_name -- name of the video without extension, names the restored csv
+        images -- filenames of the video's thumbnails in IMAGE_FOLDER
+        detections_path -- file of the per-frame detections table
+        index_path -- file of its DetectionIndex
+        '''
+        # Build the entry in a scratch folder and move it into place in one rename,
+        # so other workers never read a partial entry
+        scratch = tempfile.mkdtemp(dir=self.folder, prefix='.put-')
+        try:
+            os.makedirs(os.path.join(scratch, 'images'))
+            shutil.copyfile(csv_path, os.path.join(scratch, 'summary.csv'))
+            with open(os.path.join(scratch, 'summary.html'), 'w') as f:
+                f.write(table_html)
+            files = {}
+            for name, path in [('detections', detections_path), ('index', index_path)]:
+                files[name] = None
+                if path is not None:
+                    files[name] = os.path.basename(path)
+                    shutil.copyfile(path, os.path.join(scratch, files[name]))
+            for image in images:
+                shutil.copyfile(os.path.join(IMAGE_FOLDER, image),
+                                os.path.join(scratch, 'images', image))
+            with open(os.path.join(scratch, 'entry.json'), 'w') as f:
+                json.dump({'video_name': video_name, 'images': images, **files}, f)
+            size = folder_size(scratch)
+            try:
+                os.rename(scratch, os.path.join(self.folder, key))
+            except OSError:
+                return  # another worker cached the same results first
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO entries (key, size, created, last_used) VALUES (?, ?, ?, ?)',
+                         (key, size, now, now))
+            evicted = self._evict(conn)
+        for old_key in evicted:
+            shutil.rmtree(os.path.join(self.folder, old_key), ignore_errors=True)
+        logger.info(f'Cached results {key[:12]} ({size / 2**20:.1f} MB), evicted {len(evicted)}')
+
+    def _evict(self, conn):
+        # Removes least recently used entries from the index until the total fits, returns their keys
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        evicted = []
+        for row in conn.execute('SELECT key, size FROM entries ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM entries WHERE key = ?', (row['key'],))
+            total -= row['size']
+            evicted.append(row['key'])
+        return evicted
+
+    def stats(self):
+        '''
+        Returns hit/miss counters and the size of the cache
+        '''
+        with self._connect() as conn:
+            counters = {row['name']: row['value']
+                        for row in conn.execute('SELECT name, value FROM counters')}
+            entries, size = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes}
+
@@ -0,0 +1,136 @@
+from werkzeug.exceptions import BadRequest
+
+import os
+import re
+import zipfile
+
+from video_app.lazy import lazy_import
+
+pyarrow = lazy_import('pyarrow', 'pyarrow.csv', 'pyarrow.ipc', 'pyarrow.parquet')
+
+# Media types of the detections table formats
+DETECTION_MIMETYPES = {'.parquet': 'application/vnd.apache.parquet',
+                       '.feather': 'application/vnd.apache.arrow.file',
+                       '.csv': 'text/csv'}
+
+# Bytes read from disk per piece of a streamed download
+READ_SIZE = 64 * 1024
+
+# Thumbnail filenames written by get_images: detection<track id>_<label>.jpg
+IMAGE_NAME = re.compile(r'detection(\d+)_(.+)\.jpe?g$')
+
+
+class _Drain:
+    """
+    Unseekable file-like sink for zipfile: collects what is written until drained.
+    zipfile falls back to data descriptors for unseekable output, so nothing is ever rewritten.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_file(path):
+    """
+    Yields a file in READ_SIZE pieces. The file is opened right away, so a missing file
+    raises before the response starts
+    """
+    f = open(path, 'rb')
+
+    def chunks():
+        with f:
+            yield from iter(lambda: f.read(READ_SIZE), b'')
+    return chunks()
+
+
+def record_batches(path):
+    """
+    Returns the schema of the columnar detections table at path,
+    and a generator of its parquet row groups / feather record batches
+    """
+    if path.endswith('.parquet'):
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        return parquet_file.schema_arrow, (parquet_file.read_row_group(i)
+                                           for i in range(parquet_file.num_row_groups))
+    reader = pyarrow.ipc.open_file(path)
+    return reader.schema, (reader.get_batch(i) for i in range(reader.num_record_batches))
+
+
+def detections_as_csv(path):
+    """
+    Yields a columnar detections table as csv, converted a batch at a time
+    """
+    schema, batches = record_batches(path)
+    yield (','.join(schema.names) + '\n').encode()
+    options = pyarrow.csv.WriteOptions(include_header=False)
+    for batch in batches:
+        sink = pyarrow.BufferOutputStream()
+        pyarrow.csv.write_csv(batch, sink, options)
+        yield sink.getvalue().to_pybytes()
+
+
+def stream_zip(files):
+    """
+    Yields a ZIP archive (stored, no compression: the images are JPEGs) of (path, arcname)
+    pairs as it is produced. Files are read lazily in READ_SIZE pieces,
+    so memory use doesn't depend on the size or number of files.
+    """
+    sink = _Drain()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+        for path, arcname in files:
+            with open(path, 'rb') as src, zf.open(zipfile.ZipInfo.from_file(path, arcname), 'w') as dst:
+                for data in iter(lambda: src.read(READ_SIZE), b''):
+                    dst.write(data)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()  # central directory
+
+
+def parse_track_range(tracks):
+    """
+    Takes 'first-last' or 'track', returns (first, last) track ids
+    """
+    first, _, last = tracks.partition('-')
+    try:
+        first = int(first)
+        last = int(last) if last else first
+    except ValueError:
+        raise BadRequest(f'Track range {tracks!r} is invalid, expected e.g. 10-50')
+    return first, last
+
+
+def select_images(images, labels=None, track_range=None):
+    """
+    Filters thumbnail filenames by class label and/or (first, last) track id range
+    """
+    selected = []
+    for image in images:
+        match = IMAGE_NAME.match(image)
+        if match is None:
+            continue
+        track_id, label = int(match.group(1)), match.group(2)
+        if labels and label not in labels:
+            continue
+        if track_range and not track_range[0] <= track_id <= track_range[1]:
+            continue
+        selected.append(image)
+    return selected
+
+
+def image_archive(image_folder, images):
+    """
+    Generator of the ZIP archive of the given thumbnails of a job
+    """
+    return stream_zip((os.path.join(image_folder, image), image) for image in images)
@@ -0,0 +1,158 @@
+import time
+import queue
+import logging
+import itertools
+import threading
+
+from video_app.lazy import lazy_import
+from video_app.metrics import FRAME_DECODE_SECONDS, FRAME_WAIT_SECONDS, FRAMES_STARVED
+
+logger = logging.getLogger('video_app')
+
+cv2 = lazy_import('cv2')
+
+# Seek with CAP_PROP_POS_FRAMES when the next keyframe is further ahead than this,
+# otherwise grab() (demux without retrieving) the frames in between
+SEEK_MIN_GAP = 30
+
+# Decoded frames held ahead of the consumer
+PREFETCH_DEPTH = 8
+
+_END = object()
+
+
+class FrameSource:
+    """
+    Frames of a video decoded ahead on a background thread, into a queue of up to `depth` frames,
+    so decoding overlaps with what the consumer does with them (inference, drawing thumbnails).
+    OpenCV releases the GIL while decoding, as torch does during inference.
+
+    Reads either the given sorted `frame_nums`, or every `stride`-th frame of the video
+    (like vid_stride) from `first` to `last` (None: to the end). Frames are numbered from 1.
+    Iterating yields (frame_num, BGR frame, preprocess(frame) or None): preprocessing,
+    e.g. FrameTracker.prepare letterboxing for the model, runs on the decoder thread too.
+
+    `stats` tells how the two sides kept up: a consumer that waits (starved) is bound by
+    decoding, a decoder blocked on a full queue is bound by the consumer.
+    """
+
+    def __init__(self, VIDEO, frame_nums=None, first=1, last=None, stride=1,
+                 preprocess=None, depth=PREFETCH_DEPTH, stage='inference'):
+        self.VIDEO = VIDEO
+        self.frame_nums = frame_nums
+        self.first = first
+        self.last = last
+        self.stride = stride
+        self.preprocess = preprocess
+        self.depth = depth
+        self.stage = stage  # labels the metrics
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopping = threading.Event()
+        self.error = None
+        self.frames = 0
+        self.starved = 0
+        self.wait_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.depth_seen = 0  # sum of the queue depths met by the consumer
+        self.started = None
+        self.finished = None
+        self._thread = None
+
+    def _targets(self):
+        if self.frame_nums is not None:
+            return iter(self.frame_nums)
+        first = self.first + (-self.first) % self.stride  # the first multiple of stride
+        return itertools.takewhile(lambda frame_num: self.last is None or frame_num <= self.last,
+                                   itertools.count(first, self.stride))
+
+    def _decode(self):
+        cap = cv2.VideoCapture(self.VIDEO)
+        position = 0  # number of the last frame read
+        try:
+            if not cap.isOpened():
+                raise ValueError(f'Unable to open video file: {self.VIDEO}')
+            for frame_num in self._targets():
+                started = time.perf_counter()
+                gap = frame_num - position - 1
+                if gap > SEEK_MIN_GAP:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num - 1)
+                elif not all(cap.grab() for _ in range(gap)):
+                    break
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                position = frame_num
+                prepared = self.preprocess(frame) if self.preprocess is not None else None
+                self.decode_seconds += time.perf_counter() - started
+                if not self._put((frame_num, frame, prepared)):
+                    return
+        except Exception as e:  # raised to the consumer
+            self.error = e
+        finally:
+            cap.release()
+        self._put(_END)
+
+    def _put(self, item):
+        # Blocks while the queue is full, returns False once the consumer is gone
+        started = time.perf_counter()
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                self.blocked_seconds += time.perf_counter() - started
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._decode, name='frame-decoder', daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                self.depth_seen += self.queue.qsize()
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    self.starved += 1
+                    waited = time.perf_counter()
+                    item = self.queue.get()
+                    self.wait_seconds += time.perf_counter() - waited
+                if item is _END:
+                    break
+                self.frames += 1
+                yield item
+        finally:
+            self.close()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        '''
+        Stops the decoder, e.g. when the consumer stops early
+        '''
+        if self.finished is not None:
+            return
+        self.stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.finished = time.perf_counter()
+        FRAME_DECODE_SECONDS.labels(self.stage).inc(self.decode_seconds)
+        FRAME_WAIT_SECONDS.labels(self.stage).inc(self.wait_seconds)
+        FRAMES_STARVED.labels(self.stage).inc(self.starved)
+        logger.info(f'Frame source ({self.stage}): {self.stats()}')
+
+    def stats(self):
+        '''
+        Queue depth, starvation and utilization of the decoder and the consumer, over the source's lifetime
+        '''
+        wall = ((self.finished or time.perf_counter()) - self.started) if self.started else 0
+        return {'frames': self.frames,
+                'depth': self.depth,
+                'mean_depth': round(self.depth_seen / (self.frames + 1), 2),
+                'starved': self.starved,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'decode_utilization': round(self.decode_seconds / wall, 3) if wall else None,
+                'consumer_utilization': round(1 - self.wait_seconds / wall, 3) if wall else None,
+                'decoder_blocked_seconds': round(self.blocked_seconds, 3)}
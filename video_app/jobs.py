@@ -0,0 +1,411 @@
+from flask import current_app
+from dotenv import load_dotenv
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+
+from video_app.metrics import JOBS, STAGE_SECONDS, timed
+from video_app.models import resolve_model_type
+from video_app.profiling import SamplingProfiler, profiling
+from video_app.progress import Progress
+from video_app.query import DetectionIndex
+from video_app.sharding import process_video_sharded
+from video_app.utils import Detections
+
+logger = logging.getLogger('video_app')
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+ORPHANED_ERROR = 'The worker processing this job exited before it finished. Please try again.'
+
+
+class JobStore:
+    """
+    Persists job state in a sqlite database on local disk.
+    Every gunicorn worker opens the same file, so a job submitted to one worker
+    can be polled through any other, and state survives worker restarts.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                id TEXT PRIMARY KEY,
+                                status TEXT NOT NULL,
+                                params TEXT NOT NULL,
+                                result TEXT,
+                                error TEXT,
+                                pid INTEGER,
+                                created REAL,
+                                updated REAL,
+                                uploads TEXT,
+                                progress TEXT,
+                                cache_key TEXT,
+                                owner TEXT)''')
+            # databases created before S3 upload reports, progress, deduplication and owner identities
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(jobs)')]
+            for column in ['uploads', 'progress', 'cache_key', 'owner']:
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_cache_key ON jobs (cache_key)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, params, job_id=None, attach=False):
+        '''
+        Inserts a new queued job owned by this process, returns its id.
+        attach -- if a job with the same params['cache_key'] is queued or running,
+                  return its id instead of creating one
+        '''
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            if attach and params.get('cache_key'):
+                # lock before looking, so two workers can't both start the same video
+                conn.execute('BEGIN IMMEDIATE')
+                active_id = self._find_active(conn, params['cache_key'])
+                if active_id is not None:
+                    return active_id
+            conn.execute('INSERT INTO jobs (id, status, params, pid, created, updated, cache_key, owner) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (job_id, QUEUED, json.dumps(params), os.getpid(), now, now, params.get('cache_key'),
+                          process_identity()))
+        return job_id
+
+    def find_active(self, cache_key):
+        '''
+        Returns the id of a queued or running job with this cache key, or None
+        '''
+        with self._connect() as conn:
+            return self._find_active(conn, cache_key)
+
+    def _find_active(self, conn, cache_key):
+        rows = conn.execute('SELECT id, pid, owner FROM jobs WHERE cache_key = ? AND status IN (?, ?) '
+                            'ORDER BY created', (cache_key, QUEUED, RUNNING)).fetchall()
+        for row in rows:
+            if owner_is_alive(row['owner'], row['pid']):
+                return row['id']
+        return None  # jobs of exited workers are marked failed when next read, or by recover()
+
+    def count_active(self):
+        '''
+        Returns the number of queued and running jobs: {status: count}
+        '''
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) FROM jobs WHERE status IN (?, ?) GROUP BY status',
+                                (QUEUED, RUNNING)).fetchall()
+        counts = {QUEUED: 0, RUNNING: 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def get(self, job_id):
+        '''
+        Returns the job as a dict, or None if there is no such job.
+        An unfinished job whose worker has exited (e.g. killed by gunicorn on timeout) is marked failed first
+        '''
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row['status'] in (QUEUED, RUNNING) and not owner_is_alive(row['owner'], row['pid']):
+            self._fail_orphan(job_id)
+            return self.get(job_id)
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['uploads'] = json.loads(job['uploads']) if job['uploads'] else None
+        job['progress'] = json.loads(job['progress']) if job['progress'] else None
+        return job
+
+    def update(self, job_id, status=None, result=None, error=None):
+        '''
+        Updates the status and/or outcome of a job
+        '''
+        fields = {'updated': time.time()}
+        if status is not None:
+            fields['status'] = status
+        if result is not None:
+            fields['result'] = json.dumps(result)
+        if error is not None:
+            fields['error'] = error
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._connect() as conn:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?',
+                         (*fields.values(), job_id))
+
+    def is_active(self, job_id):
+        '''
+        Whether a job is still queued or running
+        '''
+        job = self.get(job_id)
+        return job is not None and job['status'] in (QUEUED, RUNNING)
+
+    def set_uploads(self, job_id, report):
+        '''
+        Records the report of a job's background S3 uploads
+        '''
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET uploads = ? WHERE id = ?',
+                         (json.dumps(report), job_id))
+
+    def set_progress(self, job_id, progress):
+        '''
+        Records the progress of a running job, see Progress
+        '''
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET progress = ? WHERE id = ?',
+                         (json.dumps(progress), job_id))
+
+    def recover(self):
+        '''
+        Marks unfinished jobs whose owning process has exited as failed,
+        so their status is reported instead of staying queued forever.
+        Returns the number of jobs recovered.
+        '''
+        with self._connect() as conn:
+            rows = conn.execute('SELECT id, pid, owner FROM jobs WHERE status IN (?, ?)',
+                                (QUEUED, RUNNING)).fetchall()
+        recovered = sum(self._fail_orphan(row['id']) for row in rows
+                        if not owner_is_alive(row['owner'], row['pid']))
+        if recovered:
+            logger.info(f'Marked {recovered} orphaned job(s) as failed')
+        return recovered
+
+    def _fail_orphan(self, job_id):
+        # only if still unfinished, returns whether it was marked
+        with self._connect() as conn:
+            marked = conn.execute('UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ? AND status IN (?, ?)',
+                                  (FAILED, ORPHANED_ERROR, time.time(), job_id, QUEUED, RUNNING)).rowcount
+        if marked:
+            logger.info(f'Job {job_id} marked failed, its worker has exited')
+        return marked
+
+
+def process_identity(pid=None):
+    """
+    Identity of a process which, unlike its pid, isn't reused by a later process:
+    '<pid>:<start time in clock ticks since boot>:<boot id>'. Just the pid without /proc
+    """
+    pid = pid or os.getpid()
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # the command name may hold spaces and parentheses, the fields after it don't
+            start_time = f.read().rpartition(')')[2].split()[19]
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            boot_id = f.read().strip()
+    except (OSError, IndexError):
+        return str(pid)
+    return f'{pid}:{start_time}:{boot_id}'
+
+
+def owner_is_alive(owner, pid):
+    """
+    Whether the process that created a job still runs: its pid is alive and is still the same process,
+    not a later one given the same pid (e.g. after a container restart)
+    """
+    if not pid_is_alive(pid):
+        return False
+    return owner is None or process_identity(pid) == owner  # jobs created before owners were recorded
+
+
+def pid_is_alive(pid):
+    """
+    Checks whether a process with the given pid is still running
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Bounded pool of background workers which run the processing pipeline
+    off the request thread. State is recorded in a JobStore.
+    """
+
+    def __init__(self, app, store, max_workers):
+        self.app = app
+        self.store = store
+        # threads are only started on first submit, so this is safe to create before fork
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='job-worker')
+
+    def submit(self, params, job_id=None):
+        '''
+        Records a new job and schedules it, returns the job id.
+        If the same video with the same settings is already queued or running,
+        returns the id of that job instead, unless this one is profiled
+        '''
+        # an id of its own, so a job attached to is told apart from the one created
+        job_id = job_id or uuid.uuid4().hex
+        run_id = self.store.create(params, job_id, attach=not params.get('profile'))
+        if run_id != job_id:
+            logger.info(f'Job {job_id} attached to job {run_id}, which processes the same video')
+            JOBS.labels('attached').inc()
+            return run_id
+        self.executor.submit(self._run, run_id, params, time.time())
+        logger.info(f'Job {run_id} queued')
+        return run_id
+
+    def _run(self, job_id, params, submitted):
+        with self.app.app_context():
+            self.store.update(job_id, status=RUNNING)
+            logger.info(f'Job {job_id} started')
+            model_type = resolve_model_type(params.get('model'))
+            STAGE_SECONDS.labels('queue_wait', model_type).observe(time.time() - submitted)
+            progress = Progress(partial(self.store.set_progress, job_id))
+            profiler = None
+            if params.get('profile') or self.app.config['PROFILE_JOBS']:
+                profiler = SamplingProfiler(self.app.config['PROFILE_INTERVAL_MS'] / 1000)
+            try:
+                with profiling(profiler), timed('pipeline', model_type):
+                    result = run_pipeline(params, job_id, progress)
+            except Exception as e:
+                logger.exception(f'Job {job_id} failed')
+                self.store.update(job_id, status=FAILED, error=str(e))
+                JOBS.labels('failed').inc()
+                return
+            finally:
+                if profiler is not None:
+                    self._write_profile(job_id, profiler)
+            self.store.update(job_id, status=DONE, result=result)
+            JOBS.labels('done').inc()
+            progress.start('done')
+            logger.info(f'Job {job_id} finished')
+
+    def _write_profile(self, job_id, profiler):
+        # next to the job's results, failed jobs included
+        try:
+            path = profiler.write(self.app.workspaces.get(job_id).root)
+            logger.info(f'Job {job_id} profile: {path}, {profiler.summary()}')
+        except OSError as e:
+            logger.error(f'Could not write the profile of job {job_id}: {e}')
+
+
+def job_events(store, job_id, poll=0.5, heartbeat=15, max_seconds=120):
+    """
+    Yields the Server-Sent Events of a job: a 'progress' event with its status and progress
+    on every change, then a final 'done' or 'failed' event.
+    The stream ends after max_seconds, below proxy read timeouts; browsers reconnect by themselves
+    """
+    yield 'retry: 1000\n\n'
+    started = last_sent = time.monotonic()
+    previous = None
+    while time.monotonic() - started < max_seconds:
+        job = store.get(job_id)
+        if job is None:
+            yield f"event: failed\ndata: {json.dumps({'status': FAILED, 'error': 'job not found'})}\n\n"
+            return
+        state = {'status': job['status'], 'progress': job['progress'], 'error': job['error']}
+        if state != previous:
+            event = job['status'] if job['status'] in (DONE, FAILED) else 'progress'
+            yield f'event: {event}\ndata: {json.dumps(state)}\n\n'
+            if event != 'progress':
+                return
+            previous = state
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= heartbeat:
+            yield ': heartbeat\n\n'  # keeps proxies from closing an idle connection
+            last_sent = time.monotonic()
+        time.sleep(poll)
+
+
+def run_pipeline(params, job_id=None, progress=None):
+    """
+    process video, write images, csv & detections table to the job's workspace,
+    and start uploading them to s3. Runs inside a job worker with an app context.
+    Returns the job result: csv, detections and index paths, summary table html, image filenames,
+    the number of frames motion gating skipped, and the stats of decoding ahead of inference.
+    Uploads finish in the background, their report is recorded with the job.
+    progress -- Progress of the job through inference, thumbnails and upload
+    """
+    load_dotenv()
+    progress = progress or Progress()
+
+    ### Process video ###
+    selected_model_type = params.get('model')
+    detectionsInVideo = Detections(
+        frame_strategy=current_app.config['THUMBNAIL_STRATEGY'],
+        model_type=resolve_model_type(selected_model_type),
+        motion_threshold=current_app.config['MOTION_THRESHOLD'])
+    VIDEO = params['video']
+    CLASSES = params.get(
+        'classes', [0, 1, 2, 3, 4, 5, 6, 7, 8])  # default: people & vehicles
+    logger.info(f"VIDEO: {VIDEO}")
+    stride = params.get('stride', 1)
+    SHARDS = current_app.config['SHARDS']
+
+    if SHARDS > 1:
+        # shard processes load their own models, the class names included
+        process_video_sharded(detectionsInVideo, selected_model_type,
+                              VIDEO, CLASSES, SHARDS, stride,
+                              backend=current_app.model_registry.backend_for(selected_model_type),
+                              progress=progress)
+    else:
+        # Lease the model from the registry, loading it on first use
+        with current_app.model_registry.lease(selected_model_type) as model:
+            detectionsInVideo.process_video(
+                model, VIDEO, CLASSES, stride=stride, progress=progress)
+
+    # Write csv & images locally, in the job's own workspace
+    workspace = current_app.workspaces.create(job_id or uuid.uuid4().hex)
+    csv_path = detectionsInVideo.write_csv(workspace.csv_folder, VIDEO)
+    detections_path = detectionsInVideo.write_detections(
+        workspace.csv_folder, VIDEO, current_app.config['DETECTIONS_FORMAT'])
+    with timed('index_build', detectionsInVideo.model_type):
+        index_path = DetectionIndex.build(detectionsInVideo.df, detectionsInVideo.labels).save(
+            os.path.join(workspace.csv_folder, 'detections_index.npz'))
+    images = sorted(detectionsInVideo.write_images(VIDEO, workspace.image_folder, progress))
+
+    # Write csv & images to S3 Bucket, off the critical path of the results
+    progress.start('upload')
+    current_app.s3_uploader.upload_many_async(
+        [csv_path, detections_path] + [os.path.join(workspace.image_folder, image) for image in images],
+        callback=partial(current_app.job_store.set_uploads, job_id) if job_id else None,
+        prefix=f'{job_id}/' if job_id else '')
+
+    # Keep the results for identical submissions
+    if params.get('cache_key'):
+        try:
+            current_app.result_cache.put(params['cache_key'], os.path.basename(csv_path)[:-4],
+                                         csv_path, detectionsInVideo.html, workspace.image_folder,
+                                         images, detections_path, index_path)
+        except OSError as e:
+            logger.error(f'Could not cache the results of {VIDEO}: {e}')
+
+    return {'csv': csv_path,
+            'detections': detections_path,
+            'index': index_path,
+            'table_html': detectionsInVideo.html,
+            'images': images,
+            'frames_skipped': detectionsInVideo.frames_skipped,
+            'frame_source': detectionsInVideo.frame_source_stats}
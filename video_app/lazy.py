@@ -0,0 +1,59 @@
+import time
+import logging
+import importlib
+import resource
+
+logger = logging.getLogger('video_app')
+
+# The ML stack and other heavy modules, imported by `preload`: those deferred with lazy_import,
+# and those imported inside the functions that need them (ultralytics, torch)
+PRELOAD_MODULES = ['torch', 'ultralytics', 'ultralytics.trackers.byte_tracker', 'ultralytics.utils.ops', 'lap']
+
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is used, then imports it
+    along with the given submodules, e.g. `pd = lazy_import('pandas')` reads like `import pandas as pd`
+    but pandas is only imported by the first request that needs it.
+    """
+
+    def __init__(self, name, submodules=()):
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            for submodule in self._submodules:
+                importlib.import_module(submodule)
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}{" (imported)" if self._module is not None else ""}>'
+
+
+def lazy_import(name, *submodules):
+    """
+    A LazyModule of name. Submodules are imported with it, e.g.
+    `pyarrow = lazy_import('pyarrow', 'pyarrow.parquet')` for `pyarrow.parquet.ParquetFile`
+    """
+    PRELOAD_MODULES.extend(submodules or [name])
+    return LazyModule(name, submodules)
+
+
+def preload():
+    """
+    Imports the heavy modules now, e.g. in the gunicorn master before it forks the workers
+    (--preload), so they share them copy-on-write instead of each importing its own
+    """
+    started = time.perf_counter()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    names = list(dict.fromkeys(PRELOAD_MODULES))
+    for name in names:
+        importlib.import_module(name)
+    logger.info(f'Preloaded {len(names)} modules in {time.perf_counter() - started:.1f}s, '
+                f'+{(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024:.0f} MB')
@@ -0,0 +1,88 @@
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from contextlib import contextmanager
+
+import os
+
+from video_app import profiling
+
+# Latency buckets in seconds, from quick table operations to whole videos
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Throughput buckets in frames per second
+FPS_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 240, 480)
+
+# Stages: queue_wait, model_load, inference (decode + inference + tracking), get_df, interpolate,
+# summary, middle_frames, thumbnails, csv_write, detections_write, index_build, pipeline (whole job)
+STAGE_SECONDS = Histogram('eyespy_stage_seconds', 'Duration of processing pipeline stages',
+                          ['stage', 'model'], buckets=BUCKETS)
+FRAMES = Counter('eyespy_frames', 'Video frames processed', ['model'])
+FRAMES_SKIPPED = Counter('eyespy_frames_skipped', 'Video frames whose inference was skipped by motion gating',
+                         ['model'])
+# Frame sources decoding ahead of inference and thumbnails (see frames.FrameSource), by stage
+FRAME_DECODE_SECONDS = Counter('eyespy_frame_decode_seconds', 'Time spent decoding and preparing frames ahead',
+                               ['stage'])
+FRAME_WAIT_SECONDS = Counter('eyespy_frame_wait_seconds', 'Time consumers waited for decoded frames', ['stage'])
+FRAMES_STARVED = Counter('eyespy_frames_starved', 'Frames the consumer had to wait for', ['stage'])
+DETECTIONS = Counter('eyespy_detections', 'Detections found, before interpolation', ['model'])
+INFERENCE_FPS = Histogram('eyespy_inference_fps', 'Video frames per second of the inference stage, per job',
+                          ['model'], buckets=FPS_BUCKETS)
+JOBS = Counter('eyespy_jobs', 'Jobs by outcome: done, failed, cached, attached', ['outcome'])
+S3_UPLOAD_SECONDS = Histogram('eyespy_s3_upload_seconds', 'Duration of S3 uploads of single files, retries included',
+                              ['outcome'], buckets=BUCKETS)
+S3_UPLOAD_BYTES = Counter('eyespy_s3_upload_bytes', 'Bytes uploaded to S3')
+
+
+@contextmanager
+def timed(stage, model=''):
+    """
+    Context manager recording the duration of a stage, e.g. `with timed('get_df', 'nano'):`,
+    also a stage of the job's profile when it is profiled
+    """
+    with STAGE_SECONDS.labels(stage, model).time(), profiling.stage(stage):
+        yield
+
+
+class SharedStateCollector:
+    """
+    Metrics read at scrape time from the state every worker shares on disk:
+    jobs queued and running (the queue depth) from the JobStore, and the result cache counters
+    """
+
+    def __init__(self, job_store, result_cache):
+        self.job_store = job_store
+        self.result_cache = result_cache
+
+    def collect(self):
+        jobs = GaugeMetricFamily('eyespy_jobs_active', 'Jobs queued or running, in all workers', labels=['status'])
+        for status, count in self.job_store.count_active().items():
+            jobs.add_metric([status], count)
+        yield jobs
+
+        stats = self.result_cache.stats()
+        for name in ['hits', 'misses']:
+            yield CounterMetricFamily(f'eyespy_result_cache_{name}', f'Result cache {name}', value=stats[name])
+        yield GaugeMetricFamily('eyespy_result_cache_bytes', 'Size of the result cache', value=stats['bytes'])
+
+
+class _ProcessCollector:
+    # The default registry of this process, when it is the only one serving requests
+    def collect(self):
+        return REGISTRY.collect()
+
+
+def render_metrics(job_store, result_cache):
+    """
+    Metrics in the Prometheus text format.
+    Under gunicorn, PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py) and every worker
+    writes its metrics there, so any worker answers for all of them
+    """
+    registry = CollectorRegistry()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(_ProcessCollector())
+    registry.register(SharedStateCollector(job_store, result_cache))
+    return generate_latest(registry)
@@ -1,18 +1,267 @@
-from ultralytics import YOLO
-import lap
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
 
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
 
-def load_model(model_type):
+from video_app.metrics import timed
 
-    weights_selection_mapping = {
-        "nano": "yolov8n.pt",
-        "medium": "yolov8m.pt",
-        "XL": "yolov8x.pt",
-        "custom": "best.pt"
-    }
+logger = logging.getLogger('video_app')
+
+weights_selection_mapping = {
+    "nano": "yolov8n.pt",
+    "medium": "yolov8m.pt",
+    "XL": "yolov8x.pt",
+    "custom": "best.pt"
+}
+
+
+def resolve_model_type(model_type):
+    """
+    Unknown model types fall back to nano, like load_model does
+    """
+    return model_type if model_type in weights_selection_mapping else "nano"
+
+
+# CPU inference backends: eager PyTorch, or a format exported once from the weights
+BACKENDS = ['pytorch', 'onnx', 'onnx-int8', 'openvino']
+
+# Exported models, cached per weights file hash: weights/exported/<hash>/<backend>/
+EXPORT_FOLDER = 'weights/exported'
+
+
+def load_model(model_type, backend='pytorch'):
+    """
+    Loads the YOLO model of a model type with the given inference backend.
+    Backends other than pytorch are exported from the weights on first use
+    and loaded from the on-disk cache afterwards.
+    """
+    from ultralytics import YOLO  # the ML stack is imported with the first model, or by lazy.preload
 
     model_weights = 'weights/' + \
         weights_selection_mapping.get(
             model_type, "yolov8n.pt")  # default to nano
-    model = YOLO(model_weights)
-    return model
+    if backend == 'pytorch':
+        return YOLO(model_weights)
+    return YOLO(export_model(model_weights, backend), task='detect')
+
+
+def weights_hash(path):
+    """
+    Short sha256 of a weights file, keys its exported models
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def export_model(weights, backend):
+    """
+    Returns the path of the weights exported for `backend`, exporting them if not cached.
+
+    onnx -- ONNX Runtime, fp32
+    onnx-int8 -- ONNX Runtime with weights dynamically quantized to int8
+    openvino -- OpenVINO IR, fp32
+    """
+    if backend not in BACKENDS:
+        raise ValueError(
+            f'Unknown backend {backend!r}, expected one of {BACKENDS}')
+    export_dir = os.path.join(EXPORT_FOLDER, weights_hash(weights), backend)
+    artifact = os.path.join(export_dir, 'model_openvino_model' if backend == 'openvino' else 'model.onnx')
+    if os.path.exists(artifact):
+        return artifact
+
+    from ultralytics import YOLO
+
+    # Export in a scratch directory, then move it into place in one rename,
+    # so concurrent workers never load a half-written export
+    os.makedirs(os.path.dirname(export_dir), exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=os.path.dirname(export_dir))
+    try:
+        scratch_weights = os.path.join(scratch, 'model.pt')
+        shutil.copyfile(weights, scratch_weights)
+        logger.info(f'Exporting {weights} for the {backend} backend')
+        model = YOLO(scratch_weights)
+        if backend == 'openvino':
+            model.export(format='openvino')
+        else:
+            exported = model.export(format='onnx')
+            if backend == 'onnx-int8':
+                quantize_onnx(exported)
+        os.remove(scratch_weights)
+        os.rename(scratch, export_dir)
+    except OSError:
+        if not os.path.exists(artifact):
+            raise
+        # another worker finished the same export first
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return artifact
+
+
+def quantize_onnx(path):
+    """
+    Quantizes the weights of an ONNX model to int8 in place (dynamic quantization),
+    keeping the metadata ultralytics reads class names and image size from
+    """
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized = path + '.int8'
+    quantize_dynamic(path, quantized, weight_type=QuantType.QUInt8)
+    model = onnx.load(quantized)
+    del model.metadata_props[:]
+    model.metadata_props.extend(onnx.load(path).metadata_props)
+    onnx.save(model, path)
+    os.remove(quantized)
+
+
+def parse_backends(pairs):
+    """
+    Takes ['model_type:backend', ...] from config,
+    returns {model_type: backend}
+    """
+    backends = {}
+    for pair in pairs:
+        model_type, _, backend = pair.partition(':')
+        if backend not in BACKENDS:
+            raise ValueError(
+                f'Unknown backend {backend!r} for model {model_type}, expected one of {BACKENDS}')
+        backends[model_type.strip()] = backend
+    return backends
+
+
+def model_memory(model):
+    """
+    Estimated resident size of a loaded model in bytes
+    """
+    try:
+        return sum(p.numel() * p.element_size() for p in model.model.parameters())
+    except AttributeError:
+        pass
+    # exported backends: size of the model files
+    path = str(model.ckpt_path)
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models, keyed by model type.
+
+    - LRU eviction keeps the estimated size of the loaded models under `budget_mb`.
+      Models currently leased are never evicted; the most recent model is always kept.
+    - Loading is single-flight: concurrent first requests for a model wait for one load.
+    - `preload` loads models at startup. Called in the gunicorn master (`--preload`),
+      the weights are inherited copy-on-write by every forked worker.
+
+    YOLO models (and their predictors) are not thread-safe, so a lease
+    also serializes use of each model between threads of this process.
+
+    backends -- {model_type: backend} to load each model with, pytorch if not given
+    """
+
+    def __init__(self, budget_mb, backends=None):
+        self.budget = budget_mb * 1024 * 1024
+        self.backends = backends or {}
+        self._lock = threading.Lock()
+        self._models = OrderedDict()  # model_type: (model, size in bytes)
+        self._loading = {}  # model_type: Future of the load in progress
+        self._use_locks = {}  # model_type: Lock held while the model is in use
+        self._leases = {}  # model_type: number of active leases
+
+    def get(self, model_type):
+        '''
+        Returns the loaded model, loading it if needed
+        '''
+        model_type = resolve_model_type(model_type)
+        with self._lock:
+            if model_type in self._models:
+                self._models.move_to_end(model_type)
+                return self._models[model_type][0]
+            future = self._loading.get(model_type)
+            loader = future is None
+            if loader:
+                future = self._loading[model_type] = Future()
+
+        if not loader:
+            return future.result()
+
+        try:
+            logger.info(
+                f'Loading model {model_type} ({self.backend_for(model_type)})')
+            with timed('model_load', model_type):
+                model = load_model(model_type, self.backend_for(model_type))
+        except Exception as e:
+            with self._lock:
+                del self._loading[model_type]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._models[model_type] = (model, model_memory(model))
+            del self._loading[model_type]
+            self._evict()
+        future.set_result(model)
+        return model
+
+    def backend_for(self, model_type):
+        '''
+        Returns the inference backend a model type is loaded with
+        '''
+        return self.backends.get(resolve_model_type(model_type), 'pytorch')
+
+    @contextmanager
+    def lease(self, model_type):
+        '''
+        Context manager giving exclusive use of a model, pinned against eviction
+        '''
+        model_type = resolve_model_type(model_type)
+        with self._lock:
+            use_lock = self._use_locks.setdefault(model_type, threading.Lock())
+            self._leases[model_type] = self._leases.get(model_type, 0) + 1
+        try:
+            with use_lock:
+                yield self.get(model_type)
+        finally:
+            with self._lock:
+                self._leases[model_type] -= 1
+
+    def preload(self, model_types):
+        '''
+        Loads the given models now, skipping any that fail
+        '''
+        for model_type in model_types:
+            try:
+                self.get(model_type)
+            except Exception as e:
+                logger.error(f'Could not preload model {model_type}: {e}')
+
+    def loaded(self):
+        '''
+        Returns {model_type: estimated size in bytes} of the loaded models, least recently used first
+        '''
+        with self._lock:
+            return {model_type: size for model_type, (_, size) in self._models.items()}
+
+    def _evict(self):
+        # Caller holds self._lock
+        total = sum(size for _, size in self._models.values())
+        for model_type in list(self._models)[:-1]:
+            if total <= self.budget:
+                break
+            if self._leases.get(model_type):
+                continue
+            _, size = self._models.pop(model_type)
+            total -= size
+            logger.info(
+                f'Evicted model {model_type} ({size / 2**20:.0f} MB) to stay within the model memory budget')
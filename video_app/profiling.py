@@ -0,0 +1,190 @@
+from contextlib import contextmanager, nullcontext
+from collections import Counter
+
+import os
+import sys
+import hmac
+import json
+import time
+import hashlib
+import logging
+import sysconfig
+import threading
+
+logger = logging.getLogger('video_app')
+
+# Request header enabling the profile of the job a request submits: '<expiry unix time>.<hmac>'
+PROFILE_HEADER = 'X-Eyespy-Profile'
+
+# Files written to the job's workspace
+FOLDED_FILENAME = 'profile.folded'
+SUMMARY_FILENAME = 'profile.json'
+
+# Stack frames kept per sample, from the outermost
+MAX_DEPTH = 128
+
+# Paths of modules are shown from these folders
+_PREFIXES = ['site-packages' + os.sep, 'dist-packages' + os.sep, sysconfig.get_paths()['stdlib'] + os.sep,
+             os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep]
+
+# The profiler of the job running on this thread, if it is profiled
+_local = threading.local()
+
+
+class SamplingProfiler:
+    """
+    Wall clock sampling profiler of one thread, e.g. a job worker.
+
+    A background thread reads the Python stack of the profiled thread every `interval` seconds,
+    prefixed by the pipeline stages it is in (see `stage`, entered by metrics.timed),
+    and counts identical stacks. Time spent in native code (inference, decoding, waits)
+    is counted at the Python call that entered it.
+    The profiled thread itself only pays for entering and leaving stages.
+
+    `write` saves the stacks in the folded format of flamegraph.pl, speedscope and inferno,
+    and the wall time of each stage as JSON.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = Counter()
+        self.stages = []  # stages the profiled thread is in, outermost first
+        self.stage_seconds = Counter()
+        self._names = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._ident = None
+        self._started = None
+        self.seconds = 0
+
+    def start(self, ident=None):
+        '''
+        Starts sampling the thread of `ident`, by default the calling thread
+        '''
+        self._ident = ident or threading.get_ident()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.seconds = time.perf_counter() - self._started if self._started else 0
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Marks the samples taken inside, and records the stage's wall time
+        '''
+        self.stages.append(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[';'.join(self.stages)] += time.perf_counter() - started
+            self.stages.pop()
+
+    def _name(self, code):
+        # 'function (path/file.py:line)', path shortened to the package
+        name = self._names.get(code)
+        if name is None:
+            path = code.co_filename
+            for prefix in _PREFIXES:
+                if prefix in path:
+                    path = path.split(prefix, 1)[1]
+                    break
+            name = self._names[code] = f'{code.co_name} ({path}:{code.co_firstlineno})'
+        return name
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._ident)
+            if frame is None:  # the thread has exited
+                return
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            # folded frame names can't hold ';'
+            names = [self._name(code).replace(';', ',') for code in reversed(stack[-MAX_DEPTH:])]
+            self.samples[';'.join(list(self.stages) + names)] += 1
+
+    def summary(self):
+        return {'interval_ms': self.interval * 1000,
+                'samples': sum(self.samples.values()),
+                'seconds': round(self.seconds, 3),
+                'stage_seconds': {stage: round(seconds, 3) for stage, seconds in self.stage_seconds.items()}}
+
+    def write(self, folder):
+        '''
+        Writes profile.folded and profile.json to folder, returns the path of profile.folded
+        '''
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, FOLDED_FILENAME)
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        with open(os.path.join(folder, SUMMARY_FILENAME), 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+        return path
+
+
+@contextmanager
+def profiling(profiler):
+    """
+    Profiles the calling thread inside, when profiler is not None
+    """
+    if profiler is None:
+        yield None
+        return
+    _local.profiler = profiler
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _local.profiler = None
+
+
+def stage(name):
+    """
+    Stage of the profile of this thread, a no-op when it isn't profiled
+    """
+    profiler = getattr(_local, 'profiler', None)
+    return nullcontext() if profiler is None else profiler.stage(name)
+
+
+def sign(secret, ttl=3600):
+    """
+    Value of the PROFILE_HEADER, valid for ttl seconds
+    """
+    expires = str(int(time.time() + ttl))
+    return f'{expires}.{_signature(secret, expires)}'
+
+
+def verify(secret, value):
+    """
+    Whether value is a PROFILE_HEADER signed with secret, and not expired
+    """
+    if not secret or not value:
+        return False
+    expires, _, signature = value.partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(secret, expires))
+
+
+def _signature(secret, expires):
+    return hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+
+
+if __name__ == '__main__':
+    # Prints a header value for a profiled submission, e.g.
+    # curl -H "X-Eyespy-Profile: $(python -m video_app.profiling)" ...
+    from config import Config
+    if not Config.PROFILE_SECRET:
+        sys.exit('PROFILE_SECRET is not set')
+    print(sign(Config.PROFILE_SECRET, int(sys.argv[1]) if len(sys.argv) > 1 else 3600))
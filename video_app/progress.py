@@ -0,0 +1,71 @@
+import time
+import logging
+
+logger = logging.getLogger('video_app')
+
+# Stages of a job, in order. Uploads run in the background: the job is done once they have started
+STAGES = ['queued', 'inference', 'thumbnails', 'upload', 'done']
+
+# Weight of the latest measurement in the smoothed fps
+FPS_SMOOTHING = 0.3
+
+
+class Progress:
+    """
+    Progress of a job through its stages, published with `publish(state)`,
+    e.g. JobStore.set_progress. Without `publish` updates are only kept here.
+
+    `update` is called by processing loops for every frame; it's published at most
+    every `interval` seconds, stage changes are published right away.
+    fps is smoothed over the recent updates, and the ETA of the stage follows from it.
+    """
+
+    def __init__(self, publish=None, interval=0.5):
+        self.publish = publish
+        self.interval = interval
+        self.stage = 'queued'
+        self.frames_done = 0
+        self.total_frames = None
+        self.fps = None
+        self._last = (time.monotonic(), 0)  # time and frames_done of the last measurement
+
+    def start(self, stage, total_frames=None):
+        '''
+        Enters a stage, with the number of frames it will go through if known
+        '''
+        self.stage = stage
+        self.frames_done = 0
+        self.total_frames = total_frames or None
+        self.fps = None
+        self._last = (time.monotonic(), 0)
+        self._publish()
+
+    def update(self, frames_done):
+        now = time.monotonic()
+        self.frames_done = frames_done
+        last_time, last_frames = self._last
+        if now - last_time < self.interval:
+            return
+        fps = (frames_done - last_frames) / (now - last_time)
+        self.fps = fps if self.fps is None else FPS_SMOOTHING * fps + (1 - FPS_SMOOTHING) * self.fps
+        self._last = (now, frames_done)
+        self._publish()
+
+    def state(self):
+        remaining = self.total_frames - self.frames_done if self.total_frames else None
+        return {'stage': self.stage,
+                'frames_done': self.frames_done,
+                'total_frames': self.total_frames,
+                'percent': round(100 * min(self.frames_done / self.total_frames, 1), 1)
+                if self.total_frames else None,
+                'fps': round(self.fps, 1) if self.fps is not None else None,
+                'eta': round(max(remaining, 0) / self.fps, 1)
+                if remaining is not None and self.fps else None}
+
+    def _publish(self):
+        if self.publish is None:
+            return
+        try:
+            self.publish(self.state())
+        except Exception:  # progress is informative, never fail the job over it
+            logger.exception('Could not publish progress')
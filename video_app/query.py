@@ -0,0 +1,200 @@
+from functools import lru_cache
+from werkzeug.exceptions import BadRequest
+
+import os
+import logging
+
+import numpy as np
+
+from video_app.utils import DETECTION_COLUMNS, DETECTION_DTYPES, seconds_to_mmss
+
+logger = logging.getLogger('video_app')
+
+# Cells per side of the spatial grid over box centers
+GRID_SIZE = 32
+
+# Largest page of detections a query returns
+MAX_LIMIT = 1000
+
+
+def _groups(keys):
+    # Groups row positions by key: rows of keys[i] are order[starts[i]:starts[i + 1]], in time order
+    order = np.argsort(keys, kind='stable')
+    values, starts = np.unique(keys[order], return_index=True)
+    return values, np.append(starts, len(keys)).astype(np.int64), order.astype(np.int32)
+
+
+class DetectionIndex:
+    """
+    Indexes over a job's per-frame detections table, for interactive queries.
+
+    - rows sorted by timestamp: a time range is two binary searches
+    - rows grouped by class_id, by track_id, and by the cell of the box center
+      on a GRID_SIZE x GRID_SIZE grid over the frame; each group is in time order
+
+    A query starts from the smallest matching group clipped to the time range,
+    then checks the exact conditions on those rows only, so its cost depends on
+    the number of candidate detections, not on the length of the video.
+    Saved next to the detections table as an .npz of plain arrays.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.labels = [str(label) for label in arrays['labels']]
+        self.cell_width, self.cell_height = arrays['cell_size']
+
+    def __len__(self):
+        return len(self.arrays['timestamp'])
+
+    @classmethod
+    def build(cls, df, labels):
+        '''
+        df -- per-frame detections table (see get_df)
+        labels -- dict of class names by class id, e.g. model.names
+        '''
+        # compact dtypes, but timestamps stay float64: binary searches would round the times asked for
+        df = df[DETECTION_COLUMNS].astype({**DETECTION_DTYPES, 'timestamp': 'float64'}).sort_values(
+            'timestamp', kind='stable')
+        arrays = {column: df[column].to_numpy() for column in DETECTION_COLUMNS}
+        arrays['labels'] = np.array([labels.get(i, str(i)) for i in range(max(labels) + 1)] if labels else [])
+
+        # the grid covers the boxes, the frame size isn't stored in the table
+        width = max(float(df['xmax'].max()) if len(df) else 0, 1)
+        height = max(float(df['ymax'].max()) if len(df) else 0, 1)
+        arrays['cell_size'] = np.array([width / GRID_SIZE, height / GRID_SIZE])
+        cx = (arrays['xmin'] + arrays['xmax']) / 2
+        cy = (arrays['ymin'] + arrays['ymax']) / 2
+        cells = (np.clip((cy / arrays['cell_size'][1]).astype(np.int64), 0, GRID_SIZE - 1) * GRID_SIZE
+                 + np.clip((cx / arrays['cell_size'][0]).astype(np.int64), 0, GRID_SIZE - 1))
+
+        for name, keys in [('class', arrays['class_id'].astype(np.int64)),
+                           ('track', arrays['track_id'].astype(np.int64)),
+                           ('cell', cells)]:
+            arrays[f'{name}_keys'], arrays[f'{name}_starts'], arrays[f'{name}_rows'] = _groups(keys)
+        logger.info(f'Indexed {len(df)} detections')
+        return cls(arrays)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, **self.arrays)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            return cls({name: npz[name] for name in npz.files})
+
+    def _lookup(self, name, keys, lo, hi):
+        # Positions in [lo, hi) of the rows of the given keys, sorted
+        index_keys = self.arrays[f'{name}_keys']
+        starts = self.arrays[f'{name}_starts']
+        rows = self.arrays[f'{name}_rows']
+        found = []
+        for i in np.flatnonzero(np.isin(index_keys, keys)):
+            group = rows[starts[i]:starts[i + 1]]
+            found.append(group[np.searchsorted(group, lo):np.searchsorted(group, hi)])
+        return np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.int32)
+
+    def class_ids(self, classes):
+        '''
+        Class ids of class names or ids, raises BadRequest on an unknown class
+        '''
+        ids = []
+        for name in classes:
+            if name.isdigit():
+                ids.append(int(name))
+            elif name in self.labels:
+                ids.append(self.labels.index(name))
+            else:
+                raise BadRequest(f'Unknown class {name!r}')
+        return ids
+
+    def query(self, start=None, end=None, classes=None, track_ids=None, roi=None, offset=0, limit=100):
+        '''
+        Detections between start and end seconds, of the given class ids and track ids,
+        with their box center inside roi (xmin, ymin, xmax, ymax in pixels).
+        Returns (number of matching detections, the page of them from offset)
+        '''
+        a = self.arrays
+        lo = 0 if start is None else int(np.searchsorted(a['timestamp'], start, 'left'))
+        hi = len(self) if end is None else int(np.searchsorted(a['timestamp'], end, 'right'))
+
+        candidates = []
+        if classes:
+            candidates.append(self._lookup('class', classes, lo, hi))
+        if track_ids:
+            candidates.append(self._lookup('track', track_ids, lo, hi))
+        if roi:
+            x0, y0, x1, y1 = roi
+            columns = np.arange(int(x0 // self.cell_width), int(x1 // self.cell_width) + 1)
+            rows = np.arange(int(y0 // self.cell_height), int(y1 // self.cell_height) + 1)
+            columns = columns[(columns >= 0) & (columns < GRID_SIZE)]
+            rows = rows[(rows >= 0) & (rows < GRID_SIZE)]
+            cells = (rows[:, None] * GRID_SIZE + columns[None, :]).ravel()
+            candidates.append(self._lookup('cell', cells, lo, hi))
+        if not candidates:
+            return hi - lo, [self.detection(i) for i in range(lo + offset, min(hi, lo + offset + limit))]
+        positions = min(candidates, key=len)
+
+        # exact conditions, on the candidates only
+        keep = np.ones(len(positions), dtype=bool)
+        if classes:
+            keep &= np.isin(a['class_id'][positions], classes)
+        if track_ids:
+            keep &= np.isin(a['track_id'][positions], track_ids)
+        if roi:
+            cx = (a['xmin'][positions] + a['xmax'][positions]) / 2
+            cy = (a['ymin'][positions] + a['ymax'][positions]) / 2
+            keep &= (cx >= x0) & (cx <= x1) & (cy >= y0) & (cy <= y1)
+        positions = positions[keep]
+        return len(positions), [self.detection(i) for i in positions[offset:offset + limit]]
+
+    def detection(self, i):
+        a = self.arrays
+        class_id = int(a['class_id'][i])
+        return {'frame_num': int(a['frame_num'][i]),
+                'timestamp': round(float(a['timestamp'][i]), 3),
+                'time': seconds_to_mmss(a['timestamp'][i]),
+                'box': [round(float(a[column][i]), 1) for column in ['xmin', 'ymin', 'xmax', 'ymax']],
+                'track_id': int(a['track_id'][i]),
+                'confidence': round(float(a['confidence'][i]), 3),
+                'class_id': class_id,
+                'label': self.labels[class_id] if class_id < len(self.labels) else None}
+
+
+@lru_cache(maxsize=8)
+def _load_index(path, mtime):
+    return DetectionIndex.load(path)
+
+
+def load_index(path):
+    """
+    The index saved at path, kept in memory by each worker for the next queries
+    """
+    return _load_index(path, os.path.getmtime(path))
+
+
+def parse_time(value):
+    """
+    Takes seconds or 'MM:SS' / 'HH:MM:SS', returns seconds
+    """
+    try:
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise BadRequest(f'Time {value!r} is invalid, expected seconds or MM:SS')
+    return seconds
+
+
+def parse_ints(value, name, count=None):
+    """
+    Takes comma separated numbers, e.g. a roi 'xmin,ymin,xmax,ymax'
+    """
+    try:
+        numbers = [int(float(part)) for part in value.split(',') if part]
+    except ValueError:
+        raise BadRequest(f'{name} {value!r} is invalid, expected comma separated numbers')
+    if count is not None and len(numbers) != count:
+        raise BadRequest(f'{name} needs {count} numbers, got {len(numbers)}')
+    return numbers
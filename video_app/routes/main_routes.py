@@ -2,28 +2,30 @@ from flask import Blueprint, current_app, flash, g, jsonify, redirect, render_te
 from flask import request, Response, session, url_for, send_from_directory, send_file
 
 from threading import Thread
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 
-from video_app.utils import Detections, has_allowed_extension, upload_to_s3, extract_video_id, get_video_duration, download_video_from_youtube
-from video_app.utils import handle_selections, local_file_validation, youtube_url_validation
-from video_app.models import load_model
-
-from io import BytesIO
+from video_app.utils import has_allowed_extension, extract_video_id, get_video_duration, download_video_from_youtube
+from video_app.utils import handle_selections, handle_stride, local_file_validation, youtube_url_validation
+from video_app.cache import cache_key, file_digest
+from video_app.downloads import DETECTION_MIMETYPES, detections_as_csv, image_archive, parse_track_range
+from video_app.downloads import select_images, stream_file
+from video_app.jobs import DONE, FAILED, job_events
+from video_app.metrics import JOBS, render_metrics
+from video_app.models import resolve_model_type
+from video_app.profiling import FOLDED_FILENAME, PROFILE_HEADER, SUMMARY_FILENAME, verify
+from video_app.query import MAX_LIMIT, load_index, parse_ints, parse_time
+from video_app.streams import stream_url_validation
 
 import sys
 import time
+import uuid
 import os
-import boto3
-import magic
 import logging
-import zipfile
 import re
-import requests
-import isodate
 
-from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST
 
 logger = logging.getLogger('video_app')
 
@@ -33,8 +35,7 @@ main = Blueprint('main', __name__)
 @main.route('/')
 def home():
     ''' 
-    renders the upload form at upload.html, 
-    deletes local files in `tmp` indirectly as upload.html calls /delete_files
+    renders the upload form at upload.html
     '''
     logger.info('"/" route was hit')
     return render_template('upload.html')
@@ -52,7 +53,9 @@ def upload():
         uploaded_file = request.files.get('video_file', None)
         logger.info(f'uploaded_file: {uploaded_file}')
         logger.info(print(type(uploaded_file)))
+        upload_id = request.form.get('upload_id', "").strip()
         video_url = request.form.get('video_url', "").strip()
+        stream_url = request.form.get('stream_url', "").strip()
 
         # Desired Classes: Handle User Input for selectDetections
         selected_detections = request.form.getlist('detections')
@@ -63,28 +66,55 @@ def upload():
         selected_model = request.form.get('singleSelectModel')
         session['MODEL'] = selected_model
 
+        # Frame Stride: Handle User Input for singleSelectStride
+        stride = handle_stride(request.form.get('singleSelectStride', '1'))
+
         ### File Validation ###
 
         # Flash Messaging
         # Neither URL nor file was provided
-        if ((uploaded_file is None) or not uploaded_file) and not video_url:
-            flash('Please provide either a video file or a YouTube URL')
+        if ((uploaded_file is None) or not uploaded_file) and not upload_id and not video_url and not stream_url:
+            flash('Please provide either a video file, a YouTube URL or a stream URL')
             return redirect(url_for('main.home'))
 
         # Both URL and file were provided
-        # if (uploaded_file is not None) and video_url:
-        #     flash('Please only provide one: a video file or a YouTube URL')
-        #     return redirect(url_for('main.home'))
+        if (uploaded_file or upload_id) and video_url:
+            flash('Please only provide one: a video file or a YouTube URL')
+            return redirect(url_for('main.home'))
 
         # Detections were not selected
         if not selected_detections:
             flash('Please select at least one detection from Additional Options')
             return redirect(url_for('main.home'))
 
-        VIDEO_FOLDER = current_app.config['VIDEO_FOLDER']
+        # Case: live stream, processed until the user stops it
+        if stream_url and not uploaded_file and not upload_id and not video_url:
+            stream_url_validation(
+                stream_url, current_app.config['STREAM_ALLOWED_HOSTS'])
+            stream_id = current_app.stream_manager.start(
+                stream_url, selected_model, classes,
+                backend=current_app.model_registry.backend_for(selected_model))
+            return render_template('stream.html', stream_id=stream_id, stream_url=stream_url)
+
+        # Every job gets its own workspace for its video, csv and images
+        job_id = uuid.uuid4().hex
+        workspace = current_app.workspaces.create(job_id)
+        VIDEO_FOLDER = workspace.video_folder
+        params = {'model': selected_model, 'classes': classes, 'stride': stride}
+        # Sampling profile of the job, asked for by an operator (see PROFILE_SECRET in config.py)
+        if verify(current_app.config['PROFILE_SECRET'], request.headers.get(PROFILE_HEADER)):
+            params['profile'] = True
+
+        # Case: chunked upload via dropZone, validated as its chunks arrived
+        if upload_id and not video_url:
+            video_file_path = current_app.chunked_uploads.assemble(
+                upload_id, VIDEO_FOLDER)
+            session['VIDEO_SOURCE'] = video_file_path
+            params['video'] = video_file_path
+            video_id = file_digest(video_file_path)
 
-        # Case: file upload via dropZone
-        if uploaded_file and not video_url:
+        # Case: file upload in the form
+        elif uploaded_file and not video_url:
             local_file_validation(uploaded_file)
 
             # Save the file locally
@@ -92,134 +122,289 @@ def upload():
             video_file_path = os.path.join(VIDEO_FOLDER, filename)
             uploaded_file.save(video_file_path)
             session['VIDEO_SOURCE'] = video_file_path
+            params['video'] = video_file_path
+            video_id = file_digest(video_file_path)
 
         # Case: YouTube URL
         if not uploaded_file and video_url:
             youtube_url_validation(video_url)
-
-            # Download the video and save it locally
-            downloaded_video = download_video_from_youtube(
-                video_url, VIDEO_FOLDER)
-            logger.info(f"downloaded_video: {downloaded_video}")
-            session['VIDEO_SOURCE'] = downloaded_video
-
-        return render_template('loading.html')
+            video_id = f'youtube:{extract_video_id(video_url) or video_url}'
+
+        # Identical video & settings processed before: serve the cached results.
+        # Profiled jobs always run
+        params['cache_key'] = cache_key(video_id, resolve_model_type(selected_model), classes, stride,
+                                        current_app.model_registry.backend_for(selected_model),
+                                        current_app.config['THUMBNAIL_STRATEGY'],
+                                        current_app.config['MOTION_THRESHOLD'])
+        if not params.get('profile') and reuse_cached_results(job_id, params, workspace):
+            session['JOB_ID'] = job_id
+            return redirect(url_for('main.job_results', job_id=job_id))
+
+        # Same video & settings already being processed (e.g. submitted twice): follow that job
+        run_id = None if params.get('profile') else current_app.job_store.find_active(params['cache_key'])
+        if run_id is None:
+            if not uploaded_file and video_url:
+                # Download the video and save it locally
+                downloaded_video = download_video_from_youtube(
+                    video_url, VIDEO_FOLDER)
+                logger.info(f"downloaded_video: {downloaded_video}")
+                session['VIDEO_SOURCE'] = downloaded_video
+                params['video'] = downloaded_video
+
+            # Hand the video off to the background workers
+            run_id = current_app.job_queue.submit(params, job_id)
+        if run_id != job_id:
+            workspace.remove()  # the running job has its own
+        session['JOB_ID'] = run_id
+
+        return render_template('loading.html', job_id=run_id)
 
     except Exception as e:
         return render_template('error.html', error_message=str(e))
 
 
+def reuse_cached_results(job_id, params, workspace):
+    """
+    Records the job as finished from the result cache into its workspace.
+    Returns False on a cache miss
+    """
+    cache = current_app.result_cache
+    entry = cache.get(params['cache_key'])
+    if entry is None:
+        return False
+    try:
+        result = cache.restore(entry, workspace.csv_folder, workspace.image_folder)
+    except OSError as e:
+        logger.error(f'Could not restore cached results: {e}')  # evicted meanwhile
+        return False
+    # YouTube videos aren't downloaded on a hit, the name of the cached one is kept for downloads
+    params.setdefault('video', os.path.join(workspace.video_folder, entry['video_name'] + '.mp4'))
+    current_app.job_store.create(params, job_id)
+    current_app.job_store.update(job_id, status=DONE, result=result)
+    JOBS.labels('cached').inc()
+    logger.info(f'Job {job_id} served from the result cache')
+    return True
+
+
+@main.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    starts a chunked upload, called from dropZone.js with the file's name and size
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = current_app.chunked_uploads.create(
+            str(data.get('filename', '')), int(data.get('size', 0)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size must be a number of bytes'}), 400
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
+    return jsonify(upload), 201
+
+
+@main.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """
+    JSON status of a chunked upload, with the chunks received so far for resuming
+    """
+    try:
+        return jsonify(current_app.chunked_uploads.status(upload_id))
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
+
+
+@main.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    receives one chunk of an upload, the raw bytes starting at ?offset=
+    """
+    try:
+        index = current_app.chunked_uploads.write_chunk(
+            upload_id, request.args.get('offset', -1, type=int),
+            request.content_length or 0, request.stream)
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
+    return jsonify({'id': upload_id, 'chunk': index})
+
+
 @main.route('/processing')
 def processing():
     """ 
-    process video, write images & csv to s3, serve images & csv to user
+    kept for old links: sends the user to the results of their latest job
     """
-    logger.info("Processing route was hit!")
-    load_dotenv()
+    job_id = session.get('JOB_ID')
+    if job_id is None:
+        return redirect(url_for('main.home'))
+    return redirect(url_for('main.job_results', job_id=job_id))
 
-    # TODO: display loading page faster
-    # perhaps the way to do this is by
-    # having the validations occur in the next route.
-    # Alternatively, we could call render_template('loading.html')
-    # before any of the checks occur, and call the next route
-    # on the return from this route.
-    # In any case, the current state of user feedback for load
-    # is laggy, and causes users to click the get results button
-    # multiple times and all this is just buggy and needs to be fixed
 
+@main.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    JSON status of a job, polled by loading.html
+    """
+    job = current_app.job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify({
+        'id': job['id'],
+        'status': job['status'],
+        'error': job['error'],
+        'created': job['created'],
+        'updated': job['updated'],
+        'progress': job['progress'],
+        'frames_skipped': (job['result'] or {}).get('frames_skipped'),
+        'uploads': job['uploads']
+    })
+
+
+@main.route('/jobs/<job_id>/events')
+def job_events_stream(job_id):
+    """
+    Server-Sent Events of a job's progress, consumed by loading.html.
+    Refused with 503 when MAX_EVENT_STREAMS are open in this worker: the page polls /jobs/<id> instead
+    """
+    store = current_app.job_store
+    if store.get(job_id) is None:
+        return jsonify({'error': 'job not found'}), 404
+    # every open stream holds a request thread, they mustn't starve uploads and results pages
+    streams = current_app.event_streams
+    if not streams.acquire(blocking=False):
+        return jsonify({'error': 'too many event streams, poll the job status instead'}), 503
+    response = Response(job_events(store, job_id), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})  # nginx: pass events on as they come
+    response.call_on_close(streams.release)
+    return response
+
+
+@main.route('/jobs/<job_id>/detections')
+def query_detections(job_id):
+    """
+    JSON query over a finished job's per-frame detections, e.g.
+    ?classes=car&start=02:00&end=03:30&roi=0,0,640,360&offset=0&limit=100
+    start, end -- seconds or MM:SS; classes -- names or ids; tracks -- track ids;
+    roi -- xmin,ymin,xmax,ymax of the box centers, in pixels
+    """
+    try:
+        job, _ = job_workspace(job_id)
+        if not job['result'].get('index'):
+            raise BadRequest('These results have no detection index. Please process the video again.')
+        index = load_index(job['result']['index'])
+
+        args = request.args
+        start = parse_time(args['start']) if args.get('start') else None
+        end = parse_time(args['end']) if args.get('end') else None
+        classes = index.class_ids(args['classes'].split(',')) if args.get('classes') else None
+        tracks = parse_ints(args['tracks'], 'tracks') if args.get('tracks') else None
+        roi = parse_ints(args['roi'], 'roi', count=4) if args.get('roi') else None
+        if roi and (roi[0] > roi[2] or roi[1] > roi[3]):
+            raise BadRequest('roi must be xmin,ymin,xmax,ymax')
+        offset = max(args.get('offset', 0, type=int), 0)
+        limit = min(max(args.get('limit', 100, type=int), 1), MAX_LIMIT)
+
+        total, detections = index.query(start, end, classes, tracks, roi, offset, limit)
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
+    except OSError:
+        return jsonify({'error': 'These results have expired. Please process the video again.'}), 400
+    return jsonify({
+        'job_id': job_id,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'detections': detections
+    })
+
+
+@main.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    """
+    serve images & csv of a finished job to the user
+    """
     try:
-        # Load model using cache
-        selected_model_type = session.get('MODEL')
-        # If model not in cache, load it, save it in cache
-        if selected_model_type not in current_app.model_cache:
-            current_app.model_cache[selected_model_type] = load_model(
-                selected_model_type)
-        model = current_app.model_cache[selected_model_type]
-
-        ### Process video ###
-        detectionsInVideo = Detections()
-        VIDEO = session.get('VIDEO_SOURCE')
-        CLASSES = session.get(
-            'CLASSES', [0, 1, 2, 3, 4, 5, 6, 7, 8])  # default: people & vehicles
-        logger.info(f"VIDEO: {VIDEO}")
-        detectionsInVideo.process_video(model, VIDEO, CLASSES)
-
-        S3_BUCKET = os.environ.get('S3_BUCKET_NAME')
-
-        # Write csv locally
-        CSV_FOLDER = current_app.config['CSV_FOLDER']
-        csv_path = detectionsInVideo.write_csv(CSV_FOLDER, VIDEO)
-        # Write csv to S3 Bucket
-        upload_to_s3(csv_path, S3_BUCKET)
-
-        # save csv to session for serving download from /download_csv
-        session['CSV'] = csv_path
-
-        # serve csv to user as csv_info as (filename, url)
-        table_html = detectionsInVideo.html
-
-        # Only serve images if not YouTube
-        image_info = None
-
-        # Write images locally
-        IMAGE_FOLDER = current_app.config['IMAGE_FOLDER']
-        detectionsInVideo.write_images(VIDEO, IMAGE_FOLDER)
-        # Write images to S3 Bucket
-        full_image_paths = [os.path.join(IMAGE_FOLDER, filename) for filename in os.listdir(
-            IMAGE_FOLDER) if os.path.isfile(os.path.join(IMAGE_FOLDER, filename))]
-        for image in full_image_paths:
-            upload_to_s3(image, S3_BUCKET)
-        logger.info('images successfully written to s3 bucket')
+        job = current_app.job_store.get(job_id)
+        if job is None:
+            raise BadRequest('Job not found')
+        if job['status'] == FAILED:
+            return render_template('error.html', error_message=job['error'])
+        if job['status'] != DONE:
+            return render_template('loading.html', job_id=job_id)
+
+        result = job['result']
+        # remember the job, for the download links of old pages
+        session['JOB_ID'] = job_id
+        current_app.workspaces.get(job_id).touch()
 
         # serve images to user as image_info as (filename, url)
-        IMAGE_FOLDER = current_app.config['IMAGE_FOLDER']
-        images = [f for f in os.listdir(IMAGE_FOLDER) if (
-            f.lower().endswith('.jpg') or f.lower().endswith('.jpeg'))]
-        image_info = [(f, url_for('main.serve_image', filename=f))
-                      for f in images]
+        image_info = [(f, url_for('main.serve_image', job_id=job_id, filename=f))
+                      for f in result['images']]
 
-        return render_template('results.html', image_info=image_info, table_html=table_html)
+        return render_template('results.html', job_id=job_id, image_info=image_info,
+                               table_html=result['table_html'])
     except Exception as e:
         return render_template('error.html', error_message=str(e))
 
 
-@main.route('/delete_files')
-def delete_files_locally():
-    """ 
-    deletes the local files from previous sessions.
-    called from 'upload.html' on page load
+@main.route('/streams/<stream_id>')
+def stream_status(stream_id):
     """
-    try:
-        IMAGE_FOLDER = current_app.config['IMAGE_FOLDER']
-        CSV_FOLDER = current_app.config['CSV_FOLDER']
-        VIDEO_FOLDER = current_app.config['VIDEO_FOLDER']
-
-        files_deleted = 0
-        errors = []
-
-        # Remove all files
-        for directory in [IMAGE_FOLDER, CSV_FOLDER, VIDEO_FOLDER]:
-            for root, dirs, files in os.walk(directory, topdown=False):
-                for name in files:
-                    file_path = os.path.join(root, name)
-                    try:
-                        os.remove(file_path)
-                        files_deleted += 1
-                        logger.info(f"Deleted file {file_path}")
-                    except Exception as e:
-                        error_msg = f"Error deleting file {file_path}: {e}"
-                        logger.error(error_msg)
-                        errors.append(error_msg)
-
-        response_delete_data = {
-            "success": len(errors) != 0,
-            "files_deleted": files_deleted,
-            "errors": errors
-        }
-        logger.info("files deleted successfully!")
-        return jsonify(response_delete_data), 200 if len(errors) == 0 else 500
-    except Exception as e:
-        return render_template('error.html', error_message=str(e))
+    JSON status of a live stream, polled by stream.html
+    """
+    status = current_app.stream_manager.status(stream_id)
+    if status is None:
+        return jsonify({'error': 'stream not found'}), 404
+    return jsonify(status)
+
+
+@main.route('/streams/<stream_id>/stop', methods=['POST'])
+def stop_stream(stream_id):
+    """
+    stops a live stream, its output stays available for download
+    """
+    if not current_app.stream_manager.stop(stream_id):
+        return jsonify({'error': 'stream not found'}), 404
+    return jsonify({'id': stream_id, 'stopping': True})
+
+
+@main.route('/streams/<stream_id>/<any("detections.csv", "summary.csv"):filename>')
+def download_stream_csv(stream_id, filename):
+    """
+    serve the rolling csvs of a live stream, as written so far
+    """
+    folder = current_app.stream_manager.stream_folder(stream_id)
+    if folder is None:
+        raise BadRequest('Stream not found')
+    return send_from_directory(folder, filename, as_attachment=True,
+                               download_name=f'{stream_id}_{filename}', max_age=0)
+
+
+@main.route('/streams/<stream_id>/images/<filename>')
+def serve_stream_image(stream_id, filename):
+    """
+    serve the thumbnail of a track that ended in a live stream
+    """
+    folder = current_app.stream_manager.stream_folder(stream_id)
+    if folder is None:
+        raise BadRequest('Stream not found')
+    return send_from_directory(os.path.join(folder, 'images'), filename)
+
+
+@main.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics of the processing pipeline, from all workers
+    """
+    return Response(render_metrics(current_app.job_store, current_app.result_cache),
+                    content_type=CONTENT_TYPE_LATEST)
+
+
+@main.route('/cache/stats')
+def cache_stats():
+    """
+    JSON hit/miss counters and size of the result cache
+    """
+    return jsonify(current_app.result_cache.stats())
 
 
 @main.errorhandler(BadRequest)
@@ -230,67 +415,141 @@ def handle_bad_request(e):
     return render_template('error.html', error_message=str(e))
 
 
-@main.route('/images/<filename>')
-def serve_image(filename):
+def job_workspace(job_id):
+    """
+    Returns the job and workspace of a finished job, raises BadRequest if they are gone
+    """
+    job = current_app.job_store.get(job_id)
+    workspace = current_app.workspaces.get(job_id)
+    if job is None or job['status'] != DONE or not workspace.exists():
+        raise BadRequest('These results have expired. Please process the video again.')
+    workspace.touch()
+    return job, workspace
+
+
+def download_name(job):
+    """
+    Name of a job's downloads: the video's filename without extension
+    """
+    return (str(job['params']['video']).split('/')[-1])[:-4]
+
+
+@main.route('/jobs/<job_id>/images/<filename>')
+def serve_image(job_id, filename):
     """ 
-    serve images, called from /processing route
-    only available for uploaded videos (not YouTube)
+    serve a job's images, shown in results.html
     """
     try:
-        IMAGE_FOLDER = current_app.config['IMAGE_FOLDER']
-        return send_from_directory(IMAGE_FOLDER, filename)
+        _, workspace = job_workspace(job_id)
+        return send_from_directory(workspace.image_folder, filename)
     except Exception as e:
         return render_template('error.html', error_message=str(e))
 
 
-@main.route('/download_images')
-def download_images():
+@main.route('/jobs/<job_id>/download_images')
+def download_images(job_id):
     """ 
-    serve images when user clicks on 'Download Images' button in 'results.html'
-    only available for uploaded videos (not YouTube)
+    serve a job's images when user clicks on 'Download Images' button in 'results.html'.
+    The zip is streamed as it's written. Optional selection:
+    ?classes=person,car (labels) and/or ?tracks=10-50 (track id range)
     """
     try:
-        image_folder = current_app.config['IMAGE_FOLDER']
-        VIDEO = session.get('VIDEO_SOURCE')
-        filename = (str(VIDEO).split('/')[-1])[:-4]
-
-        # Create a Zip file on-the-fly
-        in_memory_zip = BytesIO()
-        with zipfile.ZipFile(in_memory_zip, 'w') as zf:
-            for image_name in os.listdir(image_folder):
-                zf.write(os.path.join(image_folder, image_name),
-                         arcname=image_name)
-
-        in_memory_zip.seek(0)
-        return send_file(in_memory_zip,
-                         download_name=f'{filename}.zip',
-                         as_attachment=True)
+        job, workspace = job_workspace(job_id)
+        classes = request.args.get('classes')
+        tracks = request.args.get('tracks')
+        images = select_images(job['result']['images'],
+                               labels=classes.split(',') if classes else None,
+                               track_range=parse_track_range(tracks) if tracks else None)
+
+        return Response(image_archive(workspace.image_folder, images),
+                        mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={download_name(job)}.zip'})
     except Exception as e:
         return render_template('error.html', error_message=str(e))
 
 
-@main.route('/download_csv')
-def download_csv():
+@main.route('/jobs/<job_id>/download_csv')
+def download_csv(job_id):
     """
-    serve csv when user clicks on 'Download CSV' button in 'results.html' 
+    serve a job's csv when user clicks on 'Download CSV' button in 'results.html' 
     """
     try:
-        # Fetch csv file path from session
-        csv_file_path = session.get('CSV')
-        VIDEO = session.get('VIDEO_SOURCE')
-        filename = (str(VIDEO).split('/')[-1])[:-4]
+        job, _ = job_workspace(job_id)
+        csv_file_path = job['result']['csv']
 
-        if csv_file_path is None or not os.path.exists(csv_file_path):
+        if not os.path.exists(csv_file_path):
             raise BadRequest("CSV file not found")
 
-        # Read the content of the csv file
-        with open(csv_file_path, 'r') as file:
-            csv_data = file.read()
-
-        # Create a response with csv data, content_type, headers, and a filename
-        csv_response = Response(csv_data, content_type='text/csv')
-        csv_response.headers['Content-Disposition'] = f'attachment; filename={filename}.csv'
+        # Stream the csv file in chunks, with content_type, headers, and a filename
+        csv_response = Response(stream_file(csv_file_path), content_type='text/csv')
+        csv_response.headers['Content-Disposition'] = f'attachment; filename={download_name(job)}.csv'
 
         return csv_response
     except Exception as e:
         return render_template('error.html', error_message=str(e))
+
+
+@main.route('/jobs/<job_id>/download_detections')
+def download_detections(job_id):
+    """
+    serve a job's per-frame detections table, streamed in chunks.
+    ?format=csv converts a parquet/feather table to csv on the fly, for compatibility
+    """
+    try:
+        job, _ = job_workspace(job_id)
+        path = job['result'].get('detections')
+        if not path or not os.path.exists(path):
+            raise BadRequest("Detections table not found")
+
+        extension = os.path.splitext(path)[1]
+        requested = '.' + request.args.get('format', extension.lstrip('.'))
+        if requested == extension:
+            body = stream_file(path)
+        elif requested == '.csv':
+            body = detections_as_csv(path)
+        else:
+            raise BadRequest(f"Detections are available as {extension.lstrip('.')} or csv")
+
+        return Response(body, mimetype=DETECTION_MIMETYPES[requested],
+                        headers={'Content-Disposition':
+                                 f'attachment; filename={download_name(job)}_detections{requested}'})
+    except Exception as e:
+        return render_template('error.html', error_message=str(e))
+
+
+@main.route('/jobs/<job_id>/profile')
+def job_profile(job_id):
+    """
+    serve a profiled job's sampling profile: folded stacks for flamegraph.pl or speedscope,
+    ?format=json for the wall time of each stage.
+    Needs a signed X-Eyespy-Profile header, like the submission: without PROFILE_SECRET, profiles aren't served
+    """
+    secret = current_app.config['PROFILE_SECRET']
+    if not secret:
+        return jsonify({'error': 'profile not found'}), 404
+    if not verify(secret, request.headers.get(PROFILE_HEADER)):
+        return jsonify({'error': f'a signed {PROFILE_HEADER} header is required'}), 403
+    as_json = request.args.get('format') == 'json'
+    try:
+        workspace = current_app.workspaces.get(job_id)
+    except NotFound:
+        return jsonify({'error': 'profile not found'}), 404
+    path = os.path.join(workspace.root, SUMMARY_FILENAME if as_json else FOLDED_FILENAME)
+    if not os.path.exists(path):
+        return jsonify({'error': 'profile not found'}), 404
+    if as_json:
+        return send_file(path, mimetype='application/json')
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f'{job_id}.folded')
+
+
+@main.route('/download_images')
+@main.route('/download_csv')
+def download_latest():
+    """
+    kept for old links: downloads from the user's latest job
+    """
+    job_id = session.get('JOB_ID')
+    if job_id is None:
+        return redirect(url_for('main.home'))
+    endpoint = 'main.download_csv' if request.path == '/download_csv' else 'main.download_images'
+    return redirect(url_for(endpoint, job_id=job_id))
@@ -0,0 +1,196 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cached_property, partial
+
+import os
+import time
+import random
+import logging
+import threading
+
+from video_app.lazy import lazy_import
+from video_app.metrics import S3_UPLOAD_BYTES, S3_UPLOAD_SECONDS
+
+logger = logging.getLogger('video_app')
+
+boto3 = lazy_import('boto3', 'boto3.exceptions', 'boto3.s3.transfer')
+botocore = lazy_import('botocore', 'botocore.config', 'botocore.exceptions')
+
+# One client per (process, endpoint): boto3 clients are thread-safe and keep a
+# connection pool, but must not be shared across a fork
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def object_name_for(file_name, object_name=None):
+    """
+    S3 key of a local file: images, csvs and detections tables go to their "folder" in the bucket
+    """
+    if file_name.endswith('.jpg'):
+        s3_folder = 'video-app-data/images/'
+    elif file_name.endswith('.csv'):
+        s3_folder = 'video-app-data/csvs/'
+    elif file_name.endswith(('.parquet', '.feather')):
+        s3_folder = 'video-app-data/detections/'
+    else:
+        s3_folder = ''
+    return s3_folder + (object_name or os.path.basename(file_name))
+
+
+def get_client(endpoint_url=None, max_connections=10):
+    """
+    Returns the shared S3 client of this process.
+    endpoint_url points it at an S3-compatible stand-in (MinIO, benchmarks.local_s3)
+    """
+    key = (os.getpid(), endpoint_url, max_connections)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = boto3.client(
+                's3', endpoint_url=endpoint_url,
+                aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                config=botocore.config.Config(max_pool_connections=max_connections,
+                                  # retries are done by S3Uploader, with backoff, and reported
+                                  retries={'total_max_attempts': 1},
+                                  s3={'addressing_style': 'path'} if endpoint_url else None))
+        return client
+
+
+class S3Uploader:
+    """
+    Uploads files to a bucket with one pooled client and a bounded thread pool.
+
+    - Small files are uploaded concurrently, `max_workers` at a time.
+    - Files over `multipart_threshold_mb` are uploaded in parts, in parallel.
+    - Failed uploads are retried `retries` times with exponential backoff and jitter.
+    - `upload_many_async` runs off the caller's thread and reports on completion.
+
+    With no bucket configured uploads are skipped, e.g. for local development.
+    """
+
+    def __init__(self, bucket, endpoint_url=None, max_workers=8, multipart_threshold_mb=8,
+                 retries=3, backoff=0.5):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url or None
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.multipart_threshold_mb = multipart_threshold_mb
+        # threads are only started on first submit, so this is safe to create before fork
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='s3-upload')
+
+    @cached_property
+    def transfer_config(self):
+        # created on first upload, so the app doesn't import boto3 until then
+        return boto3.s3.transfer.TransferConfig(multipart_threshold=self.multipart_threshold_mb * 1024 * 1024,
+                                                multipart_chunksize=self.multipart_threshold_mb * 1024 * 1024,
+                                                max_concurrency=4)
+
+    @property
+    def client(self):
+        # each upload thread, plus the part uploads of multipart transfers, may hold a connection
+        return get_client(self.endpoint_url, self.max_workers * self.transfer_config.max_request_concurrency)
+
+    def upload(self, file_name, object_name=None):
+        '''
+        Uploads one file, retrying with backoff.
+        Returns its outcome: {'file', 'key', 'ok', 'attempts', 'bytes', 'error'}
+        '''
+        key = object_name_for(file_name, object_name)
+        outcome = {'file': file_name, 'key': key, 'ok': False,
+                   'attempts': 0, 'bytes': 0, 'error': None}
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            outcome['attempts'] = attempt + 1
+            try:
+                self.client.upload_file(file_name, self.bucket, key, Config=self.transfer_config)
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError,
+                    boto3.exceptions.S3UploadFailedError) as e:
+                outcome['error'] = str(e)
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+            except OSError as e:
+                # the local file is gone or unreadable, retrying won't help
+                outcome['error'] = str(e)
+                break
+            outcome.update(ok=True, error=None, bytes=os.path.getsize(file_name))
+            break
+        S3_UPLOAD_SECONDS.labels('ok' if outcome['ok'] else 'failed').observe(time.perf_counter() - started)
+        S3_UPLOAD_BYTES.inc(outcome['bytes'])
+        if not outcome['ok']:
+            logger.error(f'Upload of {file_name} to s3://{self.bucket}/{key} failed: {outcome["error"]}')
+        return outcome
+
+    def upload_many_async(self, file_names, callback=None, prefix=''):
+        '''
+        Uploads files concurrently in the background.
+        Returns a Future of the completion report, which is also passed to `callback`
+        prefix -- prepended to the file names in the object keys, e.g. '<job id>/'
+        '''
+        report_future = Future()
+        started = time.monotonic()
+        file_names = list(file_names)
+
+        def finish(outcomes):
+            report = upload_report(self.bucket, outcomes, time.monotonic() - started)
+            if callback is not None:
+                try:
+                    callback(report)
+                except Exception:
+                    logger.exception('Upload report callback failed')
+            report_future.set_result(report)
+
+        if not self.bucket or not file_names:
+            if not self.bucket:
+                logger.info('No S3 bucket configured, skipping uploads')
+            finish([])
+            return report_future
+
+        outcomes = []
+        lock = threading.Lock()
+
+        def collect(file_name, future):
+            try:
+                outcome = future.result()
+            except Exception as e:  # never leave the report waiting on a lost upload
+                outcome = {'file': file_name, 'key': object_name_for(file_name), 'ok': False,
+                           'attempts': 1, 'bytes': 0, 'error': str(e)}
+            with lock:
+                outcomes.append(outcome)
+                done = len(outcomes) == len(file_names)
+            if done:
+                finish(outcomes)
+
+        for file_name in file_names:
+            object_name = prefix + os.path.basename(file_name) if prefix else None
+            self.executor.submit(self.upload, file_name, object_name).add_done_callback(
+                partial(collect, file_name))
+        return report_future
+
+    def upload_many(self, file_names, prefix=''):
+        '''
+        Uploads files concurrently, returns the completion report
+        '''
+        return self.upload_many_async(file_names, prefix=prefix).result()
+
+    def close(self):
+        '''
+        Waits for pending uploads, then stops the upload threads
+        '''
+        self.executor.shutdown(wait=True)
+
+
+def upload_report(bucket, outcomes, seconds):
+    """
+    Summary of a batch of uploads
+    """
+    failed = [{'file': o['file'], 'error': o['error']} for o in outcomes if not o['ok']]
+    return {'bucket': bucket,
+            'uploaded': len(outcomes) - len(failed),
+            'failed': len(failed),
+            'retried': sum(1 for o in outcomes if o['attempts'] > 1),
+            'bytes': sum(o['bytes'] for o in outcomes),
+            'seconds': round(seconds, 3),
+            'failures': failed}
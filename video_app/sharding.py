@@ -0,0 +1,188 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import os
+import time
+import logging
+import multiprocessing
+
+import numpy as np
+
+from video_app.models import load_model
+from video_app.metrics import FRAMES_SKIPPED, timed
+from video_app.progress import Progress
+from video_app.utils import DetectionStore, FrameTracker, MotionGate, get_frame_count, record_throughput, track_frames
+
+logger = logging.getLogger('video_app')
+
+# Frames processed by two neighbouring segments, used to match their tracks
+OVERLAP_FRAMES = 5
+# Minimum mean IoU over the overlap for two tracks to be stitched together
+STITCH_IOU = 0.5
+
+# Model of this shard process, loaded once by _init_shard
+_shard_model = None
+
+
+def split_frames(total_frames, shards):
+    """
+    Splits frames 1..total_frames into `shards` contiguous (first, last) ranges
+    """
+    bounds = np.linspace(0, total_frames, shards + 1).astype(int)
+    return [(int(start) + 1, int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def _init_shard(model_type, backend, threads):
+    global _shard_model
+    import torch
+    torch.set_num_threads(threads)
+    _shard_model = load_model(model_type, backend)
+
+
+def track_segment(VIDEO, first, last, CLASSES, stride=1, score_sharpness=False, motion_threshold=0):
+    """
+    Runs detection + tracking on frames first..last (None: to the end) of the video in a shard process.
+    Tracking starts fresh, so track ids are local to the segment.
+    Returns (frame_num per row, (N,7) boxes, {frame_num: sharpness}, number of frames skipped by motion gating,
+    class names of the model)
+    """
+    tracker = FrameTracker(_shard_model, CLASSES,
+                           motion_gate=MotionGate(motion_threshold) if motion_threshold else None)
+    sharpness = {}
+    store = DetectionStore()
+    track_frames(tracker, VIDEO, store, first, last, stride, sharpness if score_sharpness else None)
+    frame_nums, boxes = store.rows()
+    return frame_nums, boxes, sharpness, tracker.frames_skipped, _shard_model.names
+
+
+def box_iou(a, b):
+    """
+    IoU of every box in a (N,4) against every box in b (M,4), returns (N,M)
+    """
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:4] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:4] - b[:, :2], axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def match_tracks(prev_frames, prev_boxes, frames, boxes, overlap, iou_threshold=STITCH_IOU):
+    """
+    Matches the tracks of a segment to those of the previous segment
+    over the frames both of them processed.
+    Tracks of the same class are paired greedily by mean IoU across the overlap.
+    Returns {track_id in this segment: track_id in the previous segment}
+    """
+    scores = {}
+    compared = 0
+    for frame_num in overlap:
+        prev_rows = prev_boxes[prev_frames == frame_num]
+        rows = boxes[frames == frame_num]
+        if len(prev_rows) == 0 or len(rows) == 0:
+            continue
+        compared += 1
+        iou = box_iou(rows[:, :4], prev_rows[:, :4])
+        iou[rows[:, 6][:, None] != prev_rows[:, 6][None, :]] = 0
+        for i, j in zip(*np.nonzero(iou)):
+            key = (rows[i, 4], prev_rows[j, 4])
+            scores[key] = scores.get(key, 0) + iou[i, j]
+
+    mapping = {}
+    matched = set()
+    for (track_id, prev_track_id), total in sorted(scores.items(), key=lambda item: -item[1]):
+        if total / compared < iou_threshold:
+            break
+        if track_id in mapping or prev_track_id in matched:
+            continue
+        mapping[track_id] = prev_track_id
+        matched.add(prev_track_id)
+    return mapping
+
+
+def stitch_segments(segments, overlap_frames):
+    """
+    Joins per-segment detections into one table with globally consistent track ids.
+
+    segments -- list of (first_owned_frame, frame_nums, boxes) in video order,
+                where each segment may also cover the `overlap_frames` frames before
+                first_owned_frame, which the previous segment owns.
+    Tracks continuing across a boundary keep the previous segment's id,
+    every other track gets a new id. Returns a DetectionStore.
+    """
+    store = DetectionStore()
+    next_id = 1
+    prev = None
+    for first, frame_nums, boxes in segments:
+        boxes = boxes.copy()
+        mapping = {}
+        if prev is not None:
+            overlap = range(first - overlap_frames, first)
+            mapping = match_tracks(*prev, frame_nums, boxes, overlap)
+
+        local_ids = np.unique(boxes[:, 4])
+        global_ids = []
+        for track_id in local_ids:
+            if track_id not in mapping:
+                mapping[track_id] = next_id
+                next_id += 1
+            global_ids.append(mapping[track_id])
+        if len(local_ids):
+            boxes[:, 4] = np.asarray(global_ids, dtype=np.float32)[
+                np.searchsorted(local_ids, boxes[:, 4])]
+
+        owned = frame_nums >= first
+        store.extend(frame_nums[owned], boxes[owned])
+        prev = (frame_nums, boxes)
+    return store
+
+
+def process_video_sharded(detections, model_type, VIDEO, CLASSES, shards, stride=1,
+                          backend='pytorch', progress=None):
+    """
+    Processes a video with `shards` processes, each tracking a contiguous frame range
+    with its own model instance, then stitches the tracks across segment boundaries.
+    The model is only loaded by the shard processes, class names included.
+    Fills the given Detections object like Detections.process_video does.
+    progress -- Progress of the job, advanced as segments finish
+    """
+    progress = progress or Progress()
+    total_frames = get_frame_count(VIDEO)
+    progress.start('inference', total_frames)
+    ranges = split_frames(total_frames, shards)
+    if not ranges:
+        raise ValueError(f'No frames found in video {VIDEO}')
+    ranges[-1] = (ranges[-1][0], None)
+    overlap_frames = OVERLAP_FRAMES * stride
+    threads = max(1, (os.cpu_count() or 1) // len(ranges))
+    score_sharpness = detections.frame_strategy == 'sharpness'
+    logger.info(
+        f'Sharded processing of {total_frames} frames in {len(ranges)} segments')
+
+    # spawn, not fork: the web worker is threaded and torch is not fork-safe
+    context = multiprocessing.get_context('spawn')
+    started = time.perf_counter()
+    with timed('inference', detections.model_type), ProcessPoolExecutor(max_workers=len(ranges), mp_context=context,
+                             initializer=_init_shard, initargs=(model_type, backend, threads)) as pool:
+        futures = {pool.submit(track_segment, VIDEO, max(1, first - overlap_frames), last,
+                               CLASSES, stride, score_sharpness, detections.motion_threshold): (first, last)
+                   for first, last in ranges}
+        segments = []
+        frames_done = 0
+        for future in as_completed(futures):
+            first, last = futures[future]
+            frame_nums, boxes, sharpness, skipped, names = future.result()
+            segments.append((first, frame_nums, boxes))
+            detections.frame_sharpness.update(sharpness)
+            detections.frames_skipped += skipped
+            frames_done += (last or total_frames) - first + 1
+            progress.update(frames_done)
+        segments.sort(key=lambda segment: segment[0])
+    record_throughput(detections.model_type, total_frames, time.perf_counter() - started)
+    if detections.motion_threshold:
+        FRAMES_SKIPPED.labels(detections.model_type).inc(detections.frames_skipped)
+        logger.info(f'Motion gating skipped {detections.frames_skipped} of {total_frames} frames')
+
+    detections.detections = stitch_segments(segments, overlap_frames)
+    detections.summarize(VIDEO, names, stride)
+    logger.info('Sharded video processing has finished')
+    return detections
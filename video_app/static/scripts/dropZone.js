@@ -50,6 +50,7 @@ function dropHandler(ev) {
         let file = ev.dataTransfer.items[0].getAsFile();
         document.getElementById('video_file').files = ev.dataTransfer.files;
         showFileDetails(file);  // Show file details
+        startChunkedUpload(file);  // Upload while the user picks options
     }
     ev.currentTarget.style.backgroundColor = "";  // Reset color after drop
 }
@@ -70,6 +71,7 @@ document.addEventListener('DOMContentLoaded', function () {
             urlField.disabled = true;
             urlField.value = "";
             showFileDetails(this.files[0]);
+            startChunkedUpload(this.files[0]);
         } else {
             urlField.disabled = false;
         }
@@ -87,3 +89,133 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     })
 });
+
+// Chunked, resumable upload: the file is sent in slices to /uploads as soon as it's selected,
+// several at a time. The first chunk goes alone, so the server can reject non-videos early.
+// Upload ids are kept in localStorage, so a page reload or dropped connection resumes the upload.
+const CHUNKS_IN_FLIGHT = 4;
+const CHUNK_RETRIES = 5;
+let currentUpload = null;  // {file, id, promise, done}
+
+function uploadKey(file) {
+    return 'upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+}
+
+function showUploadProgress(text) {
+    document.getElementById('fileName').textContent = text;
+}
+
+async function createOrResumeUpload(file) {
+    const savedId = localStorage.getItem(uploadKey(file));
+    if (savedId) {
+        const response = await fetch('/uploads/' + savedId);
+        if (response.ok) {
+            return await response.json();
+        }
+        localStorage.removeItem(uploadKey(file));
+    }
+    const response = await fetch('/uploads', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({filename: file.name, size: file.size})
+    });
+    const upload = await response.json();
+    if (!response.ok) {
+        throw new Error(upload.error);
+    }
+    localStorage.setItem(uploadKey(file), upload.id);
+    return upload;
+}
+
+async function sendChunk(file, upload, index) {
+    const offset = index * upload.chunk_size;
+    const chunk = file.slice(offset, Math.min(offset + upload.chunk_size, file.size));
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const response = await fetch('/uploads/' + upload.id + '?offset=' + offset, {
+                method: 'PUT',
+                headers: {'Content-Type': 'application/octet-stream'},
+                body: chunk
+            });
+            if (response.ok) {
+                return;
+            }
+            // the server refused the chunk (e.g. not a video): retrying won't help
+            if (response.status >= 400 && response.status < 500) {
+                throw Object.assign(new Error((await response.json()).error), {fatal: true});
+            }
+        } catch (error) {
+            if (error.fatal || attempt >= CHUNK_RETRIES) {
+                throw error;
+            }
+        }
+        // network error or server error: back off, then retry the chunk
+        await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+    }
+}
+
+async function chunkedUpload(file) {
+    const upload = await createOrResumeUpload(file);
+    const received = new Set(upload.received);
+    const pending = [];
+    for (let index = 0; index < upload.chunks; index++) {
+        if (!received.has(index)) {
+            pending.push(index);
+        }
+    }
+    let done = received.size;
+    const report = () => showUploadProgress(file.name + ': uploaded ' + Math.round(100 * done / upload.chunks) + '%');
+    report();
+
+    // first chunk alone, it is validated before the server accepts the others
+    if (pending[0] === 0) {
+        await sendChunk(file, upload, pending.shift());
+        done++;
+        report();
+    }
+    async function worker() {
+        while (pending.length) {
+            await sendChunk(file, upload, pending.shift());
+            done++;
+            report();
+        }
+    }
+    await Promise.all(Array.from({length: CHUNKS_IN_FLIGHT}, worker));
+    return upload.id;
+}
+
+function startChunkedUpload(file) {
+    const upload = {file: file, id: null, done: false};
+    upload.promise = chunkedUpload(file)
+        .then(id => {
+            upload.id = id;
+            upload.done = true;
+            showUploadProgress(file.name + ': uploaded');
+            return id;
+        })
+        .catch(error => {
+            localStorage.removeItem(uploadKey(file));
+            showUploadProgress(file.name + ': upload failed, ' + error.message);
+            throw error;
+        });
+    upload.promise.catch(() => {});  // reported above
+    currentUpload = upload;
+}
+
+// On submit, send the upload id instead of the whole file, once the chunks are in
+document.addEventListener('DOMContentLoaded', function () {
+    const form = document.querySelector('form');
+    form.addEventListener('submit', function(ev) {
+        const fileInput = document.getElementById('video_file');
+        if (!currentUpload || fileInput.disabled || fileInput.files.length === 0) {
+            return;
+        }
+        ev.preventDefault();
+        currentUpload.promise.then(id => {
+            localStorage.removeItem(uploadKey(currentUpload.file));
+            document.getElementById('upload_id').value = id;
+            fileInput.disabled = true;  // disabled inputs aren't posted
+            form.submit();
+        }).catch(() => {});
+    });
+});
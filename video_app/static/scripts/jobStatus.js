@@ -0,0 +1,82 @@
+// Follow the progress of the background job, go to results when it finishes.
+// Progress comes as Server-Sent Events from /jobs/<id>/events, with polling of /jobs/<id> as a fallback
+const jobId = document.getElementById('jobStatus').dataset.jobId;
+
+const stageNames = {
+    queued: 'Waiting for a free worker',
+    inference: 'Tracking objects',
+    thumbnails: 'Saving snapshots',
+    upload: 'Uploading results',
+    done: 'Done'
+};
+
+function formatSeconds(seconds) {
+    const minutes = Math.floor(seconds / 60);
+    const rest = Math.round(seconds % 60);
+    return minutes + ':' + (rest < 10 ? '0' : '') + rest;
+}
+
+function showProgress(job) {
+    const progress = job.progress || {stage: job.status === 'queued' ? 'queued' : 'inference'};
+    const bar = document.getElementById('progressBar');
+    document.getElementById('jobProgress').style.display = 'block';
+    document.querySelector('.processingMessage').style.display = 'none';
+    document.getElementById('progressStage').textContent = stageNames[progress.stage] || progress.stage;
+
+    const details = [];
+    if (progress.total_frames) {
+        bar.value = progress.percent;
+        details.push(progress.frames_done + ' / ' + progress.total_frames + ' frames (' + progress.percent + '%)');
+    } else {
+        bar.removeAttribute('value');  // indeterminate
+    }
+    if (progress.fps) {
+        details.push(progress.fps + ' fps');
+    }
+    if (progress.eta !== null && progress.eta !== undefined) {
+        details.push('~' + formatSeconds(progress.eta) + ' left');
+    }
+    document.getElementById('progressDetail').textContent = details.join(' · ');
+}
+
+function showResults() {
+    window.location.href = '/jobs/' + jobId + '/results';
+}
+
+function pollJobStatus() {
+    fetch('/jobs/' + jobId)
+        .then(response => response.json())
+        .then(job => {
+            if (job.status === 'done' || job.status === 'failed') {
+                showResults();
+            } else {
+                showProgress(job);
+                setTimeout(pollJobStatus, 2000);
+            }
+        })
+        .catch(error => {
+            console.error("Failed to fetch job status:", error);
+            setTimeout(pollJobStatus, 5000);
+        });
+}
+
+function followJobEvents() {
+    if (!window.EventSource) {
+        pollJobStatus();
+        return;
+    }
+    const events = new EventSource('/jobs/' + jobId + '/events');
+    events.addEventListener('progress', event => showProgress(JSON.parse(event.data)));
+    ['done', 'failed'].forEach(name => events.addEventListener(name, () => {
+        events.close();
+        showResults();
+    }));
+    events.onerror = () => {
+        // the browser reconnects by itself unless the stream was refused, e.g. 503 when the worker has too many
+        if (events.readyState === EventSource.CLOSED) {
+            pollJobStatus();
+        }
+    };
+}
+
+window.onload = followJobEvents;
@@ -1,3 +0,0 @@
-window.onload = function () {
-    document.getElementById('processingLink').click();
-};
\ No newline at end of file
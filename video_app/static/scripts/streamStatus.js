@@ -0,0 +1,64 @@
+// Poll the status of a live stream, show its counters and recently ended tracks
+const streamId = document.getElementById('streamStatus').dataset.streamId;
+
+function showRecentTracks(recent) {
+    const body = document.getElementById('recentTracks');
+    body.innerHTML = '';
+    // newest first
+    recent.slice().reverse().forEach(function(track) {
+        const row = document.createElement('tr');
+        ['track id', 'label', 'time enter', 'time exit', 'confidence'].forEach(function(column) {
+            const cell = document.createElement('td');
+            cell.textContent = track[column];
+            row.appendChild(cell);
+        });
+        const cell = document.createElement('td');
+        const image = document.createElement('img');
+        image.src = '/streams/' + streamId + '/images/' + encodeURIComponent(track.image);
+        image.alt = track.image;
+        image.className = 'streamThumbnail';
+        cell.appendChild(image);
+        row.appendChild(cell);
+        body.appendChild(row);
+    });
+}
+
+function pollStreamStatus() {
+    fetch('/streams/' + streamId)
+        .then(response => response.json())
+        .then(stream => {
+            document.getElementById('state').textContent = stream.state;
+            document.getElementById('framesProcessed').textContent = stream.frames_processed;
+            document.getElementById('framesDropped').textContent = stream.frames_dropped;
+            document.getElementById('inferenceFps').textContent = stream.inference_fps;
+            document.getElementById('latency').textContent = stream.latency;
+            document.getElementById('activeTracks').textContent = stream.active_tracks;
+            document.getElementById('tracksEnded').textContent = stream.tracks_ended;
+            showRecentTracks(stream.recent);
+
+            if (stream.error) {
+                document.getElementById('streamError').textContent = stream.error;
+                document.getElementById('streamError').style.display = 'block';
+            }
+            if (stream.state === 'stopped' || stream.state === 'failed') {
+                document.getElementById('stopStream').style.display = 'none';
+            } else {
+                setTimeout(pollStreamStatus, 2000);
+            }
+        })
+        .catch(error => {
+            console.error("Failed to fetch stream status:", error);
+            setTimeout(pollStreamStatus, 5000);
+        });
+}
+
+document.getElementById('stopStream').addEventListener('click', function() {
+    this.disabled = true;
+    fetch('/streams/' + streamId + '/stop', { method: 'POST' })
+        .catch(error => {
+            console.error("Failed to stop stream:", error);
+            this.disabled = false;
+        });
+});
+
+window.onload = pollStreamStatus;
@@ -9,6 +9,9 @@ document.querySelectorAll('input[name="uploadMethod"]').forEach(function(radio)
         document.getElementById('dropZone').style.display = 'none';
         document.getElementById('urlInputFieldHeader').style.display = 'none';
         document.getElementById('urlInputField').style.display = 'none';
+        document.getElementById('streamInputFieldHeader').style.display = 'none';
+        document.getElementById('streamInputField').style.display = 'none';
+        document.getElementById('streamInputField').value = "";
         document.getElementById('webcamHeader').style.display = 'none';
         document.getElementById('additionalOptions').style.display = 'none';
         document.getElementById('getResultsButton').style.display = 'none';
@@ -32,6 +35,12 @@ document.querySelectorAll('input[name="uploadMethod"]').forEach(function(radio)
             document.getElementById('urlInputField').value = "";
             document.getElementById('additionalOptions').style.display = 'block';
             document.getElementById('getResultsButton').style.display = 'block';
+        } else if (selectedMethod === 'streamURL') {
+            document.getElementById('streamInputField').style.display = 'block';
+            document.getElementById('streamInputFieldHeader').style.display = 'block';
+            document.getElementById('urlInputField').value = "";
+            document.getElementById('additionalOptions').style.display = 'block';
+            document.getElementById('getResultsButton').style.display = 'block';
         } else if (selectedMethod === 'useWebcam') {
             document.getElementById('webcamHeader').style.display = 'block';
             document.getElementById('urlInputField').value = "";
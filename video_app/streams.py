@@ -0,0 +1,351 @@
+from werkzeug.exceptions import BadRequest
+from urllib.parse import urlsplit
+
+import os
+import csv
+import json
+import time
+import uuid
+import logging
+import threading
+
+from video_app.lazy import lazy_import
+from video_app.models import load_model
+from video_app.utils import DetectionStore, FrameTracker, DETECTION_COLUMNS, detections_to_df, seconds_to_mmss
+
+logger = logging.getLogger('video_app')
+
+cv2 = lazy_import('cv2')
+
+# Frame rate assumed when a live source does not report one
+DEFAULT_STREAM_FPS = 30
+# Columns of the rolling summary csv, as in get_summary_df
+SUMMARY_COLUMNS = ['track id', 'label', 'time enter', 'time exit', 'confidence']
+# Recently ended tracks reported in the stream status
+RECENT_TRACKS = 20
+# Seconds between status.json updates
+STATUS_INTERVAL = 1.0
+
+
+# Live sources accepted from any host. http(s) sources must be on an allowed host (STREAM_ALLOWED_HOSTS)
+STREAM_SCHEMES = ['rtsp', 'rtsps']
+ALLOWLISTED_SCHEMES = ['http', 'https']
+
+
+def stream_url_validation(stream_url, allowed_hosts=()):
+    '''
+    Validates the user input for a live stream URL
+    Accepts: rtsp://, rtsps://, and http(s):// on one of allowed_hosts.
+    The server itself opens the URL, so other hosts could be internal services (SSRF)
+    '''
+    try:
+        url = urlsplit(stream_url)
+        host = url.hostname
+    except ValueError:
+        host = None
+    if not host or url.scheme not in STREAM_SCHEMES + ALLOWLISTED_SCHEMES:
+        raise BadRequest('Stream URL is invalid. Must begin with one of: '
+                         + ', '.join(f'{scheme}://' for scheme in STREAM_SCHEMES + ALLOWLISTED_SCHEMES))
+    if url.scheme in ALLOWLISTED_SCHEMES and host.lower() not in [h.lower() for h in allowed_hosts]:
+        raise BadRequest('Stream URL is invalid. HTTP streams are only accepted from allowed hosts, '
+                         'use an rtsp:// URL')
+
+
+def open_stream(url):
+    """
+    Opens a live source through FFmpeg, see benchmarks.local_rtsp for a local stand-in
+    """
+    cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # don't queue stale frames in the decoder
+    return cap
+
+
+class LatestFrame:
+    """
+    Single-slot handoff from the reader thread to inference.
+    A new frame replaces one that was not consumed yet, which is counted as dropped,
+    so latency stays bounded when inference falls behind the source.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, frame_num, frame):
+        with self._condition:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = (frame_num, frame, time.monotonic())
+            self._condition.notify()
+
+    def get(self, timeout=1.0):
+        '''
+        Returns (frame_num, frame, time read), or None on timeout / close
+        '''
+        with self._condition:
+            if self._item is None and not self.closed:
+                self._condition.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class StreamProcessor:
+    """
+    Processes one live source until stopped, in background threads.
+
+    Output in `folder`, updated as the stream runs:
+    - detections.csv: per-frame detections, appended every `chunk_frames` processed frames
+    - summary.csv: one row per track once it has ended (unseen for `track_timeout` frames)
+    - images/: a thumbnail per ended track, from its highest-confidence frame
+    - status.json: progress counters, read by the /streams routes in any worker
+
+    Memory stays bounded: a single pending frame, one chunk of detections,
+    and one thumbnail crop per active track.
+
+    model -- a loaded model to use instead of loading one, e.g. a stand-in
+    on_stop -- called with the processor once it has stopped
+    """
+
+    def __init__(self, stream_id, url, model_type, CLASSES, folder, backend='pytorch',
+                 chunk_frames=300, track_timeout=90, model=None, on_stop=None):
+        self.stream_id = stream_id
+        self.url = url
+        self.model_type = model_type
+        self.backend = backend
+        self.CLASSES = CLASSES
+        self.folder = folder
+        self.image_folder = os.path.join(folder, 'images')
+        self.chunk_frames = chunk_frames
+        self.track_timeout = track_timeout
+        self.model = model
+        self.on_stop = on_stop
+
+        self.slot = LatestFrame()
+        self.stopping = threading.Event()
+        self.fps = DEFAULT_STREAM_FPS
+        self.status = {'id': stream_id, 'url': url, 'state': 'starting', 'error': None,
+                       'frames_read': 0, 'frames_processed': 0, 'frames_dropped': 0,
+                       'detections': 0, 'active_tracks': 0, 'tracks_ended': 0,
+                       'inference_fps': 0.0, 'latency': 0.0, 'recent': []}
+        self.active = {}  # track_id: running summary of a track that is still in view
+        self.status_written = 0.0
+        os.makedirs(self.image_folder, exist_ok=True)
+
+    def start(self):
+        self._write_status()
+        threading.Thread(target=self._run, name=f'stream-{self.stream_id}', daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def stop_requested(self):
+        # a stop may come through any gunicorn worker, which leaves a marker file
+        return self.stopping.is_set() or os.path.exists(os.path.join(self.folder, 'stop'))
+
+    def _read(self, cap):
+        frame_num = 0
+        while not self.stopping.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                logger.error(f'Stream {self.stream_id}: lost the source')
+                break
+            frame_num += 1
+            self.status['frames_read'] = frame_num
+            self.slot.put(frame_num, frame)
+        self.slot.close()
+
+    def _run(self):
+        cap = None
+        reader = None
+        try:
+            model = self.model or load_model(self.model_type, self.backend)  # own instance for the stream's lifetime
+            self.labels = model.names
+            tracker = FrameTracker(model, self.CLASSES)
+            cap = open_stream(self.url)
+            if not cap.isOpened():
+                raise ValueError(f'Unable to open stream {self.url}')
+            self.fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_STREAM_FPS
+            reader = threading.Thread(target=self._read, args=(cap,), daemon=True)
+            reader.start()
+            self.status['state'] = 'running'
+
+            chunk = DetectionStore()
+            started = time.monotonic()
+            while not self.stop_requested():
+                item = self.slot.get()
+                if item is None:
+                    if self.slot.closed:
+                        break
+                    continue
+                frame_num, frame, read_at = item
+                boxes = tracker.update(frame)
+                chunk.append(boxes, frame_num)
+                self._update_tracks(frame_num, frame, boxes)
+
+                processed = self.status['frames_processed'] + 1
+                self.status.update(frames_processed=processed,
+                                   frames_dropped=self.slot.dropped,
+                                   latency=round(time.monotonic() - read_at, 3),
+                                   inference_fps=round(processed / (time.monotonic() - started), 2))
+                if processed % self.chunk_frames == 0:
+                    self._flush(chunk)
+                    chunk = DetectionStore()
+                if time.monotonic() - self.status_written > STATUS_INTERVAL:
+                    self._write_status()
+
+            self._flush(chunk)
+            self._end_tracks(None)
+            self.status['state'] = 'stopped'
+        except Exception as e:
+            logger.exception(f'Stream {self.stream_id} failed')
+            self.status.update(state='failed', error=str(e))
+        finally:
+            self.stopping.set()
+            self.slot.close()
+            if reader is not None:
+                reader.join(timeout=10)  # don't release the capture under a read
+            if cap is not None:
+                cap.release()
+            self._write_status()
+            if self.on_stop is not None:
+                self.on_stop(self)
+
+    def _update_tracks(self, frame_num, frame, boxes):
+        timestamp = frame_num / self.fps
+        for xmin, ymin, xmax, ymax, track_id, confidence, class_id in boxes:
+            track = self.active.get(track_id)
+            if track is None:
+                track = self.active[track_id] = {'class_id': int(class_id), 'enter': timestamp,
+                                                 'confidence': 0.0, 'thumbnail': None}
+            track['exit'] = timestamp
+            track['last_frame'] = frame_num
+            if confidence > track['confidence']:
+                track['confidence'] = float(confidence)
+                # keep only the box's neighbourhood, not the whole frame
+                height, width = frame.shape[:2]
+                margin_x, margin_y = (xmax - xmin) / 2, (ymax - ymin) / 2
+                x1, y1 = int(max(0, xmin - margin_x)), int(max(0, ymin - margin_y))
+                x2, y2 = int(min(width, xmax + margin_x)), int(min(height, ymax + margin_y))
+                crop = frame[y1:y2, x1:x2].copy()
+                if crop.size == 0:
+                    continue
+                cv2.rectangle(crop, (int(xmin) - x1, int(ymin) - y1),
+                              (int(xmax) - x1, int(ymax) - y1), (255, 255, 255), 2)
+                track['thumbnail'] = crop
+        self._end_tracks(frame_num)
+        self.status['active_tracks'] = len(self.active)
+
+    def _end_tracks(self, frame_num):
+        '''
+        Writes the summary row and thumbnail of tracks unseen for track_timeout frames,
+        or of every active track when frame_num is None (end of stream)
+        '''
+        ended = [track_id for track_id, track in self.active.items()
+                 if frame_num is None or frame_num - track['last_frame'] > self.track_timeout]
+        if not ended:
+            return
+        summary_path = os.path.join(self.folder, 'summary.csv')
+        new_file = not os.path.exists(summary_path)
+        with open(summary_path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(SUMMARY_COLUMNS)
+            for track_id in ended:
+                track = self.active.pop(track_id)
+                label = self.labels[track['class_id']]
+                row = [int(track_id), label, seconds_to_mmss(track['enter']),
+                       seconds_to_mmss(track['exit']), round(track['confidence'], 2)]
+                writer.writerow(row)
+                image = f"detection{int(track_id)}_{label}.jpg"
+                if track['thumbnail'] is not None:
+                    cv2.imwrite(os.path.join(self.image_folder, image), track['thumbnail'])
+                self.status['recent'] = (self.status['recent'] +
+                                         [dict(zip(SUMMARY_COLUMNS, row), image=image)])[-RECENT_TRACKS:]
+        self.status['tracks_ended'] += len(ended)
+
+    def _flush(self, chunk):
+        '''
+        Appends a chunk of detections to detections.csv
+        '''
+        df = detections_to_df(chunk, self.fps)
+        if df.empty:
+            return
+        csv_path = os.path.join(self.folder, 'detections.csv')
+        df.to_csv(csv_path, mode='a', index=False,
+                  header=not os.path.exists(csv_path), columns=DETECTION_COLUMNS)
+        self.status['detections'] += len(df)
+
+    def _write_status(self):
+        self.status_written = time.monotonic()
+        status_path = os.path.join(self.folder, 'status.json')
+        with open(status_path + '.tmp', 'w') as f:
+            json.dump(self.status, f)
+        os.replace(status_path + '.tmp', status_path)
+
+
+class StreamManager:
+    """
+    Starts and tracks the live streams processed by this process.
+    Processors are forgotten once stopped, their output stays on disk
+    """
+
+    def __init__(self, folder, max_streams):
+        self.folder = folder
+        self.max_streams = max_streams
+        self.streams = {}
+        self._lock = threading.Lock()
+
+    def start(self, url, model_type, CLASSES, backend='pytorch'):
+        '''
+        Starts processing a stream in the background, returns its id
+        '''
+        with self._lock:
+            running = [s for s in self.streams.values() if not s.stopping.is_set()]
+            if len(running) >= self.max_streams:
+                raise BadRequest(
+                    'Too many live streams are being processed. Please try again later.')
+            stream_id = uuid.uuid4().hex
+            processor = StreamProcessor(stream_id, url, model_type, CLASSES,
+                                        os.path.join(self.folder, stream_id), backend, on_stop=self._forget)
+            self.streams[stream_id] = processor
+        processor.start()
+        logger.info(f'Stream {stream_id} started for {url}')
+        return stream_id
+
+    def _forget(self, processor):
+        with self._lock:
+            self.streams.pop(processor.stream_id, None)
+
+    def stream_folder(self, stream_id):
+        '''
+        Returns the output folder of a stream, or None if there is no such stream
+        '''
+        folder = os.path.join(self.folder, os.path.basename(stream_id))
+        return folder if os.path.exists(os.path.join(folder, 'status.json')) else None
+
+    def status(self, stream_id):
+        folder = self.stream_folder(stream_id)
+        if folder is None:
+            return None
+        with open(os.path.join(folder, 'status.json')) as f:
+            return json.load(f)
+
+    def stop(self, stream_id):
+        '''
+        Asks a stream to stop, wherever it runs
+        '''
+        folder = self.stream_folder(stream_id)
+        if folder is None:
+            return False
+        open(os.path.join(folder, 'stop'), 'w').close()
+        processor = self.streams.get(stream_id)
+        if processor is not None:
+            processor.stop()
+        return True
@@ -0,0 +1,145 @@
+from werkzeug.exceptions import BadRequest, Conflict, NotFound
+from werkzeug.utils import secure_filename
+
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+
+from video_app.utils import has_allowed_extension, is_allowed_video_content
+
+logger = logging.getLogger('video_app')
+
+# Bytes read from the request per write, bounds memory per chunk request
+READ_SIZE = 1024 * 1024
+
+
+class ChunkedUploads:
+    """
+    Resumable video uploads in fixed-size chunks, sent in any order and in parallel.
+
+    Each upload has a folder with:
+    - upload.json: filename, size and chunk size
+    - data: the file, preallocated to its size, chunks are written at their offset
+    - chunks/<index>: marker written once a chunk is complete
+
+    State lives on disk only, so chunks of one upload can go through any gunicorn worker,
+    and a client can resume by asking which chunks are missing.
+    Chunk 0 is validated (MIME type) first; other chunks are refused until it has passed,
+    so files that aren't videos are rejected before the rest is transferred.
+    """
+
+    def __init__(self, folder, chunk_mb=8, max_mb=500):
+        self.folder = folder
+        self.chunk_size = chunk_mb * 1024 * 1024
+        self.max_bytes = max_mb * 1024 * 1024
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, upload_id, *parts):
+        return os.path.join(self.folder, os.path.basename(upload_id), *parts)
+
+    def _load(self, upload_id):
+        try:
+            with open(self._path(upload_id, 'upload.json')) as f:
+                return json.load(f)
+        except OSError:
+            raise NotFound('Upload not found')
+
+    def create(self, filename, size):
+        '''
+        Starts an upload after validating the file's name and size, returns its status
+        '''
+        if not filename:
+            raise BadRequest('Uploaded file has no name')
+        if not has_allowed_extension(filename):
+            raise BadRequest(
+                'Uploaded file is not an allowed video type. Accepted types: .mp4, .mov')
+        if size <= 0:
+            raise BadRequest('Uploaded file is empty')
+        if size > self.max_bytes:
+            raise BadRequest(
+                f'Uploaded file size exceeds the {self.max_bytes // (1024 * 1024)}MB limit')
+
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._path(upload_id, 'chunks'))
+        with open(self._path(upload_id, 'data'), 'wb') as f:
+            f.truncate(size)
+        with open(self._path(upload_id, 'upload.json'), 'w') as f:
+            json.dump({'id': upload_id, 'filename': filename, 'size': size,
+                       'chunk_size': self.chunk_size, 'created': time.time()}, f)
+        logger.info(f'Upload {upload_id} started: {filename}, {size} bytes')
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        '''
+        Returns the upload with the indexes of the chunks received so far
+        '''
+        upload = self._load(upload_id)
+        upload['chunks'] = -(-upload['size'] // upload['chunk_size'])
+        upload['received'] = sorted(int(name) for name in os.listdir(self._path(upload_id, 'chunks')))
+        upload['complete'] = len(upload['received']) == upload['chunks']
+        return upload
+
+    def write_chunk(self, upload_id, offset, length, stream):
+        '''
+        Writes the chunk starting at `offset`, read from `stream`, returns the chunk index
+        '''
+        upload = self._load(upload_id)
+        size, chunk_size = upload['size'], upload['chunk_size']
+        if offset < 0 or offset >= size or offset % chunk_size:
+            raise BadRequest(f'Chunk offset must be a multiple of {chunk_size} below {size}')
+        index = offset // chunk_size
+        if length != min(chunk_size, size - offset):
+            raise BadRequest(f'Chunk {index} must be {min(chunk_size, size - offset)} bytes')
+        if index and not os.path.exists(self._path(upload_id, 'chunks', '0')):
+            raise Conflict('The first chunk must be uploaded first')
+
+        remaining = length
+        head = b''
+        with open(self._path(upload_id, 'data'), 'r+b') as f:
+            f.seek(offset)
+            while remaining:
+                data = stream.read(min(READ_SIZE, remaining))
+                if not data:
+                    raise BadRequest(f'Chunk {index} ended early')
+                if index == 0 and not head:
+                    head = data[:2048]
+                    if not is_allowed_video_content(head):
+                        self.discard(upload_id)
+                        raise BadRequest(
+                            'Uploaded file is not an allowed video type. Accepted types: .mp4, .mov')
+                f.write(data)
+                remaining -= len(data)
+        open(self._path(upload_id, 'chunks', str(index)), 'w').close()
+        return index
+
+    def assemble(self, upload_id, VIDEO_FOLDER):
+        '''
+        Moves a complete upload into VIDEO_FOLDER, returns the video's path
+        '''
+        upload = self.status(upload_id)
+        if not upload['complete']:
+            raise BadRequest(
+                f"Upload is incomplete: {len(upload['received'])} of {upload['chunks']} chunks received")
+        video_path = os.path.join(VIDEO_FOLDER, secure_filename(upload['filename']))
+        shutil.move(self._path(upload_id, 'data'), video_path)
+        self.discard(upload_id)
+        return video_path
+
+    def expire(self, max_age):
+        '''
+        Discards uploads started more than max_age seconds ago and never submitted
+        '''
+        now = time.time()
+        for upload_id in os.listdir(self.folder):
+            try:
+                started = os.path.getmtime(self._path(upload_id))
+            except OSError:
+                continue  # discarded meanwhile
+            if now - started > max_age:
+                self.discard(upload_id)
+
+    def discard(self, upload_id):
+        shutil.rmtree(self._path(upload_id), ignore_errors=True)
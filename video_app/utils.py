@@ -1,27 +1,36 @@
-from flask import session, current_app, request, flash, redirect, url_for
+from flask import session, current_app, has_app_context, request, flash, redirect, url_for
 
 from werkzeug.exceptions import BadRequest
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
-from pytube import YouTube
 from dotenv import load_dotenv
-from botocore.exceptions import ClientError
-import boto3
-import pandas as pd
+from contextlib import contextmanager
 import numpy as np
 
-import cv2
 import os
 import logging
 import datetime
-import magic
-import isodate
+import time
 import re
-import requests
+
+from video_app.lazy import lazy_import
+from video_app.frames import FrameSource
+from video_app.metrics import DETECTIONS, FRAMES, FRAMES_SKIPPED, INFERENCE_FPS, timed
+from video_app.progress import Progress
+from video_app.s3 import S3Uploader
 
 logger = logging.getLogger('video_app')
 
+# Imported on first use, or by lazy.preload: light routes don't pay for them.
+# ultralytics is imported by FrameTracker
+pd = lazy_import('pandas')
+cv2 = lazy_import('cv2')
+magic = lazy_import('magic')
+isodate = lazy_import('isodate')
+pytube = lazy_import('pytube')
+requests = lazy_import('requests')
+
 
 def handle_selections(selections):
     '''
@@ -45,6 +54,25 @@ def handle_selections(selections):
     return classes
 
 
+# Inference strides offered in the upload form, 1 runs YOLO on every frame
+ALLOWED_STRIDES = [1, 2, 3, 5, 10]
+
+
+def handle_stride(selection):
+    '''
+    Takes the frame stride form selection (string)
+    returns it as an int, run inference on every `stride`-th frame
+    '''
+    try:
+        stride = int(selection)
+    except (TypeError, ValueError):
+        raise BadRequest('Frame stride must be a whole number')
+    if stride not in ALLOWED_STRIDES:
+        raise BadRequest(
+            f'Frame stride must be one of {ALLOWED_STRIDES}')
+    return stride
+
+
 def local_file_validation(uploaded_file):
     '''
     Validates the user input for video file local file upload (via dropZone)
@@ -96,7 +124,7 @@ def download_video_from_youtube(url: str, output_path) -> str:
     Download a video from YouTube using pytube
     Replace spaces with underscores in the filename
     """
-    video_filename = (YouTube(url).streams.filter(res='360p', file_extension='mp4',
+    video_filename = (pytube.YouTube(url).streams.filter(res='360p', file_extension='mp4',
                                                   type='video', progressive='False').first().download(output_path=output_path))
 
     # rename video file to remove spaces
@@ -108,20 +136,27 @@ def download_video_from_youtube(url: str, output_path) -> str:
     return new_path
 
 
+# allowed MIME types of uploaded videos
+ALLOWED_VIDEO_MIMETYPES = ['video/mp4', 'video/quicktime']
+
+
 def is_allowed_video(file: FileStorage) -> bool:
     """
     Check if the uploaded file is a valid video based on its MIME type.
     """
-    # allowed MIME types
-    allowed_mimetypes = ['video/mp4', 'video/quicktime']
-
     # read first 2 KB to determine MIME type
     file_content = file.stream.read(2048)
     file.stream.seek(0)  # reset the file stream so it can be saved later
 
-    mime = magic.from_buffer(file_content, mime=True)
+    return is_allowed_video_content(file_content)
 
-    return mime in allowed_mimetypes
+
+def is_allowed_video_content(file_content: bytes) -> bool:
+    """
+    Check if the first bytes of a file are those of an allowed video type.
+    """
+    mime = magic.from_buffer(file_content, mime=True)
+    return mime in ALLOWED_VIDEO_MIMETYPES
 
 
 def has_allowed_extension(filename):
@@ -132,6 +167,14 @@ def has_allowed_extension(filename):
     return ('.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions)
 
 
+def folder_size(folder):
+    """
+    Total size of the files under a folder in bytes
+    """
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(folder) for name in names)
+
+
 def get_frame_rate(VIDEO):
     """
     gets fps of uploaded video
@@ -142,6 +185,25 @@ def get_frame_rate(VIDEO):
     return fps
 
 
+def record_throughput(model_type, frames, seconds):
+    """
+    Counts the video frames of an inference run, and records its frames per second
+    """
+    FRAMES.labels(model_type).inc(frames)
+    if frames and seconds > 0:
+        INFERENCE_FPS.labels(model_type).observe(frames / seconds)
+
+
+def get_frame_count(VIDEO):
+    """
+    gets the number of frames of a video
+    """
+    cap = cv2.VideoCapture(VIDEO)
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return frames
+
+
 def extract_video_id(url):
     """ 
     Extracts the video id from a YouTube URL
@@ -171,67 +233,302 @@ def get_video_duration(video_id, api_key):
     return duration
 
 
-def get_df(list_results, VIDEO):
+class DetectionStore:
+    """
+    Compact, growing buffer of the per-frame boxes from YOLO results.
+    Each frame's (N,7) `boxes.data` is copied out as a small float32 array, so the
+    Results object (and the frame image it holds) can be dropped as soon as it is read.
+    Memory grows with the number of detections, not with video length or resolution.
+    """
+
+    def __init__(self):
+        self.frame_nums = []
+        self.blocks = []
+        self.num_frames = 0
+
+    def append(self, boxes, frame_num=None):
+        '''
+        Adds the boxes of the next frame. Frames are numbered from 1
+        '''
+        if frame_num is None:
+            frame_num = self.num_frames + 1
+        self.num_frames = max(self.num_frames, frame_num)
+        if len(boxes) == 0:
+            return  # nothing to keep for empty frames
+        self.frame_nums.append(frame_num)
+        self.blocks.append(np.array(boxes, dtype=np.float32))
+
+    def extend(self, frame_nums, boxes):
+        '''
+        Adds detections given row by row: a frame_num per row of the (N,7) boxes,
+        frames in increasing order
+        '''
+        frames, starts = np.unique(frame_nums, return_index=True)
+        for frame_num, block in zip(frames, np.split(boxes, starts[1:])):
+            self.append(block, int(frame_num))
+
+    def rows(self):
+        '''
+        Returns every detection row by row: (frame_num per row, (N,7) boxes)
+        '''
+        if not self.blocks:
+            return np.empty(0, dtype=np.int64), np.empty((0, 7), dtype=np.float32)
+        frame_nums = np.repeat(np.array(self.frame_nums, dtype=np.int64),
+                               [len(block) for block in self.blocks])
+        return frame_nums, np.concatenate(self.blocks)
+
+    def __iter__(self):
+        return zip(self.frame_nums, self.blocks)
+
+    def __len__(self):
+        return sum(len(block) for block in self.blocks)
+
+
+class MotionGate:
+    """
+    Tells static frames from frames worth running the detector on, for fixed cameras.
+
+    Frames are compared downscaled to `width` pixels, grayscale and blurred, against the
+    last frame that moved: a frame moved when more than `threshold` of its pixels changed by
+    more than `pixel_threshold` gray levels. Comparing against the last moving frame rather
+    than the previous one catches slow motion as it adds up; every `max_skip` static frames
+    in a row, a frame is passed on regardless, to catch up with changes of light.
+    """
+
+    def __init__(self, threshold=0.002, pixel_threshold=25, width=160, max_skip=50):
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.width = width
+        self.max_skip = max_skip
+        self.reference = None
+        self.static_run = 0
+        self.skipped = 0
+
+    def moved(self, frame):
+        '''
+        Whether the BGR frame changed since the last one that moved
+        '''
+        height = max(1, int(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if self.reference is not None and self.static_run < self.max_skip:
+            changed = np.count_nonzero(cv2.absdiff(small, self.reference) > self.pixel_threshold)
+            if changed <= self.threshold * small.size:
+                self.static_run += 1
+                self.skipped += 1
+                return False
+        self.reference = small
+        self.static_run = 0
+        return True
+
+
+# Largest stride of the YOLOv8 models: letterboxed frames are padded to a multiple of it
+LETTERBOX_STRIDE = 32
+
+
+class FrameTracker:
+    """
+    Detection + ByteTrack for one video, fed one frame at a time.
+    The tracker state lives here rather than on the model, so a model can be
+    shared and each video (or segment of a video) gets its own track state.
+    `update` returns the same (N,7) boxes `model.track` would for that frame.
+
+    With a MotionGate, static frames skip the detector and the tracker:
+    they are unchanged, so they keep the boxes of the last frame that moved.
+
+    `prepare` letterboxes a frame to the model's input size ahead of time, e.g. on a
+    FrameSource's decoder thread, the same way the model would before inference.
+    """
+
+    def __init__(self, model, CLASSES, conf=0.5, iou=0.5, tracker="bytetrack.yaml", motion_gate=None):
+        from ultralytics.data.augment import LetterBox
+        from ultralytics.trackers.byte_tracker import BYTETracker
+        from ultralytics.utils import IterableSimpleNamespace, yaml_load
+        from ultralytics.utils.checks import check_yaml
+
+        self.model = model
+        self.predict_args = dict(conf=conf, iou=iou, classes=CLASSES, verbose=False)
+        cfg = IterableSimpleNamespace(**yaml_load(check_yaml(tracker)))
+        self.tracker = BYTETracker(args=cfg, frame_rate=30)
+        self.motion_gate = motion_gate
+        self.last = np.empty((0, 7), dtype=np.float32)
+        imgsz = getattr(model, 'overrides', {}).get('imgsz') or 640
+        self.letterbox = LetterBox(imgsz if isinstance(imgsz, (list, tuple)) else (imgsz, imgsz),
+                                   auto=True, stride=LETTERBOX_STRIDE)
+
+    def prepare(self, frame):
+        '''
+        The frame letterboxed for the model: the model finds it at its input size and doesn't resize it again
+        '''
+        return self.letterbox(image=frame)
+
+    @property
+    def frames_skipped(self):
+        return self.motion_gate.skipped if self.motion_gate is not None else 0
+
+    def update(self, frame, prepared=None):
+        '''
+        Runs the model on a BGR frame, or on its `prepare`d version, and advances the tracker,
+        returns an (N,7) float32 array: xmin, ymin, xmax, ymax, track_id, confidence, class_id
+        '''
+        if self.motion_gate is not None and not self.motion_gate.moved(frame):
+            return self.last
+        if prepared is None:
+            boxes = self.model.predict(frame, **self.predict_args)[0].boxes.cpu().numpy()
+        else:
+            from ultralytics.engine.results import Boxes
+            from ultralytics.utils.ops import scale_boxes
+
+            # back from the letterboxed frame to the frame's coordinates
+            data = self.model.predict(prepared, **self.predict_args)[0].boxes.data.cpu().numpy().copy()
+            data[:, :4] = scale_boxes(prepared.shape[:2], data[:, :4], frame.shape[:2])
+            boxes = Boxes(data, frame.shape[:2])
+        if len(boxes) == 0:
+            self.last = np.empty((0, 7), dtype=np.float32)
+            return self.last
+        tracks = self.tracker.update(boxes, frame)
+        self.last = tracks[:, :7] if len(tracks) else np.empty((0, 7), dtype=np.float32)
+        return self.last
+
+
+def track_frames(tracker, VIDEO, store, first=1, last=None, stride=1, sharpness=None, progress=None):
+    """
+    Feeds frames first..last (None: to the end, the container's frame count can be short) of the video
+    to a FrameTracker, every `stride`-th frame of the video like vid_stride, and appends their boxes
+    to a DetectionStore. Frames are decoded and letterboxed ahead, while the model runs.
+    sharpness -- dict filled with {frame_num: frame_sharpness} of the tracked frames, if given
+    progress -- Progress of the job, advanced per frame
+    Returns the FrameSource, for its stats
     """
-    Takes results from YOLO model and returns a dataframe with the following columns:
-    xmin, ymin, xmax, ymax, track_id, confidence, class_id, frame_num
+    source = FrameSource(VIDEO, first=first, last=last, stride=stride, preprocess=tracker.prepare)
+    for frame_num, frame, prepared in source:
+        store.append(tracker.update(frame, prepared), frame_num)
+        if sharpness is not None:
+            sharpness[frame_num] = frame_sharpness(frame)
+        if progress is not None:
+            progress.update(frame_num)
+    return source
+
+
+# Column order of the per-frame detections table
+DETECTION_COLUMNS = ['frame_num', 'timestamp', 'xmin', 'ymin', 'xmax', 'ymax',
+                     'track_id', 'confidence', 'class_id']
+
+# Compact dtypes of the detections table on disk: ids as int32, the rest float32
+DETECTION_DTYPES = {'frame_num': 'int32', 'timestamp': 'float32',
+                    'xmin': 'float32', 'ymin': 'float32', 'xmax': 'float32', 'ymax': 'float32',
+                    'track_id': 'int32', 'confidence': 'float32', 'class_id': 'int32'}
+
+# File formats of the detections table, by extension. csv is kept for compatibility
+DETECTION_FORMATS = {'parquet': '.parquet', 'feather': '.feather', 'csv': '.csv'}
+
+# Rows per parquet row group / feather record batch, the unit of chunked reads
+DETECTION_CHUNK_ROWS = 65536
+
+
+def write_detections(df, path):
+    """
+    Writes the per-frame detections table with compact dtypes,
+    in the format given by the path's extension (see DETECTION_FORMATS)
+    """
+    df = df[DETECTION_COLUMNS].astype(DETECTION_DTYPES)
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False, row_group_size=DETECTION_CHUNK_ROWS)
+    elif path.endswith('.feather'):
+        df.to_feather(path, chunksize=DETECTION_CHUNK_ROWS)
+    elif path.endswith('.csv'):
+        df.to_csv(path, index=False)
+    else:
+        raise ValueError(f'Unknown detections format: {path}')
+    return path
+
+
+def get_df(detections, VIDEO):
+    """
+    Takes a DetectionStore of YOLO model results and returns a dataframe with the following columns:
+    frame_num, timestamp, xmin, ymin, xmax, ymax, track_id, confidence, class_id
     Each row is a detection from a frame frame_num
+
+    Built columnar: every frame's (N,7) block is concatenated once,
+    frame_num and timestamp are broadcast per block.
+    """
+    return detections_to_df(detections, get_frame_rate(VIDEO))
+
+
+def detections_to_df(detections, fps):
+    """
+    get_df for a known frame rate, e.g. of a live stream
     """
-    xmin = []
-    ymin = []
-    xmax = []
-    ymax = []
-    track_id = []
-    confidence = []
-    class_id = []
-    frame_num = []
-    timestamps = []
-
-    frame = 0
-
-    fps = get_frame_rate(VIDEO)
-
-    for frame_result in list_results:
-        frame += 1
-        for i in range(len(frame_result.boxes.data.numpy()[:])):
-            # Check if the detection is of length 7, (when it has low confidence it is outputting length 6)
-            if frame_result.boxes.data.numpy()[:][i].size == 7:
-                xmin.append(frame_result.boxes.data.numpy()
-                            [:][i][0])  # xmin
-                ymin.append(frame_result.boxes.data.numpy()
-                            [:][i][1])  # ymin
-                xmax.append(frame_result.boxes.data.numpy()
-                            [:][i][2])  # xmax
-                ymax.append(frame_result.boxes.data.numpy()
-                            [:][i][3])  # ymax
-                track_id.append(frame_result.boxes.data.numpy()
-                                [:][i][4])  # track_id
-                confidence.append(frame_result.boxes.data.numpy()[
-                    :][i][5])  # confidence
-                class_id.append(frame_result.boxes.data.numpy()
-                                [:][i][6])  # class_id
-                frame_num.append(frame)  # frame
-                timestamps.append(frame / fps)  # timestamp
-            else:
-                print("No detections in frame ", frame, " of lenght 7")
-                pass
-
-    # dict
-    data = {'frame_num': frame_num,
-            'timestamp': timestamps,
-            'xmin': xmin,
-            'ymin': ymin,
-            'xmax': xmax,
-            'ymax': ymax,
-            'track_id': track_id,
-            'confidence': confidence,
-            'class_id': class_id}
-
-    df = pd.DataFrame(data=data)
-    print("DataFrame created from model results")
+    # Untracked detections come out as (N,6) blocks without a track_id, drop them per block
+    frame_nums = []
+    blocks = []
+    untracked = 0
+    for frame, frame_boxes in detections:
+        if frame_boxes.shape[1] == 7:
+            frame_nums.append(frame)
+            blocks.append(frame_boxes)
+        else:
+            untracked += len(frame_boxes)
+    if untracked:
+        logger.info(f"Skipped {untracked} untracked detections (no track_id)")
+
+    if blocks:
+        data = np.concatenate(blocks)
+        frame_num = np.repeat(np.array(frame_nums, dtype=np.int64),
+                              [len(block) for block in blocks])
+    else:
+        data = np.empty((0, 7), dtype=np.float32)
+        frame_num = np.empty(0, dtype=np.int64)
+
+    df = pd.DataFrame(data, columns=DETECTION_COLUMNS[2:])
+    df.insert(0, 'frame_num', frame_num)
+    df.insert(1, 'timestamp', frame_num / fps)
+    logger.info("DataFrame created from model results")
     return df
 
 
+def interpolate_tracks(df, stride, fps):
+    """
+    Fills in the frames skipped by stride inference.
+    For each track, two consecutive detections at most `stride` frames apart
+    get linearly interpolated boxes and confidence for every frame in between.
+    Larger gaps (the track was lost on an inferred frame) are left as they are.
+    Returns a new dataframe with the same columns, ordered by frame_num
+    """
+    if stride <= 1 or df.empty:
+        return df
+
+    df = df.sort_values(['track_id', 'frame_num'], kind='stable')
+    track = df['track_id'].to_numpy()
+    frame = df['frame_num'].to_numpy()
+
+    # pairs of consecutive rows of the same track with skipped frames between them
+    gap = frame[1:] - frame[:-1]
+    pairs = np.flatnonzero(
+        (track[1:] == track[:-1]) & (gap > 1) & (gap <= stride))
+    if len(pairs) == 0:
+        return df.sort_values('frame_num', kind='stable').reset_index(drop=True)
+    missing = gap[pairs] - 1
+
+    # one new row per skipped frame: its left detection and distance from it
+    left = np.repeat(pairs, missing)
+    offset = np.arange(missing.sum()) - \
+        np.repeat(np.cumsum(missing) - missing, missing) + 1
+    weight = (offset / np.repeat(gap[pairs], missing))[:, None]
+
+    columns = ['xmin', 'ymin', 'xmax', 'ymax', 'confidence']
+    values = df[columns].to_numpy()
+    interpolated = pd.DataFrame(
+        values[left] + (values[left + 1] - values[left]) * weight, columns=columns).astype(df[columns].dtypes)
+    interpolated['frame_num'] = frame[left] + offset
+    interpolated['timestamp'] = interpolated['frame_num'] / fps
+    interpolated['track_id'] = track[left]
+    interpolated['class_id'] = df['class_id'].to_numpy()[left]
+
+    df = pd.concat([df, interpolated[DETECTION_COLUMNS]], ignore_index=True)
+    return df.sort_values('frame_num', kind='stable').reset_index(drop=True)
+
+
 def seconds_to_mmss(seconds):
     """
     Convert a float number of seconds into 'MM:SS' format.
@@ -277,121 +574,138 @@ def get_summary_df(df, labels):
     return summary_df
 
 
-def get_middle_frames(df, track_ids):
-    """ 
-    Returns a dict which stores {track_id: sought_frame} for each track_id in track_ids
-    """
-    middle_frames = {}
-    for track_id in track_ids:
-        first_frame_num = df.loc[df['track_id']
-                                 == track_id, 'frame_num'].min()
-        last_frame_num = df.loc[df['track_id']
-                                == track_id, 'frame_num'].max()
-        middle_frame_num = int((last_frame_num + first_frame_num) // 2)
+# Ways of choosing the representative frame of each track for its thumbnail
+FRAME_STRATEGIES = ['middle', 'confidence', 'area', 'sharpness']
+
 
-        sought_frame = (middle_frame_num - 1)
-        while (df.loc[(df['track_id'] == track_id) & (df['frame_num'] == sought_frame)].empty):
-            sought_frame += 1
+def frame_sharpness(image, width=320):
+    """
+    Variance of the Laplacian of a downscaled grayscale frame, higher is sharper
+    """
+    height = max(1, int(image.shape[0] * width / image.shape[1]))
+    small = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
 
-        middle_frames[track_id] = sought_frame
-    return middle_frames
 
+def get_middle_frames(df, track_ids, strategy='middle', sharpness=None):
+    """ 
+    Returns a dict which stores {track_id: sought_frame} for each track_id in track_ids
 
-def get_images(df, labels, VIDEO, middle_frames, IMAGE_FOLDER):
+    strategy -- one of FRAME_STRATEGIES:
+        'middle': first frame of the track at or after the middle of its lifetime
+        'confidence': frame with the highest confidence
+        'area': frame with the largest bounding box
+        'sharpness': sharpest frame, scored per frame_num in `sharpness` (see frame_sharpness)
+    All strategies are a single groupby over the detections of the tracks.
+    """
+    detections = df.loc[df['track_id'].isin(track_ids)]
+    by_track = detections.groupby('track_id')
+
+    if strategy == 'middle':
+        first_frame_num = by_track['frame_num'].transform('min')
+        last_frame_num = by_track['frame_num'].transform('max')
+        sought_frame = (last_frame_num + first_frame_num) // 2 - 1
+        sought = detections.loc[detections['frame_num'] >= sought_frame].groupby(
+            'track_id')['frame_num'].min()
+    else:
+        if strategy == 'confidence':
+            score = detections['confidence']
+        elif strategy == 'area':
+            score = (detections['xmax'] - detections['xmin']) * \
+                (detections['ymax'] - detections['ymin'])
+        elif strategy == 'sharpness':
+            if sharpness is None:
+                raise ValueError('sharpness strategy needs per-frame sharpness scores')
+            score = detections['frame_num'].map(sharpness).fillna(0)
+        else:
+            raise ValueError(
+                f'Unknown frame strategy {strategy!r}, expected one of {FRAME_STRATEGIES}')
+        best = score.groupby(detections['track_id']).idxmax()
+        sought = detections.loc[best.values].set_index('track_id')['frame_num']
+
+    return {track_id: int(frame_num) for track_id, frame_num in sought.items()}
+
+
+def get_images(df, labels, VIDEO, middle_frames, IMAGE_FOLDER, progress=None):
     """ 
     Takes middle frames dict and video file path to save images of middle frames per object
     with bounding boxes, labels, and confidence
+
+    Only the sought frames are decoded: they are visited in order, seeking or grabbing
+    past the frames in between, on a FrameSource's thread while the previous ones are drawn.
+    Returns the filenames of the images written
+    progress -- Progress of the job, advanced per frame decoded
     """
+    progress = progress or Progress()
+    written = []
     # read video
     try:
-        video = cv2.VideoCapture(VIDEO)
-        if not video.isOpened():
-            logger.error(f"Unable to open video file: {VIDEO}")
-            return
-        # frame rate
-        fps = video.get(cv2.CAP_PROP_FPS)
-
-        # open video stream
-        frame_counter = 0
-        while video.isOpened():
-            ret, frame = video.read()
-            if not ret:
-                break
-            frame_counter += 1
-
+        # Box of each (track_id, frame_num) pair, looked up once
+        targets = pd.DataFrame({'track_id': list(middle_frames.keys()),
+                                'frame_num': list(middle_frames.values())})
+        boxes = targets.merge(df, on=['track_id', 'frame_num'], how='inner').drop_duplicates(
+            ['track_id', 'frame_num'])
+
+        frames = boxes.groupby('frame_num', sort=True)
+        progress.start('thumbnails', frames.ngroups)
+        source = FrameSource(VIDEO, frame_nums=sorted(int(frame_num) for frame_num in frames.groups),
+                             stage='thumbnails')
+        for done, ((frame_num, frame_boxes), (_, frame, _)) in enumerate(zip(frames, source), start=1):
             # draw bounding boxes, labels, and confidence
-            for track_id in middle_frames.keys():
-                if frame_counter == middle_frames[track_id]:
-                    x1 = int(round(df.loc[(df['track_id'] == track_id) & (
-                        df['frame_num'] == middle_frames[track_id]), 'xmin'].iloc[0]))
-                    y1 = int(round(df.loc[(df['track_id'] == track_id) & (
-                        df['frame_num'] == middle_frames[track_id]), 'ymin'].iloc[0]))
-                    x2 = int(round(df.loc[(df['track_id'] == track_id) & (
-                        df['frame_num'] == middle_frames[track_id]), 'xmax'].iloc[0]))
-                    y2 = int(round(df.loc[(df['track_id'] == track_id) & (
-                        df['frame_num'] == middle_frames[track_id]), 'ymax'].iloc[0]))
-                    this_confidence = round(float(df.loc[(df['track_id'] == track_id) & (
-                        df['frame_num'] == middle_frames[track_id]), 'confidence'].iloc[0]), 3)
-                    this_class_id = int(round(df.loc[(df['track_id'] == track_id) & (
-                        df['frame_num'] == middle_frames[track_id]), 'class_id'].iloc[0]))
-
-                    # Labels for all 80 classes from `Detections.labels` via `model.names`
-                    this_label = labels[this_class_id]
-
-                    # Draw bounding box, label, and confidence
-                    frame_copy = frame.copy()
-                    cv2.rectangle(frame_copy, (x1, y1),
-                                  (x2, y2), (255, 255, 255), 2)
-
-                    # Write Image
-                    image_path = os.path.join(
-                        IMAGE_FOLDER, f"detection{int(track_id)}_{this_label}.jpg")
-                    cv2.imwrite(image_path, frame_copy)
-
-        video.release()
-        cv2.destroyAllWindows()
-        print('SUCCESSFULLY wrote images to: ', IMAGE_FOLDER)
+            for box in frame_boxes.itertuples(index=False):
+                x1, y1 = int(round(box.xmin)), int(round(box.ymin))
+                x2, y2 = int(round(box.xmax)), int(round(box.ymax))
+
+                # Labels for all 80 classes from `Detections.labels` via `model.names`
+                this_label = labels[int(round(box.class_id))]
+
+                # Draw bounding box, label, and confidence
+                frame_copy = frame.copy()
+                cv2.rectangle(frame_copy, (x1, y1),
+                              (x2, y2), (255, 255, 255), 2)
+
+                # Write Image
+                image_name = f"detection{int(box.track_id)}_{this_label}.jpg"
+                cv2.imwrite(os.path.join(IMAGE_FOLDER, image_name), frame_copy)
+                written.append(image_name)
+            progress.update(done)
+
+        source.close()
+        logger.info(f'Wrote {len(written)} images to {IMAGE_FOLDER}')
     except Exception as e:
-        logger.error(f"Error processing video {video}: {e}")
-    return os.listdir(IMAGE_FOLDER)
+        logger.error(f"Error processing video {VIDEO}: {e}")
+    return written
+
+
+@contextmanager
+def s3_uploader(bucket):
+    """
+    The app's shared S3Uploader if it uploads to bucket,
+    otherwise (e.g. outside the app) a short-lived one, closed after use
+    """
+    shared = getattr(current_app, 's3_uploader', None) if has_app_context() else None
+    if shared is not None and shared.bucket == bucket:
+        yield shared
+        return
+    uploader = S3Uploader(bucket, os.environ.get('S3_ENDPOINT_URL'))
+    try:
+        yield uploader
+    finally:
+        uploader.close()
 
 
 def upload_to_s3(file_name, bucket, object_name=None):
     """
-    Upload images and csv to S3 bucket
+    Upload images and csv to S3 bucket, with the shared client of this process
 
     :param file_name: File to upload
     :param bucket: Bucket to upload to
     :param object_name: S3 object name. If not specified then file_name is used
     :return: True if file was uploaded, else False
     """
-
-    AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
-    AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
-
-    # Determine the "folder" in which the file should be stored in the bucket
-    if file_name.endswith('.jpg'):
-        s3_folder = 'video-app-data/images/'
-    elif file_name.endswith('.csv'):
-        s3_folder = 'video-app-data/csvs/'
-    else:
-        s3_folder = ''
-
-    # If S3 object_name was not specified, use file_name
-    if object_name is None:
-        object_name = s3_folder + os.path.basename(file_name)
-    else:
-        object_name = s3_folder + object_name
-
-    # Upload the file
-    s3_client = boto3.client('s3', aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                             aws_access_key_id=AWS_ACCESS_KEY_ID)
-    try:
-        response = s3_client.upload_file(file_name, bucket, object_name)
-    except ClientError as e:
-        logger.error(e)
-        return False
-    return True
+    with s3_uploader(bucket) as uploader:
+        return uploader.upload(file_name, object_name)['ok']
 
 
 class Detections:
@@ -406,15 +720,21 @@ class Detections:
     and write images to a folder
     """
 
-    def __init__(self):
-        self.results = []
+    def __init__(self, frame_strategy='middle', model_type='', motion_threshold=0):
+        self.frame_strategy = frame_strategy
+        self.model_type = model_type  # labels the stage metrics
+        self.motion_threshold = motion_threshold  # see MotionGate, 0: every frame is detected
+        self.frames_skipped = 0
+        self.frame_source_stats = None  # how decoding kept up with inference, see FrameSource.stats
+        self.frame_sharpness = {}
+        self.detections = None
         self.df = None
         self.track_ids = None
         self.csv = None
         self.html = None
         self.labels = None
 
-    def process_video(self, model, VIDEO, CLASSES):
+    def process_video(self, model, VIDEO, CLASSES, stride=1, progress=None):
         '''
         Processes the user-input video with selected YOLOv8 Model.
         Called from /processing route.
@@ -423,31 +743,73 @@ class Detections:
         model -- selected from upload.html in additional options menu
         VIDEO -- provided by user on upload.html
         CLASSES -- Class names, vary with user selections upload.html
+        stride -- run inference on every `stride`-th frame, also from additional options.
+                  ByteTrack carries across the skipped frames, whose boxes are interpolated
+        progress -- Progress of the job, advanced per frame tracked
         '''
         try:
             logger.info('Video processing has begun')
-            self.results = list(model.track(source=VIDEO, conf=0.5, iou=0.5,
-                                classes=CLASSES, stream=True, tracker="bytetrack.yaml"))
-            self.df = get_df(self.results, VIDEO)
-            self.labels = model.names
-            self.summary_df = get_summary_df(self.df, self.labels)
-            self.track_ids = self.df['track_id'].unique()
-            self.csv = self.summary_df.to_csv(index=False)
-            self.html = self.summary_df.to_html(
-                classes='dataframe', index=False)
+            self.track(model, VIDEO, CLASSES, stride, progress)
+            self.summarize(VIDEO, model.names, stride)
             logger.info('Video processing has finished')
         except ValueError as e:
             logger.error(f'ValueError in process_video(): {e}')
         return
 
-    def write_images(self, VIDEO, IMAGE_FOLDER):
+    def track(self, model, VIDEO, CLASSES, stride=1, progress=None):
+        '''
+        Runs YOLO tracking over the video, filling self.detections
+        '''
+        progress = progress or Progress()
+        total_frames = get_frame_count(VIDEO)
+        progress.start('inference', total_frames)
+        # Consume the stream frame by frame, keeping only the boxes
+        self.detections = DetectionStore()
+        # Score frames while they are in hand, so picking the sharpest needs no second decode
+        score_sharpness = self.frame_strategy == 'sharpness'
+        started = time.perf_counter()
+        # frame by frame rather than model.track: frames are decoded ahead while the model runs,
+        # and with motion gating static frames skip the model
+        tracker = FrameTracker(model, CLASSES,
+                               motion_gate=MotionGate(self.motion_threshold) if self.motion_threshold else None)
+        with timed('inference', self.model_type):
+            source = track_frames(tracker, VIDEO, self.detections, stride=stride,
+                                  sharpness=self.frame_sharpness if score_sharpness else None, progress=progress)
+        self.frame_source_stats = source.stats()
+        record_throughput(self.model_type, total_frames, time.perf_counter() - started)
+        if self.motion_threshold:
+            self.frames_skipped = tracker.frames_skipped
+            FRAMES_SKIPPED.labels(self.model_type).inc(self.frames_skipped)
+            logger.info(f'Motion gating skipped {self.frames_skipped} of {total_frames} frames')
+
+    def summarize(self, VIDEO, labels, stride=1):
+        '''
+        Builds the detections table and summary from self.detections
+        '''
+        with timed('get_df', self.model_type):
+            self.df = get_df(self.detections, VIDEO)
+        DETECTIONS.labels(self.model_type).inc(len(self.df))
+        with timed('interpolate', self.model_type):
+            self.df = interpolate_tracks(self.df, stride, get_frame_rate(VIDEO))
+        self.labels = labels
+        with timed('summary', self.model_type):
+            self.summary_df = get_summary_df(self.df, self.labels)
+        self.track_ids = self.df['track_id'].unique()
+        self.csv = self.summary_df.to_csv(index=False)
+        self.html = self.summary_df.to_html(
+            classes='dataframe', index=False)
+
+    def write_images(self, VIDEO, IMAGE_FOLDER, progress=None):
         '''
-        Draws bounding boxes on a frame from the video
+        Draws bounding boxes on a frame from the video, returns the image filenames
         '''
         logger.info('Class Detections method write_images() has begun')
-        middle_frames = get_middle_frames(self.df, self.track_ids)
-        images = get_images(self.df, self.labels, VIDEO,
-                            middle_frames, IMAGE_FOLDER)
+        with timed('middle_frames', self.model_type):
+            middle_frames = get_middle_frames(self.df, self.track_ids,
+                                              self.frame_strategy, self.frame_sharpness)
+        with timed('thumbnails', self.model_type):
+            images = get_images(self.df, self.labels, VIDEO,
+                                middle_frames, IMAGE_FOLDER, progress)
         logger.info('images successfully written locally')
         return images
 
@@ -457,27 +819,32 @@ class Detections:
         '''
         filename = (str(VIDEO).split('/')[-1])[:-4] + '.csv'
         csv_path = os.path.join(CSV_FOLDER, filename)
-        with open(csv_path, 'w') as f:
+        with timed('csv_write', self.model_type), open(csv_path, 'w') as f:
             f.write(self.csv)
         logger.info('csv successfully written locally')
         return csv_path
 
+    def write_detections(self, CSV_FOLDER, VIDEO, format='parquet'):
+        '''
+        Writes the per-frame detections table to a folder, returns its path
+        format -- one of DETECTION_FORMATS
+        '''
+        if format not in DETECTION_FORMATS:
+            raise ValueError(f'Unknown detections format: {format}')
+        filename = (str(VIDEO).split('/')[-1])[:-4] + '_detections' + DETECTION_FORMATS[format]
+        with timed('detections_write', self.model_type):
+            path = write_detections(self.df, os.path.join(CSV_FOLDER, filename))
+        logger.info(f'detections table ({len(self.df)} rows) successfully written locally')
+        return path
+
     def write_all_to_s3(self, IMAGE_FOLDER, CSV_FOLDER, bucket):
         '''
         writes images and csvs to s3 Bucket
         '''
 
-        # Write images to s3
-        full_image_paths = [os.path.join(IMAGE_FOLDER, filename) for filename in os.listdir(
-            IMAGE_FOLDER) if os.path.isfile(os.path.join(IMAGE_FOLDER, filename))]
-        for image in full_image_paths:
-            upload_to_s3(image, bucket)
-        logger.info('images successfully written to s3 bucket')
-
-        # Write csv to s3
-        full_csv_paths = [os.path.join(CSV_FOLDER, filename) for filename in os.listdir(
-            CSV_FOLDER) if os.path.isfile(os.path.join(CSV_FOLDER, filename))]
-        for csv in full_csv_paths:
-            upload_to_s3(csv, bucket)
-        logger.info('csv successfully written to s3 bucket')
-        return
+        full_paths = [os.path.join(folder, filename) for folder in [IMAGE_FOLDER, CSV_FOLDER]
+                      for filename in os.listdir(folder) if os.path.isfile(os.path.join(folder, filename))]
+        with s3_uploader(bucket) as uploader:
+            report = uploader.upload_many(full_paths)
+        logger.info(f"{report['uploaded']} images and csvs written to s3 bucket, {report['failed']} failed")
+        return report
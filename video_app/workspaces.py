@@ -0,0 +1,142 @@
+from werkzeug.exceptions import NotFound
+
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+
+from video_app.utils import folder_size
+
+logger = logging.getLogger('video_app')
+
+# Job ids are uuid4().hex: anything else, e.g. '..', must not name a folder
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+class Workspace:
+    """
+    Folder holding one job's video, csv and thumbnails: <root>/videos, csvs, images
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.video_folder = os.path.join(root, 'videos')
+        self.csv_folder = os.path.join(root, 'csvs')
+        self.image_folder = os.path.join(root, 'images')
+
+    def create(self):
+        for folder in [self.video_folder, self.csv_folder, self.image_folder]:
+            os.makedirs(folder, exist_ok=True)
+        return self
+
+    def exists(self):
+        return os.path.isdir(self.root)
+
+    def remove(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def touch(self):
+        '''
+        Marks the workspace as used now, the janitor evicts by last use
+        '''
+        try:
+            os.utime(self.root)
+        except OSError:
+            pass
+
+
+class Workspaces:
+    """
+    Per-job workspaces under `folder`, one folder per job id.
+
+    `sweep` evicts workspaces unused for `ttl_hours`, then the least recently used ones
+    until the total size is under `quota_mb`. Workspaces of unfinished jobs are kept.
+    """
+
+    def __init__(self, folder, ttl_hours=24, quota_mb=5000):
+        self.folder = folder
+        self.ttl = ttl_hours * 3600
+        self.quota = quota_mb * 1024 * 1024
+        os.makedirs(folder, exist_ok=True)
+
+    def get(self, job_id):
+        '''
+        Returns the workspace of a job, which may not exist.
+        Raises NotFound for an invalid job id
+        '''
+        if not JOB_ID_PATTERN.fullmatch(job_id or ''):
+            raise NotFound('Job not found')
+        return Workspace(os.path.join(self.folder, job_id))
+
+    def create(self, job_id):
+        '''
+        Creates the workspace of a new job
+        '''
+        return self.get(job_id).create()
+
+    def sweep(self, is_active=lambda job_id: False):
+        '''
+        Evicts workspaces by age, then by disk quota, returns the number evicted.
+        is_active -- job_id: whether the job is still queued or running
+        '''
+        now = time.time()
+        workspaces = []
+        for job_id in os.listdir(self.folder):
+            root = os.path.join(self.folder, job_id)
+            try:
+                workspaces.append((os.path.getmtime(root), folder_size(root), job_id))
+            except OSError:
+                continue  # evicted by another worker meanwhile
+
+        evicted = 0
+        total = sum(size for _, size, _ in workspaces)
+        # least recently used first
+        for last_used, size, job_id in sorted(workspaces):
+            if now - last_used < self.ttl and total <= self.quota:
+                break
+            if is_active(job_id):
+                continue
+            shutil.rmtree(os.path.join(self.folder, job_id), ignore_errors=True)
+            total -= size
+            evicted += 1
+        if evicted:
+            logger.info(f'Janitor evicted {evicted} workspace(s), {total / 2**20:.0f} MB in use')
+        return evicted
+
+
+class Janitor:
+    """
+    Background thread sweeping workspaces and abandoned uploads every `interval` seconds.
+    Started on first use in each process, not in the gunicorn master before fork.
+    """
+
+    def __init__(self, workspaces, is_active, interval=600, uploads=None):
+        self.workspaces = workspaces
+        self.is_active = is_active
+        self.interval = interval
+        self.uploads = uploads
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='janitor', daemon=True).start()
+
+    def sweep(self):
+        self.workspaces.sweep(self.is_active)
+        if self.uploads is not None:
+            self.uploads.expire(self.workspaces.ttl)
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception('Janitor sweep failed')
+            time.sleep(self.interval)
+